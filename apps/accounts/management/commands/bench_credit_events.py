@@ -0,0 +1,57 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.accounts.services.credit import CreditEvent, apply_credit_event, apply_credit_events_bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark credit scoring: apply_credit_event per event vs apply_credit_events_bulk. "
+        "Creates and removes its own users/events"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200, help="Distinct users, default: 200")
+        parser.add_argument("--events", type=int, default=2000, help="Events per run, default: 2000")
+        parser.add_argument("--batch-size", type=int, default=500, help="Events per bulk call, default: 500")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        tag = uuid.uuid4().hex[:8]
+        n_users, n_events = max(1, options["users"]), max(1, options["events"])
+        batch_size = max(1, options["batch_size"])
+
+        users = [User.objects.create_user(username=f"bench-credit-{tag}-{i}", password=None) for i in range(n_users)]
+        try:
+            def workload(run):
+                return [
+                    {
+                        "user": users[i % n_users],
+                        "event_type": "order_completed" if i % 3 else "order_refunded",
+                        "party": "buyer",
+                        "ref_type": "bench",
+                        "ref_id": f"{tag}-{run}-{i}",
+                    }
+                    for i in range(n_events)
+                ]
+
+            started = time.perf_counter()
+            for e in workload("loop"):
+                apply_credit_event(**e)
+            loop = time.perf_counter() - started
+
+            started = time.perf_counter()
+            events = workload("bulk")
+            for i in range(0, n_events, batch_size):
+                apply_credit_events_bulk(events[i:i + batch_size])
+            bulk = time.perf_counter() - started
+
+            self.stdout.write(f"    loop: {n_events / loop:,.0f} events/s ({loop:.2f}s)")
+            self.stdout.write(f"    bulk: {n_events / bulk:,.0f} events/s ({bulk:.2f}s)")
+            self.stdout.write(self.style.SUCCESS(f"speedup: {loop / bulk:.1f}x"))
+        finally:
+            CreditEvent.objects.filter(user__in=users).delete()
+            User.objects.filter(id__in=[u.id for u in users]).delete()
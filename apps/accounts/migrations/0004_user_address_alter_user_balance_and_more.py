@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='address',
+            field=models.CharField(blank=True, help_text='默认收货/发货地址', max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=10000.0, help_text='平台账户余额，用于收款 / 退款等', max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='is_email_verified',
+            field=models.BooleanField(default=True, help_text='邮箱是否已通过验证'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='is_phone_verified',
+            field=models.BooleanField(default=True, help_text='手机号是否已通过验证'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('user', '普通用户'), ('admin', '管理员')], default='user', help_text='用户在平台中的角色类型', max_length=10),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Iterable, List, Mapping, Optional, Tuple
 
 from django.conf import settings
-from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, IntegerField, Value, When
 
 
 # CreditEvent 可能在 market.models（你当前项目里是订单域）
@@ -182,3 +184,106 @@ def apply_credit_event(
             score_after=score_after,
             level=credit_level(score_after),
         )
+
+
+def _clamp_score(score: int) -> int:
+    return max(0, min(MAX_CREDIT_SCORE, score))
+
+
+def apply_credit_events_bulk(events: Iterable[Mapping]) -> List[CreditResult]:
+    """批量写入积分事件，语义与逐条调用 apply_credit_event 相同（同样封顶、不为负、幂等）。
+
+    events 每项为 dict：user 或 user_id、event_type，可选 ref_type / ref_id / reason / party / manual_delta。
+    返回与输入顺序一一对应的 CreditResult；同一批里重复的事件只记第一次，其余 created=False。
+
+    一个事务、固定条数的查询：
+    - 按主键升序 select_for_update 锁定涉及的用户（与其它批次/单条调用加锁顺序一致，避免死锁）
+    - 一次查询取出已存在的 (user, event_type, ref_type, ref_id)（uniq_credit_event_user_type_ref 约束列）
+    - bulk_create 新事件；MySQL 的 bulk_create 不回填主键，再一次查询取回事件 id
+    - 一条 UPDATE ... CASE 写回所有用户的积分
+    """
+    specs = []
+    for e in events:
+        et = _normalize_event_type(e["event_type"])
+        user_id = e["user_id"] if "user_id" in e else e["user"].pk
+        specs.append((
+            (user_id, et, (e.get("ref_type") or "").strip(), str(e.get("ref_id") or "").strip()),
+            _compute_delta(et, party=e.get("party"), manual_delta=e.get("manual_delta")),
+            (e.get("reason") or "").strip(),
+        ))
+    if not specs:
+        return []
+
+    user_ids = sorted({key[0] for key, _, _ in specs})
+    keys = {key for key, _, _ in specs}
+    UserModel = get_user_model()
+
+    def _lookup():
+        rows = CreditEvent.objects.filter(
+            user_id__in=user_ids,
+            event_type__in={k[1] for k in keys},
+            ref_type__in={k[2] for k in keys},
+            ref_id__in={k[3] for k in keys},
+        ).values_list("user_id", "event_type", "ref_type", "ref_id", "id", "delta")
+        return {r[:4]: (r[4], int(r[5] or 0)) for r in rows if r[:4] in keys}
+
+    with transaction.atomic():
+        locked = UserModel.objects.select_for_update().filter(pk__in=user_ids).order_by("pk")
+        scores = dict(locked.values_list("pk", "credit_score"))
+        missing = set(user_ids) - set(scores)
+        if missing:
+            raise UserModel.DoesNotExist(f"users not found: {sorted(missing)}")
+        scores = {pk: int(v or 0) for pk, v in scores.items()}
+        existing = _lookup()
+
+        # 按输入顺序逐用户累计积分，与逐条调用的结果一致
+        planned, to_create, seen = [], [], set()
+        for key, delta, reason in specs:
+            user_id = key[0]
+            before = scores[user_id]
+            if key in existing or key in seen:
+                planned.append((key, False, delta, before, before))
+                continue
+            seen.add(key)
+            after = _clamp_score(before + delta)
+            scores[user_id] = after
+            planned.append((key, True, delta, before, after))
+            to_create.append(CreditEvent(
+                user_id=user_id, event_type=key[1], delta=delta, score_after=after,
+                ref_type=key[2], ref_id=key[3], reason=reason,
+            ))
+
+        ids = existing
+        if to_create:
+            CreditEvent.objects.bulk_create(to_create)
+            if connection.features.can_return_rows_from_bulk_insert:
+                ids = {
+                    **existing,
+                    **{(e.user_id, e.event_type, e.ref_type, e.ref_id): (e.pk, e.delta) for e in to_create},
+                }
+            else:
+                ids = _lookup()
+
+            # 积分相同的用户合并到同一个 WHEN，CASE 分支数 = 不同积分值个数
+            by_score = {}
+            for pk in {e.user_id for e in to_create}:
+                by_score.setdefault(scores[pk], []).append(pk)
+            UserModel.objects.filter(pk__in=[pk for pks in by_score.values() for pk in pks]).update(
+                credit_score=Case(
+                    *(When(pk__in=pks, then=Value(score)) for score, pks in by_score.items()),
+                    output_field=IntegerField(),
+                )
+            )
+
+    results = []
+    for key, created, delta, before, after in planned:
+        event_id, stored_delta = ids.get(key, (None, delta))
+        results.append(CreditResult(
+            created=created,
+            event_id=event_id,
+            delta=delta if created else stored_delta,
+            score_before=before,
+            score_after=after,
+            level=credit_level(after),
+        ))
+    return results
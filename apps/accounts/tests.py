@@ -1,3 +1,59 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from .services.credit import CreditEvent, apply_credit_event, apply_credit_events_bulk
+
+User = get_user_model()
+
+
+class CreditEventsBulkTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="x", credit_score=100)
+        self.bob = User.objects.create_user(username="bob", password="x", credit_score=118)
+
+    def events(self, ref_id):
+        return [
+            {"user": self.alice, "event_type": "order_completed", "ref_type": "order", "ref_id": ref_id},
+            {"user_id": self.bob.id, "event_type": "order_completed", "ref_type": "order", "ref_id": ref_id},
+            {"user": self.alice, "event_type": "refund", "party": "buyer", "ref_type": "order", "ref_id": ref_id},
+        ]
+
+    def test_matches_per_event_semantics(self):
+        results = apply_credit_events_bulk(self.events("1"))
+        self.assertEqual([r.created for r in results], [True, True, True])
+        self.assertEqual([(r.score_before, r.score_after) for r in results], [(100, 103), (118, 120), (103, 100)])
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.credit_score, self.bob.credit_score), (100, 120))
+        self.assertEqual(CreditEvent.objects.get(id=results[2].event_id).event_type, "order_refunded")
+
+        # 与单条 API 共用幂等键
+        single = apply_credit_event(user=self.bob, event_type="order_completed", ref_type="order", ref_id="1")
+        self.assertFalse(single.created)
+        self.assertEqual(single.event_id, results[1].event_id)
+
+    def test_idempotent_within_and_across_batches(self):
+        first = apply_credit_events_bulk(self.events("2") + self.events("2"))
+        self.assertEqual([r.created for r in first], [True, True, True, False, False, False])
+        self.assertEqual(first[3].event_id, first[0].event_id)
+
+        again = apply_credit_events_bulk(self.events("2"))
+        self.assertFalse(any(r.created for r in again))
+        self.assertEqual([r.event_id for r in again], [r.event_id for r in first[:3]])
+        self.assertEqual(CreditEvent.objects.count(), 3)
+
+    def test_constant_query_count(self):
+        events = [
+            {"user_id": u.id, "event_type": "order_completed", "ref_type": "order", "ref_id": str(i)}
+            for i in range(50)
+            for u in (self.alice, self.bob)
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            apply_credit_events_bulk(events)
+        statements = [q["sql"] for q in ctx.captured_queries if not q["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        self.assertLessEqual(len(statements), 5)
+        self.assertEqual(CreditEvent.objects.count(), 100)
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.credit_score, 120)
@@ -0,0 +1,180 @@
+"""草稿主图识别任务：进程内线程池异步执行 AIService.analyze_image，结果落 RecognitionResult。
+
+- 入队：上传主图后（事务提交时）即入队；analyze 接口只负责“确保有任务”+ 读结果，毫秒级返回
+- 去重：RecognitionResult 以 image 一对一，入队用 get_or_create 建 pending 行；
+  执行前用条件 UPDATE（pending -> running）抢占，多进程 / 重复点击都只会推理一次
+- 失败：标记 failed，再次点击 analyze 会重新入队
+- 取结果：轮询（GET analyze/）或长轮询（?wait=秒）；同进程内直接等 Future，跨进程按间隔查库
+- 内容去重：同内容（sha256）的图片复用已有结果，入队前 / 推理前各查一次 recognition_cache
+- 无需外部 broker；worker 数见 settings.ANALYSIS_WORKERS。进程退出时未完成的 pending / running 任务
+  会在下次 analyze 请求时重新入队（超过 STALE_SECONDS 未更新且本进程无对应 Future 视为丢失）
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .ai_service import AIService
+from .models import ProductImage, RecognitionResult
+from .recognition_cache import hash_file, recognition_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_WAIT_SECONDS = 10.0
+POLL_INTERVAL = 0.2
+STALE_SECONDS = 120
+
+_lock = threading.Lock()
+_executor = None
+_futures = {}  # image_id -> Future（仅本进程提交的任务）
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(getattr(settings, "ANALYSIS_WORKERS", 2)),
+                    thread_name_prefix="market-analysis",
+                )
+    return _executor
+
+
+def image_path(img: ProductImage) -> str:
+    return os.path.join(settings.MEDIA_ROOT, "products", img.image_name)
+
+
+def run_analysis(image_id: int) -> bool:
+    """执行一次识别；抢占失败（别的 worker 已在跑/已完成）返回 False。"""
+    claimed = RecognitionResult.objects.filter(
+        image_id=image_id, status=RecognitionResult.STATUS_PENDING
+    ).update(status=RecognitionResult.STATUS_RUNNING, updated_at=timezone.now())
+    if not claimed:
+        return False
+
+    try:
+        img = ProductImage.objects.only("id", "image_name", "content_hash").get(id=image_id)
+        content_hash = img.content_hash
+        if not content_hash:
+            # 旧数据：上传时没算 hash，这里补上
+            content_hash = hash_file(image_path(img))
+            ProductImage.objects.filter(id=image_id).update(content_hash=content_hash)
+
+        result = recognition_cache.get(content_hash)
+        if result is None:
+            result = AIService.analyze_image(image_path(img))
+            recognition_cache.put(content_hash, result)
+    except Exception as e:
+        logger.exception("image analysis failed: image_id=%s", image_id)
+        RecognitionResult.objects.filter(image_id=image_id).update(
+            status=RecognitionResult.STATUS_FAILED,
+            ok=False,
+            message=str(e)[:200],
+            updated_at=timezone.now(),
+        )
+        return True
+
+    _save_result(image_id, content_hash, result)
+    return True
+
+
+def _save_result(image_id: int, content_hash: str, result: dict, **filters) -> int:
+    return RecognitionResult.objects.filter(image_id=image_id, **filters).update(
+        status=RecognitionResult.STATUS_DONE,
+        ok=True,
+        content_hash=content_hash,
+        grade_label=result["label"],
+        grade_score=result["score"],
+        defects=result["defects"],
+        confidence=result["score"] / 100,
+        message="",
+        updated_at=timezone.now(),
+    )
+
+
+def _job(image_id: int):
+    close_old_connections()
+    try:
+        return run_analysis(image_id)
+    finally:
+        close_old_connections()
+        with _lock:
+            _futures.pop(image_id, None)
+
+
+def _submit(image_id: int):
+    with _lock:
+        fut = _futures.get(image_id)
+        if fut is not None:
+            return fut
+    if getattr(settings, "ANALYSIS_RUN_INLINE", False):
+        # 调试/测试：同步执行，不起线程
+        run_analysis(image_id)
+        return None
+    fut = _get_executor().submit(_job, image_id)
+    with _lock:
+        _futures.setdefault(image_id, fut)
+    return fut
+
+
+def enqueue_analysis(image_id: int, retry_failed: bool = True) -> RecognitionResult:
+    """确保该图片有识别任务：已完成/进行中直接返回；没有或丢失（retry_failed 时含失败）则（重新）入队。
+
+    提交到线程池放在事务提交之后，worker 才能看到 pending 行。
+    """
+    rec, created = RecognitionResult.objects.get_or_create(image_id=image_id)
+    if not created:
+        # pending 没人接 / running 的 worker 已死（进程退出、线程异常退出）：本进程没有对应 Future 且久未更新
+        stale = (
+            rec.status in (RecognitionResult.STATUS_PENDING, RecognitionResult.STATUS_RUNNING)
+            and image_id not in _futures
+            and rec.updated_at < timezone.now() - timedelta(seconds=STALE_SECONDS)
+        )
+        if (retry_failed and rec.status == RecognitionResult.STATUS_FAILED) or stale:
+            requeued = RecognitionResult.objects.filter(id=rec.id, status=rec.status).update(
+                status=RecognitionResult.STATUS_PENDING, message="", updated_at=timezone.now()
+            )
+            if not requeued:
+                return rec
+            rec.status = RecognitionResult.STATUS_PENDING
+        else:
+            return rec
+
+    # 内容已识别过：直接落结果，不进队列
+    content_hash = ProductImage.objects.filter(id=image_id).values_list("content_hash", flat=True).first()
+    result = recognition_cache.get(content_hash)
+    if result is not None and _save_result(image_id, content_hash, result, status=RecognitionResult.STATUS_PENDING):
+        rec.refresh_from_db()
+        return rec
+
+    transaction.on_commit(lambda: _submit(image_id))
+    return rec
+
+
+def wait_for_result(image_id: int, timeout: float) -> RecognitionResult:
+    """长轮询：最多等 timeout 秒，返回最新的 RecognitionResult。"""
+    timeout = max(0.0, min(timeout, MAX_WAIT_SECONDS))
+    deadline = time.monotonic() + timeout
+
+    fut = _futures.get(image_id)
+    if fut is not None and timeout:
+        try:
+            fut.result(timeout=timeout)
+        except Exception:  # 超时或 worker 异常：以库里的状态为准
+            pass
+
+    while True:
+        rec = RecognitionResult.objects.get(image_id=image_id)
+        if rec.status in (RecognitionResult.STATUS_DONE, RecognitionResult.STATUS_FAILED):
+            return rec
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return rec
+        time.sleep(min(POLL_INTERVAL, remaining))
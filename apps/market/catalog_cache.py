@@ -0,0 +1,135 @@
+"""类目 / 品牌 / 型号等近静态目录数据的版本化缓存。
+
+- 目录版本号（catalog version）存于 CatalogVersion 单行表，取值为毫秒时间戳：
+  写入（见 signals.py）与 import_zol_products / seed_devices 在写目录的同一事务里 bump，
+  提交即对所有进程（Web worker、管理命令）可见，回滚则一起撤销
+- 读版本：进程内记住最近读到的值，超过 CATALOG_VERSION_CHECK_SECONDS 才再查一次库（主键单行），
+  其他进程的写入最多这么久后可见；本进程 bump 后立即重读
+- 响应数据按 (版本, 接口, 查询参数) 缓存；版本变化后旧 key 自然失效，无需逐个删除
+- ETag 由同样的三元组计算，Last-Modified 取版本时间；命中 If-None-Match / If-Modified-Since 直接 304，
+  连缓存数据都不用读
+- 响应数据缓存在默认 cache（LocMem 时各进程各一份），key 带版本号，所以不会读到旧版本的数据
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BigIntegerField, F, Value
+from django.db.models.functions import Greatest
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from .models import CatalogVersion
+
+VERSION_ROW_ID = 1
+
+# 进程内最近读到的 (版本, time.monotonic())；元组整体替换，多线程读写无需加锁
+_seen = (None, 0.0)
+
+
+def _timeout() -> int:
+    return int(getattr(settings, "CATALOG_CACHE_TIMEOUT", 300))
+
+
+def _check_interval() -> float:
+    return float(getattr(settings, "CATALOG_VERSION_CHECK_SECONDS", 1.0))
+
+
+def _read_version() -> int:
+    version = CatalogVersion.objects.filter(pk=VERSION_ROW_ID).values_list("version", flat=True).first()
+    if version is None:
+        # 新库 / 表被清空：以当前时间起一个版本，并发创建时以先写入的为准
+        row, _ = CatalogVersion.objects.get_or_create(pk=VERSION_ROW_ID, defaults={"version": int(time.time() * 1000)})
+        version = row.version
+    return int(version)
+
+
+def get_catalog_version() -> int:
+    global _seen
+    version, checked_at = _seen
+    now = time.monotonic()
+    if version is None or now - checked_at >= _check_interval():
+        version = _read_version()
+        _seen = (version, now)
+    return version
+
+
+def bump_catalog_version():
+    """在调用方事务里 bump 版本（单调递增，且不小于当前毫秒时间戳）。"""
+    global _seen
+    now_ms = Value(int(time.time() * 1000), output_field=BigIntegerField())
+    if not CatalogVersion.objects.filter(pk=VERSION_ROW_ID).update(version=Greatest(F("version") + 1, now_ms)):
+        _read_version()
+        CatalogVersion.objects.filter(pk=VERSION_ROW_ID).update(version=Greatest(F("version") + 1, now_ms))
+    # 不直接记住新值：事务回滚后应回到库里的版本，下次读取时重新查
+    _seen = (None, 0.0)
+
+
+def version_datetime(version: int) -> datetime:
+    return datetime.fromtimestamp(version / 1000, tz=dt_timezone.utc)
+
+
+def _scope_key(scope: str, request) -> str:
+    params = "&".join(f"{k}={','.join(sorted(v))}" for k, v in sorted(request.query_params.lists()))
+    return f"{scope}?{params}"
+
+
+def _not_modified(request, etag: str, last_modified: int) -> bool:
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return "*" in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE") or "")
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def cached_catalog_response(request, scope: str, build) -> Response:
+    """目录接口通用包装：build() 返回可序列化数据（仅缓存未命中时调用）。"""
+    version = get_catalog_version()
+    scope_key = _scope_key(scope, request)
+    etag = quote_etag(hashlib.md5(f"{version}:{scope_key}".encode("utf-8")).hexdigest())
+    last_modified = version // 1000
+
+    if _not_modified(request, etag, last_modified):
+        resp = Response(status=304)
+    else:
+        key = f"market:catalog:{version}:{hashlib.md5(scope_key.encode('utf-8')).hexdigest()}"
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, timeout=_timeout())
+        resp = Response(data)
+
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(last_modified)
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+class CatalogCacheMixin:
+    """给只读目录 ViewSet 的 list / retrieve 加上版本化缓存与 ETag。"""
+
+    catalog_scope = ""
+
+    def list(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request,
+            f"{self.catalog_scope}:list",
+            lambda: _plain(super(CatalogCacheMixin, self).list(request, *args, **kwargs).data),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request,
+            f"{self.catalog_scope}:{kwargs.get(self.lookup_url_kwarg or self.lookup_field)}",
+            lambda: _plain(super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs).data),
+        )
+
+
+def _plain(data):
+    # ReturnList / ReturnDict 携带 serializer 引用，转成普通容器再入缓存
+    if isinstance(data, list):
+        return [dict(item) for item in data]
+    return dict(data)
@@ -0,0 +1,183 @@
+"""订单积分事件 outbox：订单状态流转不再同步记积分。
+
+- 入队：OrderStateMachine / 超时取消在改订单状态的同一事务里写 CreditOutbox 行，
+  状态改了就一定有待记积分，事务回滚则一起消失；请求路径不再锁用户行
+- 执行：事务提交后触发本进程的单线程 worker 立即处理（settings.CREDIT_OUTBOX_RUN_INLINE 为真时同步执行，
+  测试用）；drain_credit_outbox 命令（--every）兜底处理其它进程遗留的行和待重试的行
+- 每批：select_for_update(skip_locked) 取到期的行，一次查出订单买家/卖家，整批 apply_credit_events_bulk；
+  整批失败时逐行重试以隔离坏行，失败行 attempts+1 并按指数退避推迟，超过 MAX_ATTEMPTS 不再自动重试
+- 幂等：CreditEvent 以 (user, event_type, "order", order_id) 唯一，重复处理同一行不会重复记分
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.accounts.services.credit import apply_credit_events_bulk
+
+from .models import CreditOutbox, Order
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 3600
+
+# 事件 -> 记分方 (角色, party)
+CREDIT_RULES = {
+    "order_completed": (("buyer", None), ("seller", None)),
+    "order_refunded": (("buyer", "buyer"), ("seller", "seller")),
+    "payment_cancelled": (("buyer", None),),
+}
+
+_lock = threading.Lock()
+_executor = None
+_scheduled = False
+
+
+@dataclass
+class DrainStats:
+    processed: int = 0
+    failed: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def enqueue_order_credit(order_ids, event_type: str):
+    """在调用方事务里写 outbox 行（已有的同订单同事件忽略），提交后触发 worker。"""
+    if event_type not in CREDIT_RULES:
+        raise ValueError(f"unsupported event_type: {event_type}")
+    now = timezone.now()
+    CreditOutbox.objects.bulk_create(
+        [CreditOutbox(order_id=oid, event_type=event_type, next_attempt_at=now) for oid in order_ids],
+        ignore_conflicts=True,
+    )
+    # robust：worker 触发失败只记日志，不影响已提交的请求，行留在 outbox 由命令兜底
+    transaction.on_commit(kick, robust=True)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="credit-outbox")
+    return _executor
+
+
+def _job():
+    global _scheduled
+    with _lock:
+        _scheduled = False
+    close_old_connections()
+    try:
+        drain_credit_outbox()
+    except Exception:
+        logger.exception("credit outbox drain failed")
+    finally:
+        close_old_connections()
+
+
+def kick():
+    """让本进程 worker 尽快处理一轮；已排队的一轮未开始时不重复排队。"""
+    global _scheduled
+    if getattr(settings, "CREDIT_OUTBOX_RUN_INLINE", False):
+        # 调试/测试：同步执行，不起线程
+        drain_credit_outbox()
+        return
+    with _lock:
+        if _scheduled:
+            return
+        _scheduled = True
+    _get_executor().submit(_job)
+
+
+def _events_for(event_type, order_id, parties):
+    buyer_id, seller_id = parties[order_id]
+    for role, party in CREDIT_RULES[event_type]:
+        yield {
+            "user_id": buyer_id if role == "buyer" else seller_id,
+            "event_type": event_type,
+            "party": party,
+            "ref_type": "order",
+            "ref_id": str(order_id),
+        }
+
+
+def _apply(rows, parties):
+    events = [e for _, order_id, event_type, _ in rows for e in _events_for(event_type, order_id, parties)]
+    with transaction.atomic():
+        apply_credit_events_bulk(events)
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempts))
+
+
+def drain_credit_outbox(batch_size=500, max_attempts=MAX_ATTEMPTS, log=None) -> DrainStats:
+    started = time.perf_counter()
+    stats = DrainStats()
+
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            rows = list(
+                CreditOutbox.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True, next_attempt_at__lte=now, attempts__lt=max_attempts)
+                .order_by("id")
+                .values_list("id", "order_id", "event_type", "attempts")[:batch_size]
+            )
+            if not rows:
+                break
+            parties = {
+                oid: (buyer_id, seller_id)
+                for oid, buyer_id, seller_id in Order.objects.filter(id__in={r[1] for r in rows}).values_list(
+                    "id", "buyer_id", "product__seller_id"
+                )
+            }
+
+            done, failed = [], []
+            try:
+                _apply(rows, parties)
+                done = rows
+            except Exception:
+                # 整批失败：逐行重试，只让坏行进入退避
+                for row in rows:
+                    try:
+                        _apply([row], parties)
+                        done.append(row)
+                    except Exception as e:
+                        logger.warning("credit outbox row %s failed: %s", row[0], e)
+                        failed.append((row, e))
+
+            CreditOutbox.objects.filter(id__in=[r[0] for r in done]).update(processed_at=now, last_error="")
+            for (row_id, _, _, attempts), e in failed:
+                CreditOutbox.objects.filter(id=row_id).update(
+                    attempts=F("attempts") + 1,
+                    last_error=f"{type(e).__name__}: {e}"[:255],
+                    next_attempt_at=now + _backoff(attempts),
+                )
+
+        stats.batches += 1
+        stats.processed += len(done)
+        stats.failed += len(failed)
+        if log:
+            log(f"batch {stats.batches}: processed={stats.processed} failed={stats.failed}")
+
+    stats.seconds = time.perf_counter() - started
+    return stats
@@ -0,0 +1,160 @@
+"""被放弃的上架草稿图片回收（gc_draft_images 命令调用）。
+
+判定：product 为空、且所在草稿（uploaded_by + draft_key）最近一张图也早于 cutoff，视为整个草稿已放弃；
+只要草稿里还有 cutoff 之后上传的图，整份草稿都不动。
+
+与上传并发时的安全性：
+- 删行按 id 分批，每批在事务里加锁并重新校验 product 为空 / 早于 cutoff，发布时刚绑定的图不会被删
+- 磁盘文件按内容 hash 命名、可被多条记录共用：删行后只删已无任何记录引用的文件；
+  上传复用已有文件时会刷新其 mtime（store_upload），mtime 晚于 cutoff 的文件一律跳过，
+  避免“检查引用之后、新记录提交之前”把文件删掉
+- 残留的上传临时文件（.upload-*.tmp）早于 cutoff 也一并清理
+- 上传失败/超额时请求本身不删已落盘的文件（可能正被并发上传复用），
+  这类无任何记录引用的内容 hash 文件（<hash>.jpg 及其缩略图）早于 cutoff 时在这里回收
+- 过期的草稿状态行（ListingDraft，按 DRAFT_SESSION_TTL）一并删除
+"""
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .drafts import purge_expired_drafts
+from .imaging import THUMB_SIZES, thumb_name
+from .models import ProductImage
+
+
+@dataclass
+class GCStats:
+    dry_run: bool = False
+    rows: int = 0
+    drafts: set = field(default_factory=set)
+    files: int = 0
+    bytes: int = 0
+    skipped_files: int = 0
+    sessions: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self):
+        elapsed = self.seconds or 1e-9
+        return {
+            "dry_run": self.dry_run,
+            "drafts": len(self.drafts),
+            "rows": self.rows,
+            "files": self.files,
+            "bytes": self.bytes,
+            "skipped_files": self.skipped_files,
+            "sessions": self.sessions,
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": round(self.rows / elapsed, 1),
+            "files_per_sec": round(self.files / elapsed, 1),
+        }
+
+
+def stale_draft_images(cutoff):
+    """被放弃草稿里的图片（product 为空，且同草稿没有 cutoff 之后的图）。"""
+    newer_in_draft = ProductImage.objects.filter(
+        product__isnull=True,
+        uploaded_by=OuterRef("uploaded_by"),
+        draft_key=OuterRef("draft_key"),
+        created_at__gte=cutoff,
+    )
+    return ProductImage.objects.filter(product__isnull=True, created_at__lt=cutoff).filter(~Exists(newer_in_draft))
+
+
+# store_upload 落盘的文件名：sha256 前 32 位 + .jpg，缩略图为 <hash>_<尺寸>.webp
+_UPLOAD_NAME = re.compile(r"^([0-9a-f]{32})(?:\.jpg|_(?:%s)\.webp)$" % "|".join(map(re.escape, THUMB_SIZES)))
+_REF_CHUNK = 1000
+
+
+def _orphan_upload_files(folder):
+    """目录里没有任何 ProductImage 引用的上传文件（按内容 hash 文件名识别，其他文件不碰）。"""
+    by_image = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            m = _UPLOAD_NAME.match(entry.name)
+            if m:
+                by_image.setdefault(m.group(1) + ".jpg", []).append(entry.name)
+    names = list(by_image)
+    for i in range(0, len(names), _REF_CHUNK):
+        chunk = names[i:i + _REF_CHUNK]
+        for used in ProductImage.objects.filter(image_name__in=chunk).values_list("image_name", flat=True):
+            by_image.pop(used, None)
+    return [n for files in by_image.values() for n in files]
+
+
+def _file_names(image_name):
+    return [image_name, *(thumb_name(image_name, size) for size in THUMB_SIZES)]
+
+
+def _unlink(folder, name, cutoff_ts, dry_run):
+    """返回 (删除字节数, 是否删除)；文件不存在或在宽限期内返回 (0, False)。"""
+    path = os.path.join(folder, name)
+    try:
+        st = os.stat(path)
+        if st.st_mtime >= cutoff_ts:
+            return 0, False
+        if not dry_run:
+            os.remove(path)
+        return st.st_size, True
+    except FileNotFoundError:
+        return 0, False
+
+
+def _unlink_all(pool, folder, names, cutoff_ts, dry_run, stats):
+    for size, removed in pool.map(lambda n: _unlink(folder, n, cutoff_ts, dry_run), names):
+        if removed:
+            stats.files += 1
+            stats.bytes += size
+        else:
+            stats.skipped_files += 1
+
+
+def collect_draft_images(folder, cutoff, batch_size=500, workers=8, dry_run=False, log=None) -> GCStats:
+    started = time.perf_counter()
+    stats = GCStats(dry_run=dry_run)
+    cutoff_ts = cutoff.timestamp()
+    qs = stale_draft_images(cutoff)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    qs.select_for_update()
+                    .filter(id__gt=last_id)
+                    .order_by("id")
+                    .values_list("id", "uploaded_by_id", "draft_key", "image_name")[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                if not dry_run:
+                    ProductImage.objects.filter(id__in=[r[0] for r in rows]).delete()
+
+            stats.rows += len(rows)
+            stats.drafts.update((r[1], r[2]) for r in rows)
+
+            # 只删已无记录引用的文件（dry-run 时本批记录还在，排除掉它们自己再判断）
+            names = {r[3] for r in rows}
+            still_used = ProductImage.objects.filter(image_name__in=names)
+            if dry_run:
+                still_used = still_used.exclude(id__in=[r[0] for r in rows])
+            names -= set(still_used.values_list("image_name", flat=True))
+            _unlink_all(pool, folder, [n for name in names for n in _file_names(name)], cutoff_ts, dry_run, stats)
+
+            if log:
+                log(f"batch up to id={last_id}: rows={stats.rows} files={stats.files}")
+
+        if os.path.isdir(folder):
+            tmp_files = [n for n in os.listdir(folder) if n.startswith(".upload-") and n.endswith(".tmp")]
+            _unlink_all(pool, folder, tmp_files, cutoff_ts, dry_run, stats)
+            # dry-run 时本次“将删除”的行还在，其文件会被当作仍被引用，统计偏少但不误删
+            _unlink_all(pool, folder, _orphan_upload_files(folder), cutoff_ts, dry_run, stats)
+
+    stats.sessions = purge_expired_drafts(batch_size, dry_run=dry_run)
+    stats.seconds = time.perf_counter() - started
+    return stats
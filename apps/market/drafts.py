@@ -0,0 +1,76 @@
+"""上架草稿的服务端状态（按 用户 + draft_key 存于 ListingDraft 表，带 TTL）。
+
+分段存储，每段一列，各步骤只写自己那段，互不覆盖：
+- meta：步骤1 填写的 category_id / device_model_id / years_used / original_price（DraftInitAPI 写入）
+- analysis：主图识别结果 grade_label / grade_score / defects（DraftAnalyzeAPI 拿到结果时写入）
+- estimate：估价入参指纹 + 结果（DraftEstimateAPI 写入，publish 入参一致时直接复用）
+
+后续步骤请求里没带的字段从这里补，不再要求前端每步重传，也不再重复估价。
+存库而不是 Django cache：默认 LocMemCache 是进程内的，多 worker 部署时 init / estimate / publish
+落到不同进程会读不到草稿。各段以 JSON 存储（Decimal 存为字符串），读取方按字符串解析。
+updated_at 早于 DRAFT_SESSION_TTL 的草稿视为不存在，行由 gc_draft_images 清理（purge_expired_drafts）。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ListingDraft
+
+SECTIONS = ("meta", "analysis", "estimate")
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "DRAFT_SESSION_TTL", 72 * 3600))
+
+
+def _expired_before(now=None):
+    return (now or timezone.now()) - timedelta(seconds=_ttl())
+
+
+def load_draft(user_id, draft_key: str) -> dict:
+    """返回 {段名: 数据}，没有的段不出现在结果里。"""
+    row = (
+        ListingDraft.objects.filter(user_id=user_id, draft_key=draft_key, updated_at__gte=_expired_before())
+        .values(*SECTIONS)
+        .first()
+    )
+    return {s: v for s, v in (row or {}).items() if v is not None}
+
+
+def save_draft(user_id, draft_key: str, **sections):
+    """写入（覆盖）指定段并刷新 TTL；只 UPDATE 本次给出的列，并发写不同段互不覆盖。"""
+    sections = {s: v for s, v in sections.items() if s in SECTIONS}
+    if not sections:
+        return
+    now = timezone.now()
+    live = ListingDraft.objects.filter(user_id=user_id, draft_key=draft_key, updated_at__gte=_expired_before(now))
+    if live.update(updated_at=now, **sections):
+        return
+    # 没有或已过期：过期行的其它段不能复活，删掉重建
+    ListingDraft.objects.filter(user_id=user_id, draft_key=draft_key).delete()
+    try:
+        with transaction.atomic():
+            ListingDraft.objects.create(user_id=user_id, draft_key=draft_key, updated_at=now, **sections)
+    except IntegrityError:
+        # 并发的另一步刚建好这一行
+        live.update(updated_at=now, **sections)
+
+
+def clear_draft(user_id, draft_key: str):
+    ListingDraft.objects.filter(user_id=user_id, draft_key=draft_key).delete()
+
+
+def purge_expired_drafts(batch_size=500, dry_run=False) -> int:
+    """按 id 分批删除过期草稿，返回删除行数（dry_run 时只计数）。"""
+    qs = ListingDraft.objects.filter(updated_at__lt=_expired_before())
+    if dry_run:
+        return qs.count()
+    deleted = 0
+    while True:
+        ids = list(qs.order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # DELETE 仍带过期条件：选出之后刚被写入续期的草稿不删
+        deleted += qs.filter(id__in=ids).delete()[0]
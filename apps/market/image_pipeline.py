@@ -0,0 +1,99 @@
+"""上传图片的后台标准化：进程池执行 imaging.normalize_image，完成后回写 ProductImage。
+
+- 上传事务提交后入队；CPU 密集的解码/缩放/编码在子进程里做，不占 Web worker，也不受 GIL 限制
+- 子进程用 spawn 启动（Web 进程里已有线程，fork 不安全），只加载 Pillow 与 imaging.py
+- 磁盘按内容 hash 去重：同名文件已被别的记录处理过，直接复制其结果，不重复编码
+- 未处理完之前，接口回退返回原图
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .imaging import normalize_image
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=int(getattr(settings, "IMAGE_PROCESS_WORKERS", 2)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def media_folder() -> str:
+    return os.path.join(settings.MEDIA_ROOT, "products")
+
+
+def _save(image_id: int, result: dict):
+    ProductImage.objects.filter(id=image_id).update(
+        width=result["width"],
+        height=result["height"],
+        thumb_sm_name=result["thumbs"].get("sm", ""),
+        thumb_md_name=result["thumbs"].get("md", ""),
+        processed_at=timezone.now(),
+    )
+
+
+def _reuse_processed(img: ProductImage) -> bool:
+    """同一文件已被其他记录处理过：复制结果。"""
+    done = (
+        ProductImage.objects.filter(image_name=img.image_name, processed_at__isnull=False)
+        .exclude(id=img.id)
+        .values("width", "height", "thumb_sm_name", "thumb_md_name")
+        .first()
+    )
+    if done is None:
+        return False
+    ProductImage.objects.filter(id=img.id).update(processed_at=timezone.now(), **done)
+    return True
+
+
+def _on_done(image_id: int, fut):
+    # 回调在进程池的管理线程里执行：用完即关连接
+    close_old_connections()
+    try:
+        _save(image_id, fut.result())
+    except Exception:
+        logger.exception("image normalization failed: image_id=%s", image_id)
+    finally:
+        close_old_connections()
+
+
+def process_images(image_ids):
+    """处理一批图片；IMAGE_PROCESS_INLINE=True 时在当前进程同步执行（调试/测试）。"""
+    folder = media_folder()
+    imgs = ProductImage.objects.filter(id__in=list(image_ids), processed_at__isnull=True).only("id", "image_name")
+    for img in imgs:
+        if _reuse_processed(img):
+            continue
+        if getattr(settings, "IMAGE_PROCESS_INLINE", False):
+            try:
+                _save(img.id, normalize_image(folder, img.image_name))
+            except Exception:
+                logger.exception("image normalization failed: image_id=%s", img.id)
+            continue
+        fut = _get_pool().submit(normalize_image, folder, img.image_name)
+        fut.add_done_callback(partial(_on_done, img.id))
+
+
+def enqueue_image_processing(image_ids):
+    image_ids = list(image_ids)
+    if image_ids:
+        transaction.on_commit(lambda: process_images(image_ids))
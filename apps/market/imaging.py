@@ -0,0 +1,53 @@
+"""图片标准化（纯 Pillow，不依赖 Django，可在子进程里执行）。
+
+- 原图：按 EXIF 方向摆正后重新编码为 progressive JPEG，长边不超过 MAX_EDGE，不写回 EXIF（去掉 GPS 等信息）
+- 缩略图：THUMB_SIZES 中每个尺寸各一份 WebP，文件名 <原文件名去扩展名>_<尺寸>.webp
+- 先写临时文件再 os.replace，读者不会看到写了一半的文件
+"""
+import os
+
+from PIL import Image, ImageOps
+
+MAX_EDGE = 2048
+THUMB_SIZES = {"sm": 240, "md": 720}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+
+def thumb_name(image_name: str, size: str) -> str:
+    return f"{os.path.splitext(image_name)[0]}_{size}.webp"
+
+
+def _save_atomic(im, path, fmt, **params):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    im.save(tmp, fmt, **params)
+    os.replace(tmp, path)
+
+
+def _to_rgb(im):
+    if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+        im = im.convert("RGBA")
+        bg = Image.new("RGB", im.size, (255, 255, 255))
+        bg.paste(im, mask=im.getchannel("A"))
+        return bg
+    return im.convert("RGB")
+
+
+def normalize_image(folder: str, image_name: str) -> dict:
+    """标准化 folder/image_name 并生成缩略图，返回 {"width", "height", "thumbs": {尺寸: 文件名}}。"""
+    path = os.path.join(folder, image_name)
+    with Image.open(path) as src:
+        im = _to_rgb(ImageOps.exif_transpose(src))
+
+    im.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+    _save_atomic(im, path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+    thumbs = {}
+    for size, edge in THUMB_SIZES.items():
+        t = im.copy()
+        t.thumbnail((edge, edge), Image.LANCZOS)
+        name = thumb_name(image_name, size)
+        _save_atomic(t, os.path.join(folder, name), "WEBP", quality=WEBP_QUALITY, method=4)
+        thumbs[size] = name
+
+    return {"width": im.width, "height": im.height, "thumbs": thumbs}
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.market.market_stats import aggregate_market_prices
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate completed order amounts into MarketPriceStat p10/p50/p90 per device model "
+        "(incremental from the last watermark; mergeable quantile sketches, bounded memory)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Reset watermark and stored sketches, rebuild from scratch (drops stats of models without completed orders)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Orders per committed batch / rows per bulk write, default: 5000")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = aggregate_market_prices(
+            full=options["full"],
+            batch_size=max(1, options["batch_size"]),
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        elapsed = time.perf_counter() - started
+        pos_time, pos_id = result["watermark"]
+        self.stdout.write(self.style.SUCCESS(
+            f"orders={result['orders']} models={result['models']} removed={result['removed']} products_compared={result['products_compared']} "
+            f"watermark=({pos_time}, {pos_id}) "
+            f"in {elapsed:.2f}s ({result['orders'] / max(elapsed, 1e-9):,.0f} orders/s)"
+        ))
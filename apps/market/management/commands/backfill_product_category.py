@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from apps.market.models import DeviceModel, Product
+
+
+class Command(BaseCommand):
+    help = "Backfill Product.category_id from device_model -> brand -> category (batched UPDATE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every product (e.g. after import_zol_products moved models between brands), "
+                 "not only rows with empty category_id",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows per UPDATE statement (by id range), default: 5000",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, int(options.get("batch_size") or 5000))
+
+        qs = Product.objects.all()
+        if not options.get("all"):
+            qs = qs.filter(category__isnull=True)
+
+        category_of_model = Subquery(
+            DeviceModel.objects.filter(id=OuterRef("device_model_id")).values("brand__category_id")[:1]
+        )
+
+        # 按主键分批，每批一条 UPDATE ... SET category_id = (子查询)，避免长事务与大范围锁
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(qs.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            updated += Product.objects.filter(id__in=ids).update(category_id=category_of_model)
+            last_id = ids[-1]
+            self.stdout.write(f"[BACKFILL] up to id={last_id}, updated={updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill finished. updated={updated}"))
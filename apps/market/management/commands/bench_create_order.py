@@ -0,0 +1,116 @@
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.market.models import DeviceModel, Order, Product
+from apps.market.services import TradeService
+
+
+@transaction.atomic
+def legacy_create_order(user, product_id):
+    """旧实现（select_for_update 排队 + 全字段 save，锁内建单），仅作基准对照。"""
+    product = Product.objects.select_for_update().get(id=product_id)
+    if product.status != "on_sale":
+        raise ValueError("商品不可购买")
+    if product.seller == user:
+        raise ValueError("不能购买自己的商品")
+    product.status = "locked"
+    product.save()
+    return Order.objects.create(
+        order_no=uuid.uuid4().hex,
+        buyer=user,
+        product=product,
+        amount=product.selling_price,
+        status="pending_payment",
+    )
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire N simultaneous buyers at one on-sale product and report winners/losers latency: "
+        "legacy select_for_update vs conditional-UPDATE reservation. Creates and removes its own fixture rows"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--buyers", type=int, default=32, help="Concurrent buyers per product, default: 32")
+        parser.add_argument("--rounds", type=int, default=5, help="Products (races) per implementation, default: 5")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        n, rounds = max(2, options["buyers"]), max(1, options["rounds"])
+        tag = uuid.uuid4().hex[:8]
+        device_model = DeviceModel.objects.select_related("brand").order_by("id").first()
+        if device_model is None:
+            self.stderr.write(self.style.ERROR("No DeviceModel; run seed_devices first"))
+            return
+
+        seller = User.objects.create_user(username=f"bench-seller-{tag}", password=None)
+        buyers = [User.objects.create_user(username=f"bench-buyer-{tag}-{i}", password=None) for i in range(n)]
+        products = []
+        try:
+            for label, fn in (("legacy", legacy_create_order), ("reserve", TradeService.create_order)):
+                wins, losses, errors = [], [], []
+                for _ in range(rounds):
+                    product = Product.objects.create(
+                        seller=seller, device_model=device_model, category_id=device_model.brand.category_id,
+                        title=f"bench {tag}", description="bench",
+                        estimated_price=Decimal("1000.00"), selling_price=Decimal("999.00"), status="on_sale",
+                    )
+                    products.append(product.id)
+                    self._race(fn, product.id, buyers, wins, losses, errors)
+                    orders = Order.objects.filter(product_id=product.id).count()
+                    if orders != 1:
+                        self.stderr.write(self.style.ERROR(f"{label}: product {product.id} got {orders} orders"))
+
+                self.stdout.write(
+                    f"{label:>8}: wins={len(wins)} losses={len(losses)} errors={len(errors)} | "
+                    f"win p50={_pct(wins, 0.5):.2f}ms | "
+                    f"loss p50={_pct(losses, 0.5):.2f}ms p99={_pct(losses, 0.99):.2f}ms "
+                    f"mean={statistics.fmean(losses) if losses else 0:.2f}ms"
+                )
+                for e in errors[:3]:
+                    self.stdout.write(f"          error: {e}")
+        finally:
+            Order.objects.filter(product_id__in=products).delete()
+            Product.objects.filter(id__in=products).delete()
+            User.objects.filter(id__in=[seller.id, *(b.id for b in buyers)]).delete()
+
+    def _race(self, fn, product_id, buyers, wins, losses, errors):
+        barrier = threading.Barrier(len(buyers))
+        lock = threading.Lock()
+
+        def buy(user):
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    fn(user, product_id)
+                    bucket, err = wins, None
+                except ValueError:
+                    bucket, err = losses, None
+                except Exception as e:
+                    bucket, err = errors, f"{type(e).__name__}: {e}"
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    bucket.append(err if err else elapsed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(u,)) for u in buyers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.market.models import Category, Brand, DeviceModel, Product
+from apps.market.search import search_products, search_device_models
+from apps.market.suggest import device_model_suggest_index
+
+
+BENCH_USERNAME = "bench_search"
+
+TITLE_WORDS = ["自用", "国行", "99新", "95新", "9成新", "电池健康", "无拆修", "全套包装", "官换机", "急出", "可小刀"]
+DEFAULT_QUERIES = "iPhone,华为,小米,MacBook,iPad,游戏本,相机,电池健康,无拆修,国行 256G"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark keyword search (products + device models) and device-model typeahead over a seeded corpus, "
+        "report p50/p95/p99 latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Seed N synthetic on_sale products before benchmarking")
+        parser.add_argument("--queries", type=str, default=DEFAULT_QUERIES, help="Comma-separated query list")
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per query, default: 20")
+        parser.add_argument("--limit", type=int, default=20, help="Result limit per search, default: 20")
+        parser.add_argument("--budget-ms", type=float, default=50.0, help="p95 latency budget in ms, default: 50")
+        parser.add_argument("--cleanup", action="store_true", help="Delete seeded products after benchmarking")
+
+    def handle(self, *args, **options):
+        seeded_user = None
+        if options["seed"] > 0:
+            seeded_user = self._seed(options["seed"])
+
+        queries = [q.strip() for q in options["queries"].split(",") if q.strip()]
+        samples = []
+        for q in queries:
+            for _ in range(max(1, options["repeat"])):
+                started = time.perf_counter()
+                n_products = len(list(search_products(q, options["limit"])))
+                n_models = len(list(search_device_models(q, options["limit"])))
+                samples.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"[SEARCH] q={q!r} products={n_products} device_models={n_models}")
+
+        samples.sort()
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        p95 = pct(0.95)
+        self.stdout.write(
+            f"corpus: products={Product.objects.filter(status='on_sale').count()} "
+            f"device_models={DeviceModel.objects.count()}"
+        )
+        self.stdout.write(
+            f"latency(ms): n={len(samples)} mean={statistics.mean(samples):.2f} "
+            f"p50={pct(0.50):.2f} p95={p95:.2f} p99={pct(0.99):.2f}"
+        )
+        if p95 <= options["budget_ms"]:
+            self.stdout.write(self.style.SUCCESS(f"p95 within budget ({options['budget_ms']}ms)"))
+        else:
+            self.stdout.write(self.style.WARNING(f"p95 over budget ({options['budget_ms']}ms)"))
+
+        self._bench_suggest(queries, options["repeat"])
+
+        if seeded_user is not None and options["cleanup"]:
+            Product.objects.filter(seller=seeded_user).delete()
+            self.stdout.write("seeded products deleted")
+
+    def _bench_suggest(self, queries, repeat):
+        """typeahead：对每个查询的所有前缀（模拟逐字输入）计时，索引构建时间单独统计。"""
+        started = time.perf_counter()
+        device_model_suggest_index.rebuild()
+        build_ms = (time.perf_counter() - started) * 1000
+
+        samples = []
+        for q in queries:
+            for i in range(1, len(q) + 1):
+                for _ in range(max(1, repeat)):
+                    started = time.perf_counter()
+                    device_model_suggest_index.search(q[:i])
+                    samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        self.stdout.write(
+            f"suggest(ms): build={build_ms:.1f} n={len(samples)} p50={pct(0.50):.3f} p99={pct(0.99):.3f}"
+        )
+
+    def _seed(self, n: int):
+        rng = random.Random(42)
+        user, _ = get_user_model().objects.get_or_create(username=BENCH_USERNAME)
+
+        models = list(DeviceModel.objects.select_related("brand")[:2000])
+        if not models:
+            cat, _ = Category.objects.get_or_create(code="mobile", defaults={"name": "手机"})
+            brand, _ = Brand.objects.get_or_create(category=cat, name="Apple")
+            models = [DeviceModel.objects.create(brand=brand, name=f"iPhone {v}") for v in range(8, 16)]
+
+        batch = []
+        for i in range(n):
+            dm = rng.choice(models)
+            words = " ".join(rng.sample(TITLE_WORDS, 3))
+            price = Decimal(rng.randint(300, 12000))
+            batch.append(Product(
+                seller=user,
+                device_model=dm,
+                category_id=dm.brand.category_id,
+                title=f"{dm.brand.name} {dm.name} {words}",
+                description=f"{dm.name} {words}，编号 {i}",
+                estimated_price=price,
+                selling_price=price,
+                status="on_sale",
+            ))
+        Product.objects.bulk_create(batch, batch_size=1000)
+        self.stdout.write(f"seeded {n} products")
+        return user
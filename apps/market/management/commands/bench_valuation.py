@@ -0,0 +1,61 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from apps.market.models import DeviceModel, ValuationChoice
+from apps.market.services import ValuationEngine
+from apps.market.valuation_rules import get_rule_table
+
+
+def legacy_calculate_price(device_model_id, choice_ids):
+    """旧实现（每次估价 2 条查询 + float 累加），仅作基准对照。"""
+    try:
+        device = DeviceModel.objects.get(id=device_model_id)
+        total_depreciation = 0.0
+        for choice in ValuationChoice.objects.filter(id__in=choice_ids):
+            total_depreciation += choice.depreciation_rate
+        if total_depreciation > 0.9:
+            total_depreciation = 0.9
+        final_price = device.base_price * (Decimal("1.0") - Decimal(str(total_depreciation))) * Decimal("1.0")
+        return max(final_price, Decimal("50.00"))
+    except DeviceModel.DoesNotExist:
+        return Decimal("0.00")
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark ValuationEngine.calculate_price: legacy per-call queries vs precompiled rule table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=2000, help="Valuations per run, default: 2000")
+        parser.add_argument("--choices", type=int, default=4, help="Choice ids per valuation, default: 4")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        model_ids = list(DeviceModel.objects.filter(base_price__isnull=False).values_list("id", flat=True)[:5000])
+        choice_ids = list(ValuationChoice.objects.values_list("id", flat=True))
+        if not model_ids:
+            self.stderr.write(self.style.ERROR("No DeviceModel with base_price; run seed_devices first"))
+            return
+
+        calls = max(1, options["calls"])
+        k = min(options["choices"], len(choice_ids))
+        workload = [(rng.choice(model_ids), rng.sample(choice_ids, k)) for _ in range(calls)]
+
+        started = time.perf_counter()
+        get_rule_table()
+        self.stdout.write(f"rule table build: {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        results = {}
+        for label, fn in (("legacy", legacy_calculate_price), ("compiled", ValuationEngine.calculate_price)):
+            started = time.perf_counter()
+            results[label] = [fn(dm_id, cids) for dm_id, cids in workload]
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{label:>8}: {calls / elapsed:,.0f} calls/s ({elapsed * 1e6 / calls:.1f}us/call)")
+
+        mismatches = sum(
+            1 for a, b in zip(results["legacy"], results["compiled"])
+            if a.quantize(Decimal("0.01")) != b.quantize(Decimal("0.01"))
+        )
+        self.stdout.write(f"result mismatches (to 0.01): {mismatches}")
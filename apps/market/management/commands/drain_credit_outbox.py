@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.market.credit_outbox import MAX_ATTEMPTS, drain_credit_outbox
+from apps.market.models import CreditOutbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply pending order credit events from the CreditOutbox table (rows left by other processes "
+        "and rows due for retry)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Outbox rows per transaction, default: 500")
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=MAX_ATTEMPTS,
+            help=f"Stop retrying a row after N failures, default: {MAX_ATTEMPTS}",
+        )
+        parser.add_argument(
+            "--requeue-failed", action="store_true", help="Reset rows that exhausted --max-attempts and retry them now"
+        )
+        parser.add_argument(
+            "--every",
+            type=float,
+            default=0,
+            help="Run periodically every N seconds (simple scheduler loop); default: run once",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_failed"]:
+            n = CreditOutbox.objects.filter(processed_at__isnull=True, attempts__gte=options["max_attempts"]).update(
+                attempts=0
+            )
+            self.stdout.write(f"requeued {n} exhausted rows")
+        while True:
+            self._run_once(options)
+            if options["every"] <= 0:
+                return
+            time.sleep(options["every"])
+
+    def _run_once(self, options):
+        stats = drain_credit_outbox(
+            batch_size=max(1, options["batch_size"]),
+            max_attempts=max(1, options["max_attempts"]),
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        ).as_dict()
+        exhausted = CreditOutbox.objects.filter(
+            processed_at__isnull=True, attempts__gte=options["max_attempts"]
+        ).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"processed={stats['processed']} failed={stats['failed']} batches={stats['batches']} "
+            f"exhausted={exhausted} in {stats['seconds']}s"
+        ))
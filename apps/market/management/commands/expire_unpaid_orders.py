@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.market.order_expiry import expire_unpaid_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Cancel orders left unpaid past the payment deadline, put their locked products back on sale "
+        "and record payment_cancelled credit events, in short batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout-minutes",
+            type=float,
+            default=None,
+            help="Payment deadline in minutes, default: settings.ORDER_PAYMENT_TIMEOUT_MINUTES",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Orders per transaction, default: 500")
+        parser.add_argument("--dry-run", action="store_true", help="Count expired orders, change nothing")
+        parser.add_argument(
+            "--every",
+            type=float,
+            default=0,
+            help="Run periodically every N seconds (simple scheduler loop); default: run once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self._run_once(options)
+            if options["every"] <= 0:
+                return
+            time.sleep(options["every"])
+
+    def _run_once(self, options):
+        timeout = options["timeout_minutes"]
+        if timeout is None:
+            timeout = getattr(settings, "ORDER_PAYMENT_TIMEOUT_MINUTES", 30)
+        cutoff = timezone.now() - timedelta(minutes=timeout)
+        stats = expire_unpaid_orders(
+            cutoff,
+            batch_size=max(1, options["batch_size"]),
+            dry_run=options["dry_run"],
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        ).as_dict()
+
+        prefix = "[DRY-RUN] would expire" if stats["dry_run"] else "expired"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} orders={stats['orders']} released_products={stats['products']} "
+            f"credit_events={stats['credit_events']} batches={stats['batches']} "
+            f"in {stats['seconds']}s ({stats['orders_per_sec']} orders/s)"
+        ))
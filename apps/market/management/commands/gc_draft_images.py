@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.market.draft_gc import collect_draft_images
+from apps.market.image_pipeline import media_folder
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete images of abandoned listing drafts (product IS NULL, whole draft older than --ttl-hours) "
+        "and unlink their files; also drop draft state rows older than DRAFT_SESSION_TTL"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ttl-hours", type=float, default=72, help="Draft age to treat as abandoned, default: 72")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows per DELETE batch, default: 500")
+        parser.add_argument("--workers", type=int, default=8, help="Parallel file unlinks, default: 8")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted, change nothing")
+        parser.add_argument(
+            "--every",
+            type=float,
+            default=0,
+            help="Run periodically every N seconds (simple scheduler loop); default: run once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self._run_once(options)
+            if options["every"] <= 0:
+                return
+            time.sleep(options["every"])
+
+    def _run_once(self, options):
+        cutoff = timezone.now() - timedelta(hours=options["ttl_hours"])
+        stats = collect_draft_images(
+            media_folder(),
+            cutoff,
+            batch_size=max(1, options["batch_size"]),
+            workers=max(1, options["workers"]),
+            dry_run=options["dry_run"],
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        ).as_dict()
+
+        prefix = "[DRY-RUN] would delete" if stats["dry_run"] else "deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} drafts={stats['drafts']} rows={stats['rows']} files={stats['files']} "
+            f"({stats['bytes'] / 1024 / 1024:.1f} MiB), skipped_files={stats['skipped_files']} "
+            f"draft_sessions={stats['sessions']} "
+            f"in {stats['seconds']}s ({stats['rows_per_sec']} rows/s, {stats['files_per_sec']} files/s)"
+        ))
@@ -7,6 +7,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from apps.market.models import Category, Brand, DeviceModel
+from apps.market.catalog_cache import bump_catalog_version
 
 
 INDEX_TYPE_MAP = {
@@ -173,6 +174,10 @@ class Command(BaseCommand):
                     else:
                         updated += 1
 
+        # 目录缓存失效（类目/品牌/型号接口的 ETag 随之变化）；版本号在库里、与导入同一事务提交，
+        # Web 进程看到版本变化即重建规则表与型号联想索引
+        bump_catalog_version()
+
         self.stdout.write(
             self.style.SUCCESS(
                 f"Import finished. files={files_imported}, created={created}, updated={updated}"
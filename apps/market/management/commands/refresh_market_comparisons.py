@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.market.services import MarketComparisonService
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute market comparisons (ValuationSnapshot.market_* and Product.market_diff_pct) "
+        "against MarketPriceStat p50 for on-sale products"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--device-model", type=int, action="append", help="Only these device model ids (repeatable)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products per bulk write, default: 1000")
+
+    def handle(self, *args, **options):
+        refreshed = MarketComparisonService.refresh(
+            device_model_ids=options["device_model"], batch_size=max(1, options["batch_size"])
+        )
+        self.stdout.write(self.style.SUCCESS(f"refreshed {refreshed} on-sale products"))
@@ -5,6 +5,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from apps.market.models import Category, Brand, DeviceModel, MarketPriceStat
+from apps.market.catalog_cache import bump_catalog_version
 
 
 def D(x: int | float | str) -> Decimal:
@@ -24,6 +25,8 @@ class Command(BaseCommand):
     @transaction.atomic
     def handle(self, *args, **options):
         random.seed(42)
+        # 目录缓存失效：版本号与种子数据同一事务提交
+        bump_catalog_version()
 
         if options.get("reset"):
             # 注意：如果你已有业务数据（商品/订单）请不要 reset
@@ -0,0 +1,187 @@
+"""成交价聚合：从已完成订单增量计算每个型号的 p10/p50/p90，写入 MarketPriceStat。
+
+- 数据源：Order(status=completed).amount，经 Product.device_model 归到型号
+- 增量：JobWatermark 记录已处理到的 (complete_time, id)，每次只扫其后完成的订单（索引 status, complete_time, id）
+- 回看窗口：complete_time 在事务提交前就已写入，晚提交的订单时间可能早于已推进的水位而被漏掉；
+  只扫 complete_time 早于 now - MARKET_STATS_LOOKBACK_SECONDS 的订单，水位不越过这条线，
+  窗口内晚提交的订单仍在水位之后，下一轮照常扫到，也不会重复计数（代价是统计滞后一个窗口）
+- 分位数：对数分桶草图（DDSketch 思路），相对误差 <= RELATIVE_ACCURACY；
+  桶数只与价格跨度有关（1 元 ~ 1 亿元也不到 1000 桶），与订单量无关，且可合并：
+  增量时把新订单的草图并进 MarketPriceStat.sketch 即可，不必回看历史订单
+- 分批提交：每批（batch_size 个订单）一个短事务：锁水位行 -> 从水位扫一页 -> 并入草图 -> 推进水位，
+  不再整轮持有一个长事务和锁；中途失败时已提交的批次保留，下次从推进后的水位继续
+- 并发：重叠的两次运行在每批的水位行锁上串行，各自从对方推进后的水位接着扫，同一批订单不会并入两次
+- --full：先在一个短事务里清零水位和成交草图（sample_size=0），再按批从头并入；
+  结束时仍为 0 的成交统计（型号已没有已完成订单）删除。水位为空（首次运行 / 被重置）时同样按全量重建。
+  种子数据等非成交统计（sketch 为空）不受影响
+- 历史订单 complete_time 为空的由迁移 0017 用 updated_at 回填，并重置水位触发一次全量重建
+- 统计更新后按型号刷新在售商品的比价缓存（MarketComparisonService）
+"""
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import JobWatermark, MarketPriceStat, Order
+from .services import MarketComparisonService
+
+WATERMARK_NAME = "market_price_stat"
+RELATIVE_ACCURACY = 0.01
+QUANTILES = (0.10, 0.50, 0.90)
+
+
+class QuantileSketch:
+    """对数分桶分位数草图：值 x 落在桶 ceil(log_gamma(x))，gamma = (1 + a) / (1 - a)。"""
+
+    __slots__ = ("alpha", "gamma", "_log_gamma", "buckets", "count")
+
+    def __init__(self, alpha=RELATIVE_ACCURACY, buckets=None):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = dict(buckets or {})
+        self.count = sum(self.buckets.values())
+
+    def add(self, value, n=1):
+        value = float(value)
+        if value <= 0:
+            return
+        i = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[i] = self.buckets.get(i, 0) + n
+        self.count += n
+
+    def merge(self, other: "QuantileSketch"):
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.count += other.count
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                return 2 * self.gamma ** i / (self.gamma + 1)
+        return None
+
+    def to_json(self) -> dict:
+        return {"alpha": self.alpha, "buckets": {str(i): n for i, n in self.buckets.items()}}
+
+    @classmethod
+    def from_json(cls, data):
+        if not data or data.get("alpha") != RELATIVE_ACCURACY:
+            return cls()
+        return cls(data["alpha"], {int(i): n for i, n in data.get("buckets", {}).items()})
+
+
+def _price(value) -> Decimal:
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def _lookback() -> timedelta:
+    return timedelta(seconds=float(getattr(settings, "MARKET_STATS_LOOKBACK_SECONDS", 300)))
+
+
+def _flush(sketches: dict, batch_size: int) -> int:
+    """把一批草图并入 MarketPriceStat（批量 upsert）；由调用方的事务连同水位一起提交。"""
+    existing = MarketPriceStat.objects.in_bulk(list(sketches), field_name="device_model_id")
+    to_update, to_create = [], []
+    now = timezone.now()
+    for device_model_id, sketch in sketches.items():
+        stat = existing.get(device_model_id)
+        if stat is not None:
+            merged = QuantileSketch.from_json(stat.sketch)
+            merged.merge(sketch)
+            sketch = merged
+        p10, p50, p90 = (_price(sketch.quantile(q)) for q in QUANTILES)
+        fields = {
+            "p10_price": p10, "p50_price": p50, "p90_price": p90,
+            "sample_size": sketch.count, "sketch": sketch.to_json(), "updated_at": now,
+        }
+        if stat is None:
+            to_create.append(MarketPriceStat(device_model_id=device_model_id, **fields))
+        else:
+            for k, v in fields.items():
+                setattr(stat, k, v)
+            to_update.append(stat)
+
+    MarketPriceStat.objects.bulk_create(to_create, batch_size=batch_size)
+    MarketPriceStat.objects.bulk_update(
+        to_update,
+        ["p10_price", "p50_price", "p90_price", "sample_size", "sketch", "updated_at"],
+        batch_size=batch_size,
+    )
+    return len(to_create) + len(to_update)
+
+
+def _lock_watermark() -> JobWatermark:
+    # 锁住水位行：另一轮正在处理一批时在这里等它提交，再读到它推进后的水位
+    return JobWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+
+
+def aggregate_market_prices(full=False, batch_size=5000, log=None) -> dict:
+    """返回 {"orders", "models", "removed", "products_compared", "watermark"}。"""
+    JobWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    # 成交统计（sketch 非空）；种子数据等非成交统计的 sketch 为空，全量重建不动它们
+    trade_stats = MarketPriceStat.objects.filter(sketch__has_key="alpha")
+
+    with transaction.atomic():
+        watermark = _lock_watermark()
+        if full or watermark.position_time is None:
+            # 从头扫：先清零已有成交草图，之后各批照常并入，避免重复计数
+            full = True
+            watermark.position_time, watermark.position_id = None, 0
+            watermark.save()
+            trade_stats.update(sample_size=0, sketch=QuantileSketch().to_json())
+
+    horizon = timezone.now() - _lookback()
+    qs = Order.objects.filter(
+        status="completed", complete_time__isnull=False, complete_time__lt=horizon,
+        product__device_model__isnull=False,
+    ).order_by("complete_time", "id")
+
+    touched, orders = set(), 0
+    while True:
+        with transaction.atomic():
+            watermark = _lock_watermark()
+            pos_time, pos_id = watermark.position_time, watermark.position_id
+            page = qs
+            if pos_time is not None:
+                page = page.filter(Q(complete_time__gt=pos_time) | Q(complete_time=pos_time, id__gt=pos_id))
+            rows = list(page.values_list("id", "complete_time", "amount", "product__device_model_id")[:batch_size])
+            if not rows:
+                break
+            sketches = {}
+            for order_id, complete_time, amount, device_model_id in rows:
+                sketch = sketches.get(device_model_id)
+                if sketch is None:
+                    sketch = sketches[device_model_id] = QuantileSketch()
+                sketch.add(amount)
+            _flush(sketches, batch_size)
+            pos_id, pos_time = rows[-1][0], rows[-1][1]
+            watermark.position_time, watermark.position_id = pos_time, pos_id
+            watermark.save()
+        touched.update(sketches)
+        orders += len(rows)
+        if log:
+            log(f"scanned {orders} orders, {len(touched)} models")
+
+    removed = []
+    if full:
+        # 重建后仍为 0：型号已没有已完成订单（如全部退款），统计删除，比价随之清空
+        stale = trade_stats.filter(sample_size=0)
+        removed = list(stale.values_list("device_model_id", flat=True))
+        stale.filter(device_model_id__in=removed).delete()
+
+    refresh_ids = touched.union(removed)
+    compared = MarketComparisonService.refresh(device_model_ids=list(refresh_ids)) if refresh_ids else 0
+    return {
+        "orders": orders, "models": len(touched), "removed": len(removed),
+        "products_compared": compared, "watermark": (pos_time, pos_id),
+    }
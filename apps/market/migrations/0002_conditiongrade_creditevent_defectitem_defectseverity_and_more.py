@@ -0,0 +1,249 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConditionGrade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(help_text='显示文本，如 9成新', max_length=20)),
+                ('factor', models.DecimalField(decimal_places=2, help_text='成色系数（0~1），用于估价算法', max_digits=4)),
+                ('sort_order', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['sort_order', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CreditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('order_completed', '订单完成'), ('order_refunded', '订单退款/取消'), ('payment_cancelled', '取消支付'), ('late_shipment', '发货超时'), ('dispute_lost', '纠纷判负'), ('manual_adjust', '人工调整')], max_length=32)),
+                ('delta', models.IntegerField(default=0)),
+                ('score_after', models.IntegerField(blank=True, null=True)),
+                ('ref_type', models.CharField(blank=True, default='', max_length=32)),
+                ('ref_id', models.CharField(blank=True, default='', max_length=64)),
+                ('reason', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DefectItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='检查项编码（建议英文小写/下划线），如 screen / body / lens / port / joystick', max_length=32)),
+                ('name', models.CharField(help_text='检查项名称，如 屏幕 / 机身 / 镜头 / 接口 / 摇杆', max_length=50)),
+                ('description', models.CharField(blank=True, help_text='检查项说明（给前端提示用，可选）', max_length=200)),
+                ('is_required', models.BooleanField(default=True, help_text='是否为必检项')),
+                ('sort_order', models.PositiveIntegerField(default=0, help_text='前端展示顺序')),
+            ],
+            options={
+                'ordering': ['sort_order', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DefectSeverity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(help_text='损耗等级：1/2/3')),
+                ('label', models.CharField(help_text='等级名称，如 轻微/明显/严重', max_length=30)),
+                ('penalty_weight', models.DecimalField(decimal_places=4, default=0, help_text='扣减权重（0~1），用于估价算法', max_digits=5)),
+                ('description', models.CharField(blank=True, help_text='对该等级的解释说明（可选）', max_length=200)),
+            ],
+            options={
+                'ordering': ['defect_item', 'level', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MarketPriceStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('p10_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('p50_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('p90_price', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('sample_size', models.PositiveIntegerField(default=0, help_text='统计样本量')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecognitionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ok', models.BooleanField(default=False, help_text='是否识别成功')),
+                ('confidence', models.FloatField(default=0.0, help_text='识别置信度 0~1')),
+                ('detections', models.JSONField(default=list, help_text='检测框列表（label/confidence/bbox 等），用于前端展示')),
+                ('message', models.CharField(blank=True, help_text='识别说明/失败原因', max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ValuationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice_ids', models.JSONField(default=list, help_text='用户选择的 ValuationChoice id 列表')),
+                ('estimated_price', models.DecimalField(decimal_places=2, default=0, help_text='系统估价金额', max_digits=10)),
+                ('breakdown', models.JSONField(default=list, help_text='估价明细（JSON）')),
+                ('suggested_min', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('suggested_max', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('market_median', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('market_diff_pct', models.FloatField(default=0.0, help_text='(selling - median)/median')),
+                ('value_score', models.FloatField(default=0.0, help_text='(median - selling)/median，越大越划算')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='brand',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='brand',
+            name='logo',
+        ),
+        migrations.AddField(
+            model_name='brand',
+            name='list_url',
+            field=models.URLField(blank=True, help_text='品牌列表页入口 URL（可选，用于爬虫/增量更新）', null=True),
+        ),
+        migrations.AddField(
+            model_name='devicemodel',
+            name='detail_url',
+            field=models.URLField(blank=True, help_text='外部详情页 URL（可选）', null=True),
+        ),
+        migrations.AddField(
+            model_name='devicemodel',
+            name='image_url',
+            field=models.URLField(blank=True, help_text='外部图片 URL（可选）', null=True),
+        ),
+        migrations.AddField(
+            model_name='devicemodel',
+            name='msrp_price',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='参考价/标价（例如 ZOL 参考价）', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='devicemodel',
+            name='zol_sku_id',
+            field=models.CharField(blank=True, help_text='ZOL sku_id（唯一，用于导入去重/更新）', max_length=32, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='draft_key',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='上架草稿键（uuid），用于在未创建商品前暂存图片', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='devicemodel',
+            name='base_price',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='市场基准回收价（可根据官方或历史数据确定，可空）', max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending_payment', '待支付'), ('paid', '已支付/待发货'), ('pending_receipt', '待收货'), ('shipped', '已发货/待收货'), ('inspecting', '验机中'), ('completed', '已完成'), ('refunded', '已退款/取消')], default='pending_payment', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['uploaded_by', 'draft_key'], name='market_prod_uploade_747ca2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'sort_order'], name='market_prod_product_58525f_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='brand',
+            constraint=models.UniqueConstraint(fields=('category', 'name'), name='uniq_brand_category_name'),
+        ),
+        migrations.AddField(
+            model_name='conditiongrade',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='condition_grades', to='market.category'),
+        ),
+        migrations.AddField(
+            model_name='creditevent',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_events', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='defectitem',
+            name='category',
+            field=models.ForeignKey(help_text='所属设备类别', on_delete=django.db.models.deletion.CASCADE, related_name='defect_items', to='market.category'),
+        ),
+        migrations.AddField(
+            model_name='defectseverity',
+            name='defect_item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='severities', to='market.defectitem'),
+        ),
+        migrations.AddField(
+            model_name='marketpricestat',
+            name='device_model',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='market_price', to='market.devicemodel'),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='brand',
+            field=models.ForeignKey(blank=True, help_text='识别出的品牌（可空）', null=True, on_delete=django.db.models.deletion.SET_NULL, to='market.brand'),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='category',
+            field=models.ForeignKey(blank=True, help_text='识别出的分类（可空）', null=True, on_delete=django.db.models.deletion.SET_NULL, to='market.category'),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='device_model',
+            field=models.ForeignKey(blank=True, help_text='识别出的型号（可空）', null=True, on_delete=django.db.models.deletion.SET_NULL, to='market.devicemodel'),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='image',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recognition', to='market.productimage'),
+        ),
+        migrations.AddField(
+            model_name='valuationsnapshot',
+            name='created_by',
+            field=models.ForeignKey(blank=True, help_text='发起估价的用户', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='valuation_snapshots', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='valuationsnapshot',
+            name='device_model',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='market.devicemodel'),
+        ),
+        migrations.AddField(
+            model_name='valuationsnapshot',
+            name='product',
+            field=models.ForeignKey(blank=True, help_text='关联商品（可空）', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='valuation_snapshots', to='market.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='conditiongrade',
+            constraint=models.UniqueConstraint(fields=('category', 'label'), name='uniq_conditiongrade_category_label'),
+        ),
+        migrations.AddIndex(
+            model_name='creditevent',
+            index=models.Index(fields=['user', 'created_at'], name='market_cred_user_id_4c9c5d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditevent',
+            index=models.Index(fields=['ref_type', 'ref_id'], name='market_cred_ref_typ_9e8162_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='creditevent',
+            constraint=models.UniqueConstraint(fields=('user', 'event_type', 'ref_type', 'ref_id'), name='uniq_credit_event_user_type_ref'),
+        ),
+        migrations.AddConstraint(
+            model_name='defectitem',
+            constraint=models.UniqueConstraint(fields=('category', 'code'), name='uniq_defectitem_category_code'),
+        ),
+        migrations.AddConstraint(
+            model_name='defectseverity',
+            constraint=models.UniqueConstraint(fields=('defect_item', 'level'), name='uniq_defectseverity_item_level'),
+        ),
+    ]
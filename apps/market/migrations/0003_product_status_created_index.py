@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_conditiongrade_creditevent_defectitem_defectseverity_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='market_prod_status_1f5198_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_product_status_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(blank=True, help_text='所属类目（冗余自 device_model -> brand -> category）', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='market.category'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'category', 'created_at'], name='market_prod_status_3e9ccc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'seller', 'created_at'], name='market_prod_status_20db14_idx'),
+        ),
+    ]
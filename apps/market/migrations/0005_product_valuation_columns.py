@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0004_product_category'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='diff_pct',
+            field=models.FloatField(blank=True, help_text='售价相对估价区间的偏离百分比：高于为正，低于为负，区间内为 0', null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='estimated_max',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='estimated_mid',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='estimated_min',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='grade_label',
+            field=models.CharField(blank=True, help_text='成色标签，如 9成新（对应 ConditionGrade.label）', max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='market_tag',
+            field=models.CharField(blank=True, help_text='比价文案，如 低于市场价 5.0%', max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='original_price',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='购入原价（卖家填写）', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='value_score',
+            field=models.FloatField(blank=True, help_text='性价比评分 0~100，越高越划算', null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='years_used',
+            field=models.FloatField(blank=True, help_text='已使用年限', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'value_score'], name='market_prod_status_b024d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'diff_pct'], name='market_prod_status_8054f2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'grade_label', 'created_at'], name='market_prod_status_f84010_idx'),
+        ),
+    ]
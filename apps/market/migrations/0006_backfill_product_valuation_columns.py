@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:08
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+
+
+BATCH_SIZE = 2000
+
+DECIMAL_KEYS = ("original_price", "estimated_min", "estimated_max", "estimated_mid")
+FLOAT_KEYS = ("years_used", "diff_pct", "value_score")
+TEXT_KEYS = ("grade_label", "market_tag")
+
+
+def _to_decimal(v):
+    if v in (None, ""):
+        return None
+    try:
+        return Decimal(str(v)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _to_float(v):
+    if v in (None, ""):
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def copy_condition_data_to_columns(apps, schema_editor):
+    """把 condition_data 中的估价/比价键拷贝到新列（按主键分批 bulk_update）。"""
+    Product = apps.get_model("market", "Product")
+    fields = list(DECIMAL_KEYS + FLOAT_KEYS + TEXT_KEYS)
+
+    last_id = 0
+    while True:
+        batch = list(Product.objects.filter(id__gt=last_id).order_by("id").only("id", "condition_data")[:BATCH_SIZE])
+        if not batch:
+            break
+        for p in batch:
+            cd = p.condition_data if isinstance(p.condition_data, dict) else {}
+            for k in DECIMAL_KEYS:
+                setattr(p, k, _to_decimal(cd.get(k)))
+            for k in FLOAT_KEYS:
+                setattr(p, k, _to_float(cd.get(k)))
+            for k in TEXT_KEYS:
+                v = cd.get(k)
+                setattr(p, k, str(v) if v not in (None, "") else None)
+        Product.objects.bulk_update(batch, fields)
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0005_product_valuation_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_condition_data_to_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:10
+
+from django.db import migrations
+
+
+# MySQL 专用：ngram 分词的 FULLTEXT 索引（中文按 ngram_token_size=2 切分）。
+# 其他数据库跳过，apps/market/search.py 会自动退化为 icontains 匹配。
+FULLTEXT_INDEXES = (
+    ("market_product", "ft_product_title_desc", "title, description"),
+    ("market_devicemodel", "ft_devicemodel_name", "name"),
+)
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({columns}) WITH PARSER ngram")
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    for table, name, _ in FULLTEXT_INDEXES:
+        schema_editor.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0007_product_hall_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_fulltext_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='defects',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='grade_label',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='grade_score',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='status',
+            field=models.CharField(choices=[('pending', '排队中'), ('running', '识别中'), ('done', '已完成'), ('failed', '失败')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='recognitionresult',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
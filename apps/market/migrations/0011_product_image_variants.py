@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, help_text='标准化后高度', null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, help_text='标准化完成时间，空表示未处理', null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumb_md_name',
+            field=models.CharField(blank=True, default='', help_text='中图（长边 720）文件名', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumb_sm_name',
+            field=models.CharField(blank=True, default='', help_text='小图（长边 240）文件名', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, help_text='标准化后宽度', null=True),
+        ),
+    ]
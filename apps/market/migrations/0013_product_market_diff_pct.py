@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0012_market_price_aggregation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='market_diff_pct',
+            field=models.FloatField(blank=True, help_text='(售价 - 市场中位价)/市场中位价，负数表示低于市场价', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'market_diff_pct'], name='market_prod_status_099756_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_product_market_diff_pct'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(help_text='关联的商品，完成交易后商品即售出', on_delete=django.db.models.deletion.PROTECT, to='market.product'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='market_orde_status_ee6d38_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_order_product_fk_unpaid_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('order_completed', '订单完成'), ('order_refunded', '订单退款/取消'), ('payment_cancelled', '取消支付'), ('late_shipment', '发货超时'), ('dispute_lost', '纠纷判负'), ('manual_adjust', '人工调整')], max_length=32)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+                ('next_attempt_at', models.DateTimeField(help_text='最早可处理时间（失败后按退避推迟）')),
+                ('processed_at', models.DateTimeField(blank=True, help_text='写入积分成功的时间', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_outbox', to='market.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'next_attempt_at'], name='market_cred_process_c22138_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'event_type'), name='uniq_credit_outbox_order_event')],
+            },
+        ),
+    ]
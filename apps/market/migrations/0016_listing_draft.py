@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:10
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_credit_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingDraft',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('draft_key', models.CharField(max_length=64)),
+                ('meta', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='步骤1 填写的商品信息', null=True)),
+                ('analysis', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='主图识别结果', null=True)),
+                ('estimate', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='估价入参指纹 + 结果', null=True)),
+                ('updated_at', models.DateTimeField(db_index=True, help_text='最近写入时间（TTL 从这里算）')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listing_drafts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'draft_key'), name='uniq_listing_draft_user_key')],
+            },
+        ),
+    ]
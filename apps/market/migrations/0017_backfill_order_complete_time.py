@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import F
+
+
+BATCH_SIZE = 2000
+
+
+def backfill_complete_time(apps, schema_editor):
+    """历史已完成订单 complete_time 为空的用 updated_at 回填（按主键分批），成交价聚合才能扫到它们。
+
+    回填的时间可能早于已有水位，增量扫描会漏掉：有回填时删除 market_price_stat 水位，
+    下次 aggregate_market_prices 按全量重建。
+    """
+    Order = apps.get_model("market", "Order")
+    JobWatermark = apps.get_model("market", "JobWatermark")
+
+    pending = Order.objects.filter(status="completed", complete_time__isnull=True)
+    filled = 0
+    while True:
+        ids = list(pending.order_by("id").values_list("id", flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        filled += pending.filter(id__in=ids).update(complete_time=F("updated_at"))
+
+    if filled:
+        JobWatermark.objects.filter(name="market_price_stat").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_listing_draft'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_complete_time, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:26
+
+import time
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    """建好唯一的一行（id=1），版本从当前毫秒时间戳起，不与旧 LocMem 里的版本冲突。"""
+    CatalogVersion = apps.get_model("market", "CatalogVersion")
+    CatalogVersion.objects.get_or_create(pk=1, defaults={"version": int(time.time() * 1000)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0017_backfill_order_complete_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0, help_text='毫秒时间戳，单调递增')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
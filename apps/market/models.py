@@ -1,5 +1,7 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Coalesce, NullIf
 
 
 # 1. 设备基础库
@@ -174,6 +176,45 @@ class ValuationChoice(models.Model):
 
 # 3. 商品与交易
 
+def main_image_subquery(product_ref, thumb=False):
+    """商品主图文件名的子查询；product_ref 为指向商品 id 的 OuterRef。
+
+    thumb=True 时返回小缩略图，未生成时回退原图。
+    """
+    qs = ProductImage.objects.filter(product=product_ref).order_by("sort_order", "id")
+    if not thumb:
+        return models.Subquery(qs.values("image_name")[:1])
+    return models.Subquery(
+        qs.annotate(display_name=Coalesce(NullIf("thumb_sm_name", models.Value("")), "image_name"))
+        .values("display_name")[:1]
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    """商品查询集：封装大厅/详情常用的批量加载逻辑，避免序列化时逐行查询。"""
+
+    def with_relations(self):
+        """一次 JOIN 带出卖家与 型号->品牌->类目。"""
+        return self.select_related(
+            "seller",
+            "device_model",
+            "device_model__brand",
+            "device_model__brand__category",
+        )
+
+    def with_main_image(self):
+        """以相关子查询注解主图原图（main_image_name）与列表小图（main_thumb_name），整页只需一条 SQL。
+
+        主图规则与 ProductImage.Meta.ordering 一致：sort_order 最小，其次 id 最小；
+        小图未生成时回退原图。
+        """
+        pk = models.OuterRef("pk")
+        return self.annotate(
+            main_image_name=main_image_subquery(pk),
+            main_thumb_name=main_image_subquery(pk, thumb=True),
+        )
+
+
 class Product(models.Model):
     """
     二手商品信息：
@@ -207,6 +248,16 @@ class Product(models.Model):
         on_delete=models.PROTECT,
         help_text="关联的设备型号",
     )
+    # 冗余类目：等于 device_model.brand.category，上架时写入，
+    # 大厅按类目筛选无需再 JOIN 型号/品牌表（历史数据用 backfill_product_category 回填）
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="products",
+        help_text="所属类目（冗余自 device_model -> brand -> category）",
+    )
 
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -260,6 +311,52 @@ class Product(models.Model):
         help_text="估价时用户选择的配置与成色快照（JSON）",
     )
 
+    # --- 上架时的估价/比价结果（原先只存在 condition_data 中，提升为列以便 SQL 排序/筛选） ---
+    original_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="购入原价（卖家填写）",
+    )
+    years_used = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="已使用年限",
+    )
+    grade_label = models.CharField(
+        max_length=20,
+        null=True,
+        blank=True,
+        help_text="成色标签，如 9成新（对应 ConditionGrade.label）",
+    )
+    estimated_min = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    estimated_max = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    estimated_mid = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    diff_pct = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="售价相对估价区间的偏离百分比：高于为正，低于为负，区间内为 0",
+    )
+    value_score = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="性价比评分 0~100，越高越划算",
+    )
+    market_tag = models.CharField(
+        max_length=50,
+        null=True,
+        blank=True,
+        help_text="比价文案，如 低于市场价 5.0%",
+    )
+    # 与成交价中位数（MarketPriceStat.p50）比较的结果，由 MarketComparisonService 批量刷新；
+    # 同值写入该商品最新的 ValuationSnapshot.market_diff_pct。无成交统计时为空
+    market_diff_pct = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="(售价 - 市场中位价)/市场中位价，负数表示低于市场价",
+    )
+
     created_at = models.DateTimeField(
         auto_now_add=True,
         help_text="商品创建时间",
@@ -269,6 +366,31 @@ class Product(models.Model):
         help_text="商品最近更新时间",
     )
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 大厅游标分页：WHERE status=? ORDER BY created_at DESC, id DESC
+            models.Index(fields=["status", "created_at", "id"]),
+            # 大厅按类目 / 卖家页按卖家筛选后再按时间排序
+            models.Index(fields=["status", "category", "created_at"]),
+            models.Index(fields=["status", "seller", "created_at"]),
+            # 大厅按性价比 / 比价排序、按成色筛选
+            models.Index(fields=["status", "value_score"]),
+            models.Index(fields=["status", "diff_pct"]),
+            models.Index(fields=["status", "market_diff_pct"]),
+            models.Index(fields=["status", "grade_label", "created_at"]),
+            # ?ordering= 排序与价格/成色/地区筛选
+            models.Index(fields=["status", "selling_price"]),
+            models.Index(fields=["status", "view_count"]),
+            models.Index(fields=["status", "favorite_count"]),
+            models.Index(fields=["status", "quality_grade", "selling_price"]),
+            models.Index(fields=["status", "location"]),
+            # 类目内按性价比/价格排序：如“2000 元内最划算的手机”
+            models.Index(fields=["status", "category", "value_score"]),
+            models.Index(fields=["status", "category", "selling_price"]),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -327,6 +449,22 @@ class ProductImage(models.Model):
         help_text="文件大小（字节，可选）",
     )
 
+    # 文件内容 sha256（上传时边写边算），用于识别结果按内容复用
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="图片内容 sha256（hex）",
+    )
+
+    # 标准化结果（见 imaging.py / image_pipeline.py）：原图重编码为 progressive JPEG，另生成固定尺寸 WebP 缩略图
+    width = models.PositiveIntegerField(null=True, blank=True, help_text="标准化后宽度")
+    height = models.PositiveIntegerField(null=True, blank=True, help_text="标准化后高度")
+    thumb_sm_name = models.CharField(max_length=255, blank=True, default="", help_text="小图（长边 240）文件名")
+    thumb_md_name = models.CharField(max_length=255, blank=True, default="", help_text="中图（长边 720）文件名")
+    processed_at = models.DateTimeField(null=True, blank=True, help_text="标准化完成时间，空表示未处理")
+
     is_main = models.BooleanField(
         default=False,
         help_text="是否为主图",
@@ -352,6 +490,31 @@ class ProductImage(models.Model):
         return self.image_name
 
 
+class ListingDraft(models.Model):
+    """上架草稿的服务端状态（见 drafts.py）：每个 用户 + draft_key 一行，各步骤只写自己那一列。
+
+    存库而不是进程内缓存：多进程/多机部署时各步骤请求落到不同 worker 也能读到。
+    updated_at 早于 DRAFT_SESSION_TTL 的行视为过期，由 gc_draft_images 清理。
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="listing_drafts")
+    draft_key = models.CharField(max_length=64)
+
+    meta = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, help_text="步骤1 填写的商品信息")
+    analysis = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, help_text="主图识别结果")
+    estimate = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, help_text="估价入参指纹 + 结果")
+
+    updated_at = models.DateTimeField(db_index=True, help_text="最近写入时间（TTL 从这里算）")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "draft_key"], name="uniq_listing_draft_user_key"),
+        ]
+
+    def __str__(self):
+        return f"ListingDraft(user_id={self.user_id}, draft_key={self.draft_key})"
+
+
 # --- 识别/估价/比价相关模型 ---
 
 class RecognitionResult(models.Model):
@@ -400,7 +563,29 @@ class RecognitionResult(models.Model):
     )
     message = models.CharField(max_length=200, blank=True, help_text="识别说明/失败原因")
 
+    # 异步识别任务状态（见 analysis.py）：上传主图即入队，前端轮询/长轮询取结果
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "排队中"),
+        (STATUS_RUNNING, "识别中"),
+        (STATUS_DONE, "已完成"),
+        (STATUS_FAILED, "失败"),
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+
+    # 被识别图片的内容 sha256：相同内容的图片直接复用已完成的结果（见 recognition_cache.py）
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)
+
+    # 成色识别结果（AIService.analyze_image 的 label/score/defects）
+    grade_label = models.CharField(max_length=20, blank=True, default="")
+    grade_score = models.IntegerField(null=True, blank=True)
+    defects = models.JSONField(default=list, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"RecognitionResult(image_id={self.image_id}, ok={self.ok})"
@@ -481,12 +666,40 @@ class MarketPriceStat(models.Model):
     p90_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
     sample_size = models.PositiveIntegerField(default=0, help_text="统计样本量")
+    # 成交价分位数草图（market_stats.QuantileSketch 序列化），增量聚合时与新成交合并；空表示非成交数据（如种子数据）
+    sketch = models.JSONField(default=dict, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"MarketPriceStat({self.device_model_id})"
 
 
+class JobWatermark(models.Model):
+    """增量任务水位：记录已处理到的 (时间, id) 位置，下次从其后继续。"""
+
+    name = models.CharField(max_length=64, unique=True)
+    position_time = models.DateTimeField(null=True, blank=True)
+    position_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"JobWatermark({self.name})"
+
+
+class CatalogVersion(models.Model):
+    """目录版本号（单行计数器，见 catalog_cache.py）：目录/估价规则写入时在同一事务里 bump。
+
+    存库而不是进程内缓存：各 Web worker、管理命令看到的是同一个版本，
+    目录接口的 ETag / 缓存 key 与进程内规则表都按它失效。
+    """
+
+    version = models.BigIntegerField(default=0, help_text="毫秒时间戳，单调递增")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CatalogVersion({self.version})"
+
+
 # --- 瑕疵项 / 成色（新三步上架方案） ---
 
 class DefectItem(models.Model):
@@ -651,7 +864,8 @@ class Order(models.Model):
         on_delete=models.CASCADE,
         related_name="buy_orders",
     )
-    product = models.OneToOneField(
+    # 超时/取消的订单会把商品放回 on_sale，同一商品可再次下单，故为 ForeignKey（同一时刻最多一个未终结订单）
+    product = models.ForeignKey(
         Product,
         on_delete=models.PROTECT,
         help_text="关联的商品，完成交易后商品即售出",
@@ -744,6 +958,14 @@ class Order(models.Model):
         help_text="订单最近更新时间",
     )
 
+    class Meta:
+        indexes = [
+            # 成交价聚合（aggregate_market_prices）按 (complete_time, id) 水位增量扫描已完成订单
+            models.Index(fields=["status", "complete_time", "id"]),
+            # 超时未支付订单回收（expire_unpaid_orders）按 created_at 找过期的待支付订单
+            models.Index(fields=["status", "created_at"]),
+        ]
+
     def __str__(self):
         return self.order_no
 
@@ -800,4 +1022,33 @@ class CreditEvent(models.Model):
         ]
 
     def __str__(self):
-        return f"CreditEvent(user_id={self.user_id}, type={self.event_type}, delta={self.delta})"
\ No newline at end of file
+        return f"CreditEvent(user_id={self.user_id}, type={self.event_type}, delta={self.delta})"
+
+class CreditOutbox(models.Model):
+    """订单积分事件 outbox：与订单状态流转在同一事务写入，由 credit_outbox worker 异步写成 CreditEvent。
+
+    - 一行 = 某订单发生了一次需要记积分的事件（完成/退款/取消支付），买家/卖家各记多少由 worker 按规则展开
+    - processed_at 为空即待处理；失败累加 attempts 并按退避设置 next_attempt_at，超过上限的行留作人工排查
+    - (order, event_type) 唯一：重复入队不会重复记分（CreditEvent 本身也幂等）
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="credit_outbox")
+    event_type = models.CharField(max_length=32, choices=CreditEvent.EVENT_TYPES)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, default="")
+    next_attempt_at = models.DateTimeField(help_text="最早可处理时间（失败后按退避推迟）")
+    processed_at = models.DateTimeField(null=True, blank=True, help_text="写入积分成功的时间")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # worker 取待处理行：processed_at IS NULL AND next_attempt_at <= now
+            models.Index(fields=["processed_at", "next_attempt_at"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["order", "event_type"], name="uniq_credit_outbox_order_event"),
+        ]
+
+    def __str__(self):
+        return f"CreditOutbox(order_id={self.order_id}, type={self.event_type}, attempts={self.attempts})"
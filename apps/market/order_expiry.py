@@ -0,0 +1,81 @@
+"""超时未支付订单的自动取消（expire_unpaid_orders 命令调用）。
+
+判定：status 为 created / pending_payment 且 created_at 早于 cutoff（索引 status, created_at）。
+
+每批一个短事务：
+- select_for_update(skip_locked=True) 取最早的一批订单：正在被买家付款/取消（持有行锁）的订单直接跳过，
+  不排队等锁；只锁本批行，不锁表
+- 条件 UPDATE 取消订单（status -> refunded，记 cancel_time），WHERE 仍带未支付状态，与并发付款互斥
+- 条件 UPDATE 把这些订单锁定的商品放回 on_sale（release_locked_products，只动 status='locked' 的行，与买家取消付款共用）
+- 同一事务写 payment_cancelled 积分 outbox（credit_outbox），买家积分由 worker 批量异步写入
+已处理的订单离开过滤条件，下一批直接从头取，不需要游标；批大小控制单个事务持锁时长。
+"""
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.utils import timezone
+
+from .credit_outbox import enqueue_order_credit
+from .models import Order
+from .services import OrderStateMachine, release_locked_products
+
+# 与“取消付款”的源状态一致
+UNPAID_STATUSES = OrderStateMachine.TRANSITIONS["cancel_payment"][1]
+
+
+@dataclass
+class ExpiryStats:
+    dry_run: bool = False
+    orders: int = 0
+    products: int = 0
+    credit_events: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self):
+        elapsed = self.seconds or 1e-9
+        return {
+            "dry_run": self.dry_run,
+            "orders": self.orders,
+            "products": self.products,
+            "credit_events": self.credit_events,
+            "batches": self.batches,
+            "seconds": round(self.seconds, 3),
+            "orders_per_sec": round(self.orders / elapsed, 1),
+        }
+
+
+def stale_unpaid_orders(cutoff):
+    return Order.objects.filter(status__in=UNPAID_STATUSES, created_at__lt=cutoff)
+
+
+def expire_unpaid_orders(cutoff, batch_size=500, dry_run=False, log=None) -> ExpiryStats:
+    started = time.perf_counter()
+    stats = ExpiryStats(dry_run=dry_run)
+    qs = stale_unpaid_orders(cutoff).order_by("created_at", "id")
+
+    if dry_run:
+        stats.orders = qs.count()
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    while True:
+        with transaction.atomic():
+            rows = list(qs.select_for_update(skip_locked=True).values_list("id", "product_id", "buyer_id")[:batch_size])
+            if not rows:
+                break
+            now = timezone.now()
+            stats.orders += Order.objects.filter(id__in=[r[0] for r in rows], status__in=UNPAID_STATUSES).update(
+                status="refunded", cancel_time=now, updated_at=now
+            )
+            stats.products += release_locked_products({r[1] for r in rows}, now)
+            # 买家记 payment_cancelled：整批写 outbox，由 credit_outbox worker 批量记分
+            enqueue_order_credit([r[0] for r in rows], "payment_cancelled")
+            stats.credit_events += len(rows)
+        stats.batches += 1
+        if log:
+            log(f"batch {stats.batches}: orders={stats.orders} products={stats.products}")
+
+    stats.seconds = time.perf_counter() - started
+    return stats
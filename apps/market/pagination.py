@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """市场大厅/卖家页的游标（keyset）分页。
+
+    - 默认按 (created_at, id) 倒序；带 ?ordering= 时按视图解析的排序（如 value_score）
+    - 翻到第 N 页与第 1 页代价相同（WHERE created_at < ? + LIMIT）
+    - 依赖 Product 上的 (status, created_at, id) 复合索引
+    - 仅在 ?paginate=cursor 或携带 cursor 参数时启用，不影响旧前端的全量列表
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # 视图解析出 ?ordering= 时（如 -value_score），游标按该排序推进
+        view_ordering = view.get_ordering() if hasattr(view, "get_ordering") else None
+        return view_ordering or self.ordering
+
+    @staticmethod
+    def is_requested(request) -> bool:
+        params = request.query_params
+        return params.get("paginate") == "cursor" or "cursor" in params
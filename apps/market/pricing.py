@@ -32,10 +32,13 @@ def exp_decay(k: float, years: float) -> Decimal:
     return Decimal(str(math.exp(-k * years)))
 
 def estimate_range(original_price: Decimal, years_used: float, grade_factor: Decimal, defect_penalty: Decimal, category_code: str):
-    k = CATEGORY_K.get(category_code, 0.20)
-    base_vol = CATEGORY_VOL.get(category_code, 0.10)
+    age_factor = exp_decay(CATEGORY_K.get(category_code, 0.20), years_used)
+    return _estimate_from_age(original_price, age_factor, grade_factor, defect_penalty, category_code)
+
 
-    age_factor = exp_decay(k, years_used)
+def _estimate_from_age(original_price, age_factor, grade_factor, defect_penalty, category_code):
+    """estimate_range 的 Decimal 主体（折旧系数已算好），单条与批量共用，保证逐分一致。"""
+    base_vol = CATEGORY_VOL.get(category_code, 0.10)
     defect_penalty = clamp(defect_penalty, Decimal("0"), Decimal("0.65"))
     defect_factor = Decimal("1") - defect_penalty
 
@@ -59,6 +62,101 @@ def estimate_range(original_price: Decimal, years_used: float, grade_factor: Dec
         "defect_penalty": float(defect_penalty),
     }
 
+MAX_DEFECT_LEVEL = 3
+
+
+def parse_defect(defect):
+    """结构化瑕疵 -> (item_code, level)；支持 {"code"/"item_code": .., "level": ..}、(code, level)、"code:level"。
+
+    自由文本（如 AI 输出的“屏幕细微划痕”）返回 None。
+    """
+    try:
+        if isinstance(defect, dict):
+            code, level = defect.get("code") or defect.get("item_code"), defect.get("level")
+        elif isinstance(defect, (list, tuple)) and len(defect) == 2:
+            code, level = defect
+        elif isinstance(defect, str) and ":" in defect:
+            code, level = defect.rsplit(":", 1)
+        else:
+            return None
+        level = int(level)
+    except (TypeError, ValueError):
+        return None
+    if not code or not 0 <= level <= MAX_DEFECT_LEVEL:
+        return None
+    return str(code), level
+
+
+class DefectPenaltyMatrix:
+    """某类目的瑕疵扣减矩阵：检查项 x 损耗等级（0..MAX_DEFECT_LEVEL）的 penalty_weight，按行展平成一维元组。
+
+    打分时先把瑕疵列表压成“每个检查项一个等级”的定长向量（同一项取最重等级），
+    再对全部检查项各取一次权重求和：与瑕疵条数无关，只与该类目检查项数有关。
+    """
+
+    __slots__ = ("index", "weights", "width")
+
+    def __init__(self, weights):
+        """weights：{(item_code, level): Decimal}。"""
+        codes = sorted({code for code, _ in weights})
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.width = MAX_DEFECT_LEVEL + 1
+        flat = [Decimal("0")] * (len(codes) * self.width)
+        for (code, level), weight in weights.items():
+            if 0 < level <= MAX_DEFECT_LEVEL:
+                flat[self.index[code] * self.width + level] = Decimal(weight)
+        self.weights = tuple(flat)
+
+    def levels(self, defects):
+        """-> (每个检查项的等级向量, 矩阵无法打分的条数：自由文本 / 本类目未配置的检查项)。"""
+        vec = [0] * len(self.index)
+        unscored = 0
+        for d in defects:
+            parsed = parse_defect(d)
+            i = self.index.get(parsed[0]) if parsed else None
+            if i is None:
+                unscored += 1
+            elif parsed[1] > vec[i]:
+                vec[i] = parsed[1]
+        return vec, unscored
+
+    def score(self, levels) -> Decimal:
+        w, width = self.weights, self.width
+        return sum((w[i * width + level] for i, level in enumerate(levels)), Decimal("0"))
+
+    def penalty(self, defects) -> Decimal:
+        """矩阵打分 + 打不了分的部分按条数映射，不低于无瑕疵时的基准扣减。"""
+        levels, unscored = self.levels(defects)
+        penalty = self.score(levels)
+        if unscored:
+            penalty += defect_penalty_for_count(unscored)
+        return max(penalty, defect_penalty_for_count(0))
+
+
+def defect_penalty_for_count(defects_count: int) -> Decimal:
+    """瑕疵数量 -> 扣减比例（简单映射，后续可替换为 DefectSeverity 权重）。"""
+    if defects_count == 0:
+        return Decimal("0.02")
+    if defects_count == 1:
+        return Decimal("0.08")
+    return Decimal("0.15")
+
+def estimate_range_batch(original_prices, years_used, grade_factors, defect_penalties, category_codes):
+    """estimate_range 的批量版：各参数为等长序列，返回与输入同序的结果列表。
+
+    每条都走与 estimate_range 相同的 Decimal 计算与 quantize，结果逐分一致（float 向量化在个别
+    临界值上会差 1 分）；整批只省掉重复的部分：同一 (类目, 使用年限) 的折旧系数 exp 只算一次。
+    """
+    ages = {}
+    results = []
+    for p, y, g, d, c in zip(original_prices, years_used, grade_factors, defect_penalties, category_codes):
+        key = (c, float(y))
+        age = ages.get(key)
+        if age is None:
+            age = ages[key] = exp_decay(CATEGORY_K.get(c, 0.20), float(y))
+        results.append(_estimate_from_age(Decimal(str(p)), age, Decimal(str(g)), Decimal(str(d)), c))
+    return results
+
 def compare_price(selling_price: Decimal, estimated_min: Decimal, estimated_max: Decimal):
     # 高于 max 或低于 min 才给百分比；区间内为 0
     if selling_price > estimated_max:
@@ -0,0 +1,118 @@
+"""按图片内容（sha256）复用识别结果。
+
+- 前置层：进程内 LRU + TTL（RECOGNITION_CACHE_SIZE 条 / RECOGNITION_CACHE_TTL 秒）
+- 持久层：RecognitionResult（content_hash 列 + status=done），跨进程、重启后仍可命中
+- 同一张照片被不同草稿 / 不同用户重复上传、或重复点“识别”，都不再推理
+- 命中率：stats()，通过 /api/market/analysis/cache-stats/ 暴露（仅管理员）
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import RecognitionResult
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RecognitionCache:
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # content_hash -> (expires_at, result)
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+    @property
+    def max_entries(self) -> int:
+        return int(self._max_entries or getattr(settings, "RECOGNITION_CACHE_SIZE", 2048))
+
+    @property
+    def ttl(self) -> float:
+        return float(self._ttl or getattr(settings, "RECOGNITION_CACHE_TTL", 3600))
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _get_memory(self, content_hash):
+        with self._lock:
+            item = self._entries.get(content_hash)
+            if item is None:
+                return None
+            expires_at, result = item
+            if expires_at < time.monotonic():
+                del self._entries[content_hash]
+                return None
+            self._entries.move_to_end(content_hash)
+            return result
+
+    def _put_memory(self, content_hash, result):
+        with self._lock:
+            self._entries[content_hash] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, content_hash):
+        """命中返回 {"label", "score", "defects"}，未命中返回 None。"""
+        if not content_hash:
+            return None
+        result = self._get_memory(content_hash)
+        if result is not None:
+            self._count("memory_hits")
+            return result
+
+        row = (
+            RecognitionResult.objects.filter(content_hash=content_hash, status=RecognitionResult.STATUS_DONE)
+            .values("grade_label", "grade_score", "defects")
+            .first()
+        )
+        if row is None:
+            self._count("misses")
+            return None
+        result = {"label": row["grade_label"], "score": row["grade_score"], "defects": row["defects"]}
+        self._put_memory(content_hash, result)
+        self._count("db_hits")
+        return result
+
+    def put(self, content_hash, result):
+        if content_hash:
+            self._put_memory(content_hash, {
+                "label": result["label"], "score": result["score"], "defects": list(result["defects"]),
+            })
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for k in self._counters:
+                self._counters[k] = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self._counters)
+            size = len(self._entries)
+        lookups = c["memory_hits"] + c["db_hits"] + c["misses"]
+        hits = c["memory_hits"] + c["db_hits"]
+        return {
+            **c,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_hit_rate": round(c["memory_hits"] / lookups, 4) if lookups else 0.0,
+            "memory_entries": size,
+            "memory_max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+        }
+
+
+recognition_cache = RecognitionCache()
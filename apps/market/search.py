@@ -0,0 +1,79 @@
+"""商品 / 型号关键词搜索。
+
+- MySQL：使用 FULLTEXT 索引（ngram 分词，支持中文），MATCH ... AGAINST 自然语言模式打分排序
+  索引见 migrations/0008_fulltext_search_indexes.py
+- 其他数据库（本地 sqlite 开发/测试）：退化为 icontains 匹配 + 命中计分，语义一致但不走索引
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import DeviceModel, Product
+
+MAX_QUERY_LENGTH = 64
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+# 与 FULLTEXT 索引列保持一致（MATCH 的列清单必须与索引完全相同）
+PRODUCT_MATCH_SQL = "MATCH (market_product.title, market_product.description) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+DEVICE_MODEL_MATCH_SQL = "MATCH (market_devicemodel.name) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+
+
+def normalize_query(q) -> str:
+    q = re.sub(r"\s+", " ", str(q or "")).strip()
+    return q[:MAX_QUERY_LENGTH]
+
+
+def _use_fulltext() -> bool:
+    return connection.vendor == "mysql"
+
+
+def _fallback_relevance(terms, primary: str, secondary: str = ""):
+    """每个词：命中主字段 2 分，仅命中次字段 1 分。"""
+    score = Value(0, output_field=IntegerField())
+    for t in terms:
+        whens = [When(**{f"{primary}__icontains": t}, then=Value(2))]
+        if secondary:
+            whens.append(When(**{f"{secondary}__icontains": t}, then=Value(1)))
+        score = score + Case(*whens, default=Value(0), output_field=IntegerField())
+    return score
+
+
+def search_products(q, limit: int = DEFAULT_LIMIT, base_qs=None):
+    """返回按相关度排序的上架商品 QuerySet（已注解 relevance）。"""
+    q = normalize_query(q)
+    qs = base_qs if base_qs is not None else Product.objects.filter(status="on_sale")
+    if not q:
+        return qs.none()
+
+    if _use_fulltext():
+        qs = qs.annotate(relevance=RawSQL(PRODUCT_MATCH_SQL, (q,))).filter(relevance__gt=0)
+    else:
+        terms = q.split(" ")
+        cond = Q()
+        for t in terms:
+            cond |= Q(title__icontains=t) | Q(description__icontains=t)
+        qs = qs.filter(cond).annotate(relevance=_fallback_relevance(terms, "title", "description"))
+
+    return qs.order_by("-relevance", "-id")[:limit]
+
+
+def search_device_models(q, limit: int = DEFAULT_LIMIT):
+    """返回按相关度排序的型号 QuerySet（已注解 relevance）。"""
+    q = normalize_query(q)
+    qs = DeviceModel.objects.select_related("brand")
+    if not q:
+        return qs.none()
+
+    if _use_fulltext():
+        qs = qs.annotate(relevance=RawSQL(DEVICE_MODEL_MATCH_SQL, (q,))).filter(relevance__gt=0)
+    else:
+        terms = q.split(" ")
+        cond = Q()
+        for t in terms:
+            cond |= Q(name__icontains=t)
+        qs = qs.filter(cond).annotate(relevance=_fallback_relevance(terms, "name"))
+
+    return qs.order_by("-relevance", "id")[:limit]
@@ -99,11 +99,15 @@ class OrderDetailSerializer(serializers.ModelSerializer):
         ]
 
     def get_product_main_image(self, obj):
+        # 优先使用 OrderViewSet 注解的主图小图，避免逐行查询
+        if hasattr(obj, "product_main_image_name"):
+            image_name = obj.product_main_image_name
+            return f"/media/products/{image_name}" if image_name else None
         try:
             img = obj.product.images.order_by("sort_order", "id").first()
             if not img:
                 return None
-            return f"/media/products/{img.image_name}"
+            return f"/media/products/{img.thumb_sm_name or img.image_name}"
         except Exception:
             return None
 
@@ -158,6 +162,7 @@ class PublishSerializer(serializers.Serializer):
 
 class ProductListSerializer(serializers.ModelSerializer):
     main_image = serializers.SerializerMethodField()
+    main_thumb = serializers.SerializerMethodField()
     created_at = serializers.SerializerMethodField()
     seller_id = serializers.SerializerMethodField()
     seller_name = serializers.SerializerMethodField()
@@ -165,20 +170,11 @@ class ProductListSerializer(serializers.ModelSerializer):
     category_id = serializers.SerializerMethodField()
     device_model_id = serializers.SerializerMethodField()
 
-    # Optional fields (may not exist as real model fields). Read from attrs or condition_data.
-    original_price = serializers.SerializerMethodField()
-    years_used = serializers.SerializerMethodField()
-    grade_label = serializers.SerializerMethodField()
+    # original_price / years_used / grade_label / estimated_* / market_tag / diff_pct / market_diff_pct / value_score
+    # 是 Product 的真实列，按普通模型字段输出；以下两项仍只存在 condition_data 中。
     grade_score = serializers.SerializerMethodField()
     defects = serializers.SerializerMethodField()
 
-    estimated_min = serializers.SerializerMethodField()
-    estimated_max = serializers.SerializerMethodField()
-    estimated_mid = serializers.SerializerMethodField()
-    market_tag = serializers.SerializerMethodField()
-    diff_pct = serializers.SerializerMethodField()
-    value_score = serializers.SerializerMethodField()
-
     class Meta:
         model = Product
         fields = [
@@ -201,20 +197,36 @@ class ProductListSerializer(serializers.ModelSerializer):
             "estimated_mid",
             "market_tag",
             "diff_pct",
+            "market_diff_pct",
             "value_score",
             "status",
             "view_count",
             "favorite_count",
             "main_image",
+            "main_thumb",
             "created_at",
         ]
 
-    def get_main_image(self, obj):
+    def _main_image_names(self, obj):
+        # 优先使用 ProductQuerySet.with_main_image() 注解的主图，避免逐行查询
+        if hasattr(obj, "main_image_name"):
+            return obj.main_image_name, getattr(obj, "main_thumb_name", None) or obj.main_image_name
         img = obj.images.order_by("sort_order", "id").first()
         if not img:
+            return None, None
+        return img.image_name, img.thumb_sm_name or img.image_name
+
+    def get_main_image(self, obj):
+        image_name, _ = self._main_image_names(obj)
+        if not image_name:
             return None
-        # 返回相对路径，交由前端按 /media/products/<name> 展示
-        return f"/media/products/{img.image_name}"
+        # 返回相对路径（原图），交由前端按 /media/products/<name> 展示
+        return f"/media/products/{image_name}"
+
+    def get_main_thumb(self, obj):
+        # 列表卡片用的小图（未生成时为原图）；详情接口不返回
+        _, thumb_name = self._main_image_names(obj)
+        return f"/media/products/{thumb_name}" if thumb_name else None
 
     def get_created_at(self, obj):
         dt = getattr(obj, "created_at", None)
@@ -255,7 +267,7 @@ class ProductListSerializer(serializers.ModelSerializer):
         return getattr(seller, "address", None)
 
     def get_category_id(self, obj):
-        # Prefer explicit field; fall back via device_model->brand->category
+        # Prefer denormalized Product.category_id; fall back via device_model->brand->category (not yet backfilled)
         cid = getattr(obj, "category_id", None)
         if cid is not None:
             return cid
@@ -271,24 +283,6 @@ class ProductListSerializer(serializers.ModelSerializer):
         cd = getattr(obj, "condition_data", None)
         return cd if isinstance(cd, dict) else {}
 
-    def get_original_price(self, obj):
-        v = getattr(obj, "original_price", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("original_price")
-
-    def get_years_used(self, obj):
-        v = getattr(obj, "years_used", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("years_used")
-
-    def get_grade_label(self, obj):
-        v = getattr(obj, "grade_label", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("grade_label")
-
     def get_grade_score(self, obj):
         v = getattr(obj, "grade_score", None)
         if v is not None:
@@ -300,39 +294,3 @@ class ProductListSerializer(serializers.ModelSerializer):
         if v is not None:
             return v
         return self._cond(obj).get("defects")
-
-    def get_estimated_min(self, obj):
-        v = getattr(obj, "estimated_min", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("estimated_min")
-
-    def get_estimated_max(self, obj):
-        v = getattr(obj, "estimated_max", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("estimated_max")
-
-    def get_estimated_mid(self, obj):
-        v = getattr(obj, "estimated_mid", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("estimated_mid")
-
-    def get_market_tag(self, obj):
-        v = getattr(obj, "market_tag", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("market_tag")
-
-    def get_diff_pct(self, obj):
-        v = getattr(obj, "diff_pct", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("diff_pct")
-
-    def get_value_score(self, obj):
-        v = getattr(obj, "value_score", None)
-        if v is not None:
-            return v
-        return self._cond(obj).get("value_score")
\ No newline at end of file
@@ -1,13 +1,24 @@
+from contextlib import nullcontext
+import math
 from decimal import Decimal
 import uuid
 
 from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from .models import DeviceModel, ValuationChoice, Product, Order
+from .models import Product, Order, MarketPriceStat, ValuationSnapshot
+from .credit_outbox import enqueue_order_credit
+from .pricing import estimate_range, estimate_range_batch
+from .valuation_rules import get_rule_table
 
 User = get_user_model()
 
+MAX_DEPRECIATION = Decimal("0.9")
+DEFAULT_GRADE_FACTOR = Decimal("0.75")
+MAX_BATCH_SIZE = 10000
+
 
 class ValuationEngine:
     """
@@ -18,35 +29,196 @@ class ValuationEngine:
     def calculate_price(device_model_id, choice_ids):
         """
         核心算法：基准价 * (1 - 总折旧率) * 市场波动系数
+
+        规则（型号基准价、选项折旧率）来自预编译的进程内规则表，命中时估价本身不查库。
         """
-        try:
-            device = DeviceModel.objects.get(id=device_model_id)
-            base_price = device.base_price
+        rules = get_rule_table()
+        base_price = rules.base_price(device_model_id)
+        if base_price is None:
+            return Decimal("0.00")
+
+        # 累加折旧率 (例如：屏幕划痕-5% + 电池损耗-10% = -15%)
+        total_depreciation = rules.total_depreciation(choice_ids)
 
-            total_depreciation = 0.0
+        # 防止折旧超过100%
+        if total_depreciation > MAX_DEPRECIATION:
+            total_depreciation = MAX_DEPRECIATION
 
-            # 获取所有用户选择的选项
-            choices = ValuationChoice.objects.filter(id__in=choice_ids)
+        # 动态策略：简单的市场波动模拟 (实际项目中可接入爬虫数据或Redis缓存)
+        market_factor = Decimal("1.0")
+        # 这里可以扩展更多逻辑...
 
-            for choice in choices:
-                # 累加折旧率 (例如：屏幕划痕-5% + 电池损耗-10% = -15%)
-                total_depreciation += choice.depreciation_rate
+        final_price = base_price * (Decimal("1.0") - total_depreciation) * market_factor
 
-            # 防止折旧超过100%
-            if total_depreciation > 0.9:
-                total_depreciation = 0.9
+        # 最低回收价保护
+        return max(final_price, Decimal("50.00"))
 
-            # 动态策略：简单的市场波动模拟 (实际项目中可接入爬虫数据或Redis缓存)
-            market_factor = Decimal("1.0")
-            # 这里可以扩展更多逻辑...
+    @staticmethod
+    def estimate_listing(category_id, years_used, original_price, grade_id=None, grade_label="", defects=()):
+        """上架草稿估价区间（drafts/<key>/estimate/ 与 publish/ 共用），规则来自预编译规则表，不查库。
 
-            final_price = base_price * (Decimal("1.0") - Decimal(str(total_depreciation))) * market_factor
+        grade：优先 grade_id，其次 (类目, grade_label) 匹配 ConditionGrade，都没有按 DEFAULT_GRADE_FACTOR。
+        类目不存在抛 ValueError。
+        """
+        rules = get_rule_table()
+        category = rules.category(category_id)
+        if category is None:
+            raise ValueError(f"category {category_id} not found")
+        name, code = category
 
-            # 最低回收价保护
-            return max(final_price, Decimal("50.00"))
+        grade = rules.grade(category_id, grade_id=grade_id, label=grade_label or "")
+        if grade is not None:
+            grade_label, grade_factor = grade.label, grade.factor
+        else:
+            grade_factor = DEFAULT_GRADE_FACTOR
 
-        except DeviceModel.DoesNotExist:
-            return Decimal("0.00")
+        r = estimate_range(
+            original_price=original_price,
+            years_used=years_used,
+            grade_factor=grade_factor,
+            defect_penalty=rules.defect_penalty(category_id, defects),
+            category_code=code or "other",
+        )
+        return {
+            "category": {"id": category_id, "name": name, "code": code},
+            "grade": {"label": grade_label or "", "factor": grade_factor},
+            **r,
+        }
+
+    @staticmethod
+    def estimate_batch(items):
+        """批量估价，结果与输入同序。每项二选一：
+
+        - 型号估价：{"device_model_id": 1, "choice_ids": [3, 5]}
+          -> {"estimated_price": "..."}
+        - 区间估价（同 drafts/<key>/estimate/）：
+          {"category_id": 1, "years_used": 1.5, "original_price": "5999", "grade_label": "9成新" | "grade_id": 2,
+           "defects": [{"code": "screen", "level": 2}] | ["屏幕细微划痕"]}
+          -> {"estimated_min": "...", "estimated_max": "...", "estimated_mid": "...", "volatility": 0.12, ...}
+
+        非法项返回 {"error": "..."}，不影响其他项。规则来自预编译规则表，整批不查库；
+        区间估价收集后一次性交给 estimate_range_batch（同类目同年限的折旧系数只算一次）。
+        """
+        rules = get_rule_table()
+        results = [None] * len(items)
+
+        range_index, prices, years, grades, penalties, codes, grade_labels = [], [], [], [], [], [], []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i] = {"error": "item must be an object"}
+                continue
+            try:
+                if item.get("device_model_id") is not None:
+                    choice_ids = [int(c) for c in (item.get("choice_ids") or [])]
+                    price = ValuationEngine.calculate_price(int(item["device_model_id"]), choice_ids)
+                    results[i] = {"estimated_price": str(price.quantize(Decimal("0.01")))}
+                    continue
+
+                category_id = int(item["category_id"])
+                category = rules.category(category_id)
+                if category is None:
+                    raise ValueError(f"category {category_id} not found")
+                year = float(item["years_used"])
+                price = Decimal(str(item["original_price"]))
+                # "nan" / "inf" 能通过 float() / Decimal()，必须显式拒绝
+                if not (math.isfinite(year) and price.is_finite()) or year < 0 or price <= 0:
+                    raise ValueError("years_used must be >= 0 and original_price > 0 (finite)")
+
+                grade = rules.grade(category_id, grade_id=item.get("grade_id"), label=item.get("grade_label") or "")
+                defects = item.get("defects") or []
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                results[i] = {"error": f"invalid item: {e}"}
+                continue
+
+            range_index.append(i)
+            prices.append(price)
+            years.append(year)
+            grades.append(grade.factor if grade else DEFAULT_GRADE_FACTOR)
+            grade_labels.append(grade.label if grade else (item.get("grade_label") or ""))
+            penalties.append(rules.defect_penalty(category_id, defects))
+            codes.append(category[1] or "other")
+
+        for i, label, r in zip(range_index, grade_labels, estimate_range_batch(prices, years, grades, penalties, codes)):
+            results[i] = {
+                "grade_label": label,
+                "estimated_min": str(r["estimated_min"]),
+                "estimated_max": str(r["estimated_max"]),
+                "estimated_mid": str(r["estimated_mid"]),
+                "volatility": r["volatility"],
+                "defect_penalty": r["defect_penalty"],
+            }
+        return results
+
+
+class MarketComparisonService:
+    """与成交价中位数比价：批量写 ValuationSnapshot 的 market_* 缓存字段，并同步到 Product.market_diff_pct（有索引，
+    大厅“低于市场价”排序直接用）。
+
+    - 每个在售商品维护其最新一条快照；没有快照的补建一条（估价取商品上的估价列）
+    - 触发：aggregate_market_prices 更新统计后按型号刷新；发布商品时刷新该商品；refresh_market_comparisons 命令全量
+    """
+
+    @staticmethod
+    def refresh(product_ids=None, device_model_ids=None, batch_size=1000) -> int:
+        qs = Product.objects.filter(status="on_sale")
+        if product_ids is not None:
+            qs = qs.filter(id__in=list(product_ids))
+        if device_model_ids is not None:
+            qs = qs.filter(device_model_id__in=list(device_model_ids))
+
+        refreshed, last_id = 0, 0
+        while True:
+            rows = list(
+                qs.filter(id__gt=last_id).order_by("id").values_list(
+                    "id", "device_model_id", "selling_price", "estimated_price", "estimated_min", "estimated_max",
+                )[:batch_size]
+            )
+            if not rows:
+                return refreshed
+            last_id = rows[-1][0]
+
+            medians = dict(
+                MarketPriceStat.objects.filter(device_model_id__in={r[1] for r in rows}, p50_price__gt=0)
+                .values_list("device_model_id", "p50_price")
+            )
+            latest_ids = (
+                ValuationSnapshot.objects.filter(product_id__in=[r[0] for r in rows])
+                .values("product_id").annotate(latest=Max("id")).values_list("latest", flat=True)
+            )
+            snapshots = {s.product_id: s for s in ValuationSnapshot.objects.filter(id__in=list(latest_ids))}
+
+            products, to_update, to_create = [], [], []
+            for product_id, device_model_id, selling, estimated, est_min, est_max in rows:
+                median = medians.get(device_model_id)
+                if median is None:
+                    products.append(Product(id=product_id, market_diff_pct=None))
+                    continue
+                diff = round(float((selling - median) / median), 4)
+                products.append(Product(id=product_id, market_diff_pct=diff))
+
+                snap = snapshots.get(product_id)
+                if snap is None:
+                    snap = ValuationSnapshot(
+                        product_id=product_id,
+                        device_model_id=device_model_id,
+                        estimated_price=estimated,
+                        suggested_min=est_min or 0,
+                        suggested_max=est_max or 0,
+                    )
+                    to_create.append(snap)
+                else:
+                    to_update.append(snap)
+                snap.market_median = median
+                snap.market_diff_pct = diff
+                snap.value_score = -diff
+
+            with transaction.atomic():
+                Product.objects.bulk_update(products, ["market_diff_pct"], batch_size=batch_size)
+                ValuationSnapshot.objects.bulk_update(
+                    to_update, ["market_median", "market_diff_pct", "value_score"], batch_size=batch_size
+                )
+                ValuationSnapshot.objects.bulk_create(to_create, batch_size=batch_size)
+            refreshed += len(rows)
 
 
 class TradeService:
@@ -55,28 +227,40 @@ class TradeService:
     """
 
     @staticmethod
-    @transaction.atomic
     def create_order(user, product_id):
-        product = Product.objects.select_for_update().get(id=product_id)
+        """下单：条件 UPDATE 抢占商品，不持有行锁排队。
 
-        if product.status != "on_sale":
-            raise ValueError("商品不可购买")
+        1. 无锁读一次商品（状态/卖家/价格）：已售出/已锁定/自己的商品直接失败，连行锁都不碰
+        2. UPDATE ... SET status='locked' WHERE id=? AND status='on_sale' AND selling_price=?：
+           只影响一行，抢到的买家继续，其余买家拿到 0 行失败
+        3. 创建订单
 
-        if product.seller == user:
+        2、3 在同一个短事务里：建单失败（或进程在两步之间退出）时抢占一起回滚，商品不会卡在 locked；
+        事务里只有这两条写，行锁只持有到 INSERT 结束，其余买家最多等这一下。
+        """
+        row = Product.objects.filter(id=product_id).values_list("status", "seller_id", "selling_price").first()
+        if row is None:
+            raise ValueError("商品不存在")
+        status, seller_id, price = row
+        if seller_id == user.id:
             raise ValueError("不能购买自己的商品")
+        if status != "on_sale":
+            raise ValueError("商品不可购买")
 
-        # 锁定商品
-        product.status = "locked"
-        product.save()
+        with transaction.atomic():
+            reserved = Product.objects.filter(id=product_id, status="on_sale", selling_price=price).update(
+                status="locked", updated_at=timezone.now()
+            )
+            if not reserved:
+                raise ValueError("商品不可购买")
 
-        order = Order.objects.create(
-            order_no=str(uuid.uuid4()).replace("-", ""),
-            buyer=user,
-            product=product,
-            amount=product.selling_price,
-            status="pending_payment",
-        )
-        return order
+            return Order.objects.create(
+                order_no=uuid.uuid4().hex,
+                buyer=user,
+                product_id=product_id,
+                amount=price,
+                status="pending_payment",
+            )
 
     @staticmethod
     @transaction.atomic
@@ -84,29 +268,107 @@ class TradeService:
         """
         完成订单：解冻资金，打款给卖家，增加信用分
         """
-        order = Order.objects.select_for_update().get(id=order_id)
-
-        if order.buyer != user:
-            raise PermissionError("无权操作")
-
-        if order.status != "shipped":
-            raise ValueError("订单状态不正确")
-
-        # 1. 更新订单状态
-        order.status = "completed"
-        order.save()
+        # 1. 更新订单状态（shipped -> completed，条件 UPDATE，重复提交只有一次生效）
+        OrderStateMachine.transition(order_id, user, "confirm_receipt")
 
+        order = Order.objects.select_related("product").get(id=order_id)
         product = order.product
         product.status = "sold"
-        product.save()
+        product.save(update_fields=["status", "updated_at"])
 
         # 2. 资金划转 (简化版，实际应调用支付网关分账接口)
-        seller = product.seller
-        seller.balance += order.amount
-        seller.save()
+        User.objects.filter(pk=product.seller_id).update(balance=F("balance") + order.amount)
 
-        # 3. 信用积分体系：交易完成，双方加分
-        seller.update_credit(10)
-        user.update_credit(10)
+        # 3. 信用积分体系：交易完成双方加分，已随状态流转写入 outbox（order_completed）
+        return order
+
+
+class InvalidOrderTransition(ValueError):
+    """订单当前状态不允许该操作；status 为订单实际状态，terminal 表示已是终态。"""
+
+    def __init__(self, status, terminal=False):
+        super().__init__("order is terminal" if terminal else "invalid status")
+        self.status = status
+        self.terminal = terminal
+
+
+def release_locked_products(product_ids, now=None) -> int:
+    """把订单锁定的商品放回 on_sale，返回放回的行数。
+
+    条件 UPDATE 只动仍为 locked 的行（已售出/已被放回的不动）；product_ids 可为 id 集合，
+    也可为 values("product_id") 子查询。取消付款 / 退款与超时取消共用，调用方负责与订单状态变更同一事务。
+    """
+    return Product.objects.filter(id__in=product_ids, status="locked").update(
+        status="on_sale", updated_at=now or timezone.now()
+    )
 
-        return order
\ No newline at end of file
+
+class OrderStateMachine:
+    """
+    订单状态机：每个操作是一条条件 UPDATE
+
+        UPDATE market_order SET status=?, <时间字段>=?, updated_at=?
+        WHERE id=? AND status IN (...) AND <操作者是买家/卖家>
+
+    一次往返完成“校验 + 流转 + 记时间”，并发/重复点击只有一个请求命中 1 行，其余命中 0 行；
+    只有命中 0 行时才再读一次订单，区分 不存在 / 无权限 / 已终态 / 状态不对。
+    需要记积分的操作在同一事务里写 CreditOutbox，请求本身不锁用户行；
+    取消付款 / 退款在同一事务里把订单锁定的商品放回 on_sale。
+    """
+
+    TERMINAL = frozenset({"completed", "refunded"})
+
+    # 操作 -> (操作方, 允许的源状态, 目标状态, 时间字段)
+    TRANSITIONS = {
+        "pay": ("buyer", frozenset({"created", "pending_payment"}), "pending_shipment", "pay_time"),
+        "ship": ("seller", frozenset({"pending_shipment"}), "shipped", "ship_time"),
+        "confirm_receipt": ("buyer", frozenset({"shipped"}), "completed", "complete_time"),
+        "cancel_payment": ("buyer", frozenset({"created", "pending_payment"}), "refunded", "cancel_time"),
+        "refund": ("buyer", frozenset({"shipped"}), "refunded", "cancel_time"),
+    }
+
+    # 操作成功后需要记的积分事件（见 credit_outbox.CREDIT_RULES）
+    CREDIT_EVENTS = {
+        "confirm_receipt": "order_completed",
+        "cancel_payment": "payment_cancelled",
+        "refund": "order_refunded",
+    }
+
+    # 操作成功后商品放回 on_sale（release_locked_products）
+    RELEASES_PRODUCT = frozenset({"cancel_payment", "refund"})
+
+    @classmethod
+    def transition(cls, order_id, user, action) -> str:
+        """执行流转并返回新状态。
+
+        - 订单不存在：Order.DoesNotExist
+        - 操作者不是该订单的买家/卖家：PermissionError
+        - 状态不允许：InvalidOrderTransition（带订单当前状态）
+        """
+        role, sources, target, time_field = cls.TRANSITIONS[action]
+        now = timezone.now()
+
+        qs = Order.objects.filter(id=order_id, status__in=sources)
+        if role == "buyer":
+            qs = qs.filter(buyer_id=user.id)
+        else:
+            # 子查询而非 JOIN：MySQL 上 UPDATE 仍是单条语句，不会先 SELECT 主键
+            qs = qs.filter(product_id__in=Product.objects.filter(seller_id=user.id).values("id"))
+        credit_event = cls.CREDIT_EVENTS.get(action)
+        releases = action in cls.RELEASES_PRODUCT
+        # 有附带写入的操作与状态变更同一事务：积分写 outbox（由 credit_outbox worker 异步记分）、商品放回 on_sale
+        with transaction.atomic() if credit_event or releases else nullcontext():
+            if qs.update(status=target, updated_at=now, **{time_field: now}):
+                if releases:
+                    release_locked_products(Order.objects.filter(id=order_id).values("product_id"), now)
+                if credit_event:
+                    enqueue_order_credit([order_id], credit_event)
+                return target
+
+        row = Order.objects.filter(id=order_id).values_list("status", "buyer_id", "product__seller_id").first()
+        if row is None:
+            raise Order.DoesNotExist("订单不存在")
+        status, buyer_id, seller_id = row
+        if (buyer_id if role == "buyer" else seller_id) != user.id:
+            raise PermissionError("无权操作")
+        raise InvalidOrderTransition(status, terminal=status in cls.TERMINAL)
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_save
+
+from .catalog_cache import bump_catalog_version
+from .models import (
+    Brand,
+    Category,
+    ConditionGrade,
+    DefectItem,
+    DefectSeverity,
+    DeviceModel,
+    ValuationChoice,
+    ValuationOption,
+)
+
+# 目录 + 估价规则表：任一变更都 bump 目录版本
+CATALOG_MODELS = (
+    Category,
+    Brand,
+    DeviceModel,
+    ValuationOption,
+    ValuationChoice,
+    DefectItem,
+    DefectSeverity,
+    ConditionGrade,
+)
+
+
+def catalog_changed(sender, **kwargs):
+    """目录/估价规则变更：在同一事务里 bump 目录版本（库里单行计数器），提交后各进程的缓存/ETag/规则表失效。"""
+    bump_catalog_version()
+
+
+for _model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=_model, dispatch_uid=f"catalog_changed_save_{_model.__name__}")
+    post_delete.connect(catalog_changed, sender=_model, dispatch_uid=f"catalog_changed_delete_{_model.__name__}")
@@ -0,0 +1,215 @@
+"""型号输入联想（typeahead）：进程内前缀 + trigram 索引。
+
+- 索引内容："品牌 型号" 文本（小写、去空白后的紧凑形式，"iphone13" 可命中 "iPhone 13"）
+- 排序：型号名前缀命中 > 品牌+型号前缀命中 > 子串命中；同档按型号名长度、id
+- 短查询（<= SHORT_PREFIX_LEN 个字符）：构建时预排好每个前缀的 Top-K（全局 + 按类目各一份）
+- 长查询：取最短的 trigram 倒排表（已按排序键有序）顺序校验子串，前缀档凑满即提前结束
+- 指定 brand_id 时直接扫描该品牌下的型号（单品牌型号数很少）
+- 刷新：目录版本号（catalog_cache，存库）变化即全量重建——import_zol_products / seed_devices 与导入同一事务 bump，
+  所有 Web 进程最多 CATALOG_VERSION_CHECK_SECONDS 后的下次请求即重建；另外每隔 CHECK_INTERVAL 秒拉取
+  id > 已索引最大 id 的新型号、每隔 REBUILD_INTERVAL 秒全量重建，兜底绕过信号的写入
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+from .catalog_cache import get_catalog_version
+from .models import DeviceModel
+
+CHECK_INTERVAL = 5.0
+REBUILD_INTERVAL = 600.0
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+SHORT_PREFIX_LEN = 3
+SHORT_TOPK = 200
+
+_WS = re.compile(r"\s+")
+
+
+def _normalize(text) -> str:
+    return _WS.sub(" ", str(text or "").lower()).strip()
+
+
+def _compact(text) -> str:
+    return _WS.sub("", str(text or "").lower())
+
+
+def _trigrams(s: str):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+@dataclass(frozen=True)
+class SuggestEntry:
+    id: int
+    name: str
+    brand_id: int
+    brand_name: str
+    category_id: int
+    name_key: str
+    full_key: str
+
+    @property
+    def sort_key(self):
+        return (len(self.name), self.id)
+
+    def rank(self, qc: str):
+        """命中档位：0 型号名前缀 / 1 品牌+型号前缀 / 2 子串；不命中返回 None。"""
+        if self.name_key.startswith(qc):
+            return 0
+        if self.full_key.startswith(qc):
+            return 1
+        if qc in self.full_key:
+            return 2
+        return None
+
+    def prefix_keys(self):
+        keys = {self.name_key, self.full_key}
+        keys.update(_normalize(self.name).split(" "))
+        keys.update(_normalize(self.brand_name).split(" "))
+        keys.discard("")
+        return keys
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "brand_id": self.brand_id,
+            "brand_name": self.brand_name,
+            "category_id": self.category_id,
+        }
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """一次构建的完整只读索引；更新时整体替换引用，查询无需加锁。"""
+
+    entries: dict       # id -> SuggestEntry
+    trigrams: dict      # trigram -> [id]（按 sort_key 有序）
+    short: dict         # (category_id | None, prefix) -> [id]（按 rank、sort_key 排好的 Top-K）
+    by_brand: dict      # brand_id -> [id]
+    max_id: int
+
+
+class DeviceModelSuggestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snap = _Snapshot({}, {}, {}, {}, 0)
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._version = None
+
+    # --- 构建 / 增量 ---
+
+    @staticmethod
+    def _load(qs):
+        rows = qs.values_list("id", "name", "brand_id", "brand__name", "brand__category_id")
+        return [
+            SuggestEntry(
+                id=dm_id,
+                name=name,
+                brand_id=brand_id,
+                brand_name=brand_name,
+                category_id=category_id,
+                name_key=_compact(name),
+                full_key=_compact(f"{brand_name}{name}"),
+            )
+            for dm_id, name, brand_id, brand_name, category_id in rows.iterator(chunk_size=2000)
+        ]
+
+    @staticmethod
+    def _build(entries: dict) -> _Snapshot:
+        ordered = sorted(entries.values(), key=lambda e: e.sort_key)
+
+        trigrams, by_brand, short_sets = {}, {}, {}
+        for e in ordered:
+            for g in _trigrams(e.full_key):
+                trigrams.setdefault(g, []).append(e.id)
+            by_brand.setdefault(e.brand_id, []).append(e.id)
+            prefixes = {k[:n] for k in e.prefix_keys() for n in range(1, min(len(k), SHORT_PREFIX_LEN) + 1)}
+            for p in prefixes:
+                short_sets.setdefault((None, p), []).append(e.id)
+                short_sets.setdefault((e.category_id, p), []).append(e.id)
+
+        short = {}
+        for (cid, p), ids in short_sets.items():
+            ids.sort(key=lambda i: (entries[i].rank(p), entries[i].sort_key))
+            short[(cid, p)] = ids[:SHORT_TOPK]
+
+        return _Snapshot(entries, trigrams, short, by_brand, max(entries, default=0))
+
+    def rebuild(self):
+        version = get_catalog_version()
+        entries = {e.id: e for e in self._load(DeviceModel.objects.all())}
+        snap = self._build(entries)
+        with self._lock:
+            self._snap = snap
+            self._version = version
+            self._built_at = self._checked_at = time.monotonic()
+
+    def upsert(self, ids):
+        """增量更新指定型号（新增或改名/换品牌），合并后重建只读结构。"""
+        ids = set(ids or [])
+        if not ids or not self._built_at:
+            return
+        changed = self._load(DeviceModel.objects.filter(id__in=ids))
+        with self._lock:
+            entries = dict(self._snap.entries)
+            entries.update({e.id: e for e in changed})
+            self._snap = self._build(entries)
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if (
+            not self._built_at
+            or now - self._built_at > REBUILD_INTERVAL
+            or get_catalog_version() != self._version
+        ):
+            self.rebuild()
+            return
+        if now - self._checked_at > CHECK_INTERVAL:
+            self._checked_at = now
+            new_ids = list(DeviceModel.objects.filter(id__gt=self._snap.max_id).values_list("id", flat=True))
+            self.upsert(new_ids)
+
+    # --- 查询 ---
+
+    def search(self, q, limit: int = DEFAULT_LIMIT, category_id=None, brand_id=None):
+        qc = _compact(q)
+        if not qc:
+            return []
+
+        snap = self._snap
+        if brand_id is not None:
+            candidates, ordered = snap.by_brand.get(brand_id, []), False
+        elif len(qc) <= SHORT_PREFIX_LEN:
+            candidates, ordered = snap.short.get((category_id, qc), []), True
+        else:
+            postings = [snap.trigrams.get(g) for g in _trigrams(qc)]
+            if not all(postings):
+                return []
+            candidates, ordered = min(postings, key=len), False
+
+        tiers = ([], [], [])
+        for dm_id in candidates:
+            e = snap.entries[dm_id]
+            if category_id is not None and e.category_id != category_id:
+                continue
+            if brand_id is not None and e.brand_id != brand_id:
+                continue
+            rank = e.rank(qc)
+            if rank is None or len(tiers[rank]) >= limit:
+                continue
+            tiers[rank].append(e)
+            # 候选已按 (rank, sort_key) 排好：凑满即可结束；trigram 表按 sort_key 有序：前缀档凑满即可结束
+            if (ordered and sum(map(len, tiers)) >= limit) or len(tiers[0]) >= limit:
+                break
+
+        if not ordered:
+            for tier in tiers:
+                tier.sort(key=lambda e: e.sort_key)
+        return [e.as_dict() for tier in tiers for e in tier][:limit]
+
+
+device_model_suggest_index = DeviceModelSuggestIndex()
@@ -1,3 +1,1244 @@
-from django.test import TestCase
+import importlib
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .catalog_cache import bump_catalog_version
+from .models import (
+    Category, Brand, DeviceModel, Product, ProductImage, ValuationOption, ValuationChoice, ConditionGrade,
+    RecognitionResult, DefectItem, DefectSeverity, MarketPriceStat, Order, ValuationSnapshot, CreditOutbox,
+    ListingDraft, JobWatermark, CatalogVersion,
+)
+from .credit_outbox import drain_credit_outbox
+from .drafts import load_draft, save_draft
+from . import market_stats
+from .market_stats import QuantileSketch
+from .order_expiry import expire_unpaid_orders
+from .pricing import CATEGORY_K, estimate_range, estimate_range_batch
+from .valuation_rules import get_rule_table
+from .services import OrderStateMachine, TradeService, ValuationEngine
+from .recognition_cache import recognition_cache
+from .suggest import device_model_suggest_index
+
+User = get_user_model()
+
+
+class MarketTestMixin:
+    """公共造数：一个类目/品牌/型号 + 一个卖家。"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="手机", code="mobile")
+        self.brand = Brand.objects.create(name="Apple", category=self.category)
+        self.device_model = DeviceModel.objects.create(brand=self.brand, name="iPhone 13")
+        self.seller = User.objects.create_user(username="seller", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def make_product(self, images=2, **kwargs):
+        defaults = {
+            "seller": self.seller,
+            "device_model": self.device_model,
+            "category": self.category,
+            "title": "iPhone 13 128G",
+            "description": "自用",
+            "estimated_price": Decimal("3000.00"),
+            "selling_price": Decimal("2800.00"),
+            "status": "on_sale",
+        }
+        defaults.update(kwargs)
+        product = Product.objects.create(**defaults)
+        for i in range(images):
+            ProductImage.objects.create(product=product, image_name=f"p{product.id}-{i}.jpg", sort_order=i)
+        return product
+
+
+class ProductListQueryCountTests(MarketTestMixin, TestCase):
+    def _count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get("/api/market/products/")
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries), resp.data
+
+    def test_list_query_count_independent_of_page_size(self):
+        for _ in range(2):
+            self.make_product()
+        small, _ = self._count_list_queries()
+
+        for _ in range(10):
+            self.make_product()
+        large, data = self._count_list_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(data), 12)
+
+    def test_order_lists_query_count_independent_of_size(self):
+        buyer = User.objects.create_user(username="buyer", password="x")
+
+        def count(url, user):
+            self.client.force_authenticate(user)
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return len(ctx.captured_queries), resp.data
+
+        def add_orders(n):
+            for _ in range(n):
+                product = self.make_product(status="locked")
+                Order.objects.create(
+                    order_no=f"o{product.id}", buyer=buyer, product=product,
+                    amount=product.selling_price, status="pending_payment",
+                )
+
+        add_orders(2)
+        small = [count("/api/market/orders/buy/", buyer)[0], count("/api/market/orders/sell/", self.seller)[0]]
+        add_orders(8)
+        large = [count("/api/market/orders/buy/", buyer), count("/api/market/orders/sell/", self.seller)]
+        self.assertEqual(small, [n for n, _ in large])
+        self.assertEqual(len(large[0][1]), 10)
+        images = {o["product_main_image"] for o in large[1][1]}
+        self.assertTrue(all(name.startswith("/media/products/p") for name in images))
+
+        # 已生成缩略图的商品在订单列表里用小图
+        order = Order.objects.filter(buyer=buyer).order_by("id").first()
+        main = order.product.images.order_by("sort_order", "id").first()
+        main.thumb_sm_name = "abc123_sm.webp"
+        main.save(update_fields=["thumb_sm_name"])
+        for url, user in [("/api/market/orders/buy/", buyer), ("/api/market/orders/sell/", self.seller)]:
+            data = count(url, user)[1]
+            row = next(o for o in data if o["id"] == order.id)
+            self.assertEqual(row["product_main_image"], "/media/products/abc123_sm.webp")
+
+    def test_main_image_is_lowest_sort_order(self):
+        product = self.make_product(images=0)
+        ProductImage.objects.create(product=product, image_name="second.jpg", sort_order=1)
+        ProductImage.objects.create(product=product, image_name="first.jpg", sort_order=0)
+
+        resp = self.client.get(f"/api/market/products/{product.id}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["main_image"], "/media/products/first.jpg")
+        self.assertEqual(resp.data["category_id"], self.category.id)
+
+
+class ProductCursorPaginationTests(MarketTestMixin, TestCase):
+    def _walk(self, url):
+        seen = []
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            seen.extend(item["id"] for item in resp.data["results"])
+            url = resp.data["next"]
+        return seen
+
+    def test_default_list_is_not_paginated(self):
+        self.make_product()
+        resp = self.client.get("/api/market/products/")
+        self.assertIsInstance(resp.data, list)
+
+    def test_cursor_walks_all_pages_newest_first(self):
+        ids = [self.make_product(images=1).id for _ in range(7)]
+        seen = self._walk("/api/market/products/?paginate=cursor&page_size=3")
+        self.assertEqual(seen, sorted(ids, reverse=True))
+
+    def test_cursor_respects_seller_filter(self):
+        other = User.objects.create_user(username="other", password="x")
+        mine = [self.make_product(images=1).id for _ in range(4)]
+        for _ in range(3):
+            self.make_product(images=1, seller=other)
+        seen = self._walk(f"/api/market/products/?paginate=cursor&page_size=2&seller_id={self.seller.id}")
+        self.assertEqual(seen, sorted(mine, reverse=True))
+
+
+class ProductCategoryFilterTests(MarketTestMixin, TestCase):
+    def test_filter_uses_denormalized_category(self):
+        other_cat = Category.objects.create(name="平板", code="tablet")
+        other_model = DeviceModel.objects.create(
+            brand=Brand.objects.create(name="Apple", category=other_cat), name="iPad Air"
+        )
+        phone = self.make_product(images=1)
+        self.make_product(images=1, device_model=other_model, category=other_cat)
+
+        resp = self.client.get(f"/api/market/products/?category_id={self.category.id}")
+        self.assertEqual([item["id"] for item in resp.data], [phone.id])
+
+    def test_backfill_command_fills_missing_category(self):
+        legacy = self.make_product(images=1, category=None)
+        call_command("backfill_product_category", batch_size=1, stdout=StringIO())
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.category_id, self.category.id)
+        resp = self.client.get(f"/api/market/products/?category_id={self.category.id}")
+        self.assertEqual([item["id"] for item in resp.data], [legacy.id])
+
+
+class ProductValuationColumnTests(MarketTestMixin, TestCase):
+    def test_backfill_copies_condition_data_into_columns(self):
+        migration = importlib.import_module("apps.market.migrations.0006_backfill_product_valuation_columns")
+        product = self.make_product(images=0, condition_data={
+            "original_price": "5999",
+            "years_used": 1.5,
+            "grade_label": "9成新",
+            "market_tag": "低于市场价 3.0%",
+            "diff_pct": -3.0,
+            "value_score": 100.0,
+            "estimated_mid": "bad-value",
+        })
+
+        migration.copy_condition_data_to_columns(django_apps, None)
+
+        product.refresh_from_db()
+        self.assertEqual(product.original_price, Decimal("5999.00"))
+        self.assertEqual(product.years_used, 1.5)
+        self.assertEqual(product.grade_label, "9成新")
+        self.assertEqual(product.diff_pct, -3.0)
+        self.assertEqual(product.value_score, 100.0)
+        self.assertIsNone(product.estimated_mid)
+
+    def test_list_reads_columns(self):
+        self.make_product(images=0, value_score=88.5, grade_label="95新", estimated_min=Decimal("2500.00"))
+        item = self.client.get("/api/market/products/").data[0]
+        self.assertEqual(item["value_score"], 88.5)
+        self.assertEqual(item["grade_label"], "95新")
+        self.assertEqual(item["estimated_min"], "2500.00")
+        self.assertIsNone(item["market_tag"])
+
+
+class ProductHallFilterOrderingTests(MarketTestMixin, TestCase):
+    def _ids(self, query):
+        resp = self.client.get(f"/api/market/products/?{query}")
+        self.assertEqual(resp.status_code, 200)
+        rows = resp.data["results"] if isinstance(resp.data, dict) else resp.data
+        return [item["id"] for item in rows]
+
+    def test_best_value_under_price(self):
+        cheap_ok = self.make_product(images=0, selling_price=Decimal("1500.00"), value_score=80.0)
+        cheap_best = self.make_product(images=0, selling_price=Decimal("1999.00"), value_score=95.0)
+        self.make_product(images=0, selling_price=Decimal("2500.00"), value_score=99.0)
+
+        ids = self._ids(f"category_id={self.category.id}&max_price=2000&ordering=-value_score")
+        self.assertEqual(ids, [cheap_best.id, cheap_ok.id])
+
+    def test_range_grade_and_location_filters(self):
+        match = self.make_product(images=0, selling_price=Decimal("1200.00"), quality_grade="A", location="深圳市 南山区")
+        self.make_product(images=0, selling_price=Decimal("1200.00"), quality_grade="C", location="深圳市 福田区")
+        self.make_product(images=0, selling_price=Decimal("800.00"), quality_grade="A", location="深圳市 南山区")
+        self.make_product(images=0, selling_price=Decimal("1200.00"), quality_grade="B", location="广州市")
+
+        ids = self._ids("min_price=1000&quality_grade=A,B&location=深圳市")
+        self.assertEqual(ids, [match.id])
+
+    def test_invalid_ordering_is_ignored(self):
+        p = self.make_product(images=0)
+        self.assertEqual(self._ids("ordering=password"), [p.id])
+        self.assertEqual(self._ids("ordering=--selling_price"), [p.id])
+
+    def test_non_finite_price_bounds_are_ignored(self):
+        p = self.make_product(images=0)
+        self.assertEqual(self._ids("min_price=NaN&max_price=Infinity"), [p.id])
+
+    def test_cursor_follows_ordering_and_skips_null_scores(self):
+        scored = [self.make_product(images=0, value_score=float(v)) for v in (70, 90, 80, 60)]
+        self.make_product(images=0, value_score=None)
+
+        seen, url = [], "/api/market/products/?paginate=cursor&page_size=2&ordering=-value_score"
+        while url:
+            resp = self.client.get(url)
+            seen.extend(item["id"] for item in resp.data["results"])
+            url = resp.data["next"]
+
+        expected = [p.id for p in sorted(scored, key=lambda p: -p.value_score)]
+        self.assertEqual(seen, expected)
+
+
+class SearchAPITests(MarketTestMixin, TestCase):
+    def test_ranks_title_hits_above_description_hits(self):
+        in_desc = self.make_product(images=1, title="闲置手机", description="iPhone 13 自用")
+        in_title = self.make_product(images=1, title="iPhone 13 国行", description="自用")
+        self.make_product(images=1, title="华为 Mate 40", description="自用")
+
+        resp = self.client.get("/api/market/search/?q=iPhone")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([p["id"] for p in resp.data["products"]], [in_title.id, in_desc.id])
+        self.assertEqual([m["id"] for m in resp.data["device_models"]], [self.device_model.id])
+
+    def test_missing_query_is_rejected(self):
+        self.assertEqual(self.client.get("/api/market/search/?q=").status_code, 400)
+
+
+class DeviceModelSuggestTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        huawei = Brand.objects.create(name="Huawei", category=self.category)
+        self.mate = DeviceModel.objects.create(brand=huawei, name="Mate 40 Pro")
+        self.iphone_pro = DeviceModel.objects.create(brand=self.brand, name="iPhone 13 Pro")
+        device_model_suggest_index.rebuild()
+
+    def _suggest(self, query):
+        resp = self.client.get(f"/api/market/device-models/suggest/?{query}")
+        self.assertEqual(resp.status_code, 200)
+        return [item["id"] for item in resp.data]
+
+    def test_prefix_and_compact_matching(self):
+        expected = [self.device_model.id, self.iphone_pro.id]
+        self.assertEqual(self._suggest("q=iphone"), expected)
+        self.assertEqual(self._suggest("q=iphone13"), expected)
+        self.assertEqual(self._suggest("q=ip"), expected)
+        self.assertEqual(self._suggest("q=huawei mate"), [self.mate.id])
+        self.assertEqual(self._suggest("q=40"), [self.mate.id])
+
+    def test_brand_filter_and_empty_query(self):
+        self.assertEqual(self._suggest(f"q=pro&brand_id={self.brand.id}"), [self.iphone_pro.id])
+        self.assertEqual(self._suggest("q="), [])
+
+    def test_upsert_picks_up_new_and_renamed_models(self):
+        new_model = DeviceModel.objects.create(brand=self.brand, name="iPad Air")
+        self.mate.name = "Nova 12"
+        self.mate.save()
+        device_model_suggest_index.upsert([new_model.id, self.mate.id])
+
+        self.assertEqual(self._suggest("q=ipad"), [new_model.id])
+        self.assertEqual(self._suggest("q=nova"), [self.mate.id])
+        self.assertEqual(self._suggest("q=mate"), [])
+
+
+class CatalogCacheTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_repeat_list_is_served_from_cache(self):
+        first = self.client.get("/api/market/categories/")
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/market/categories/")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_etag_and_last_modified_give_304(self):
+        first = self.client.get(f"/api/market/brands/?category_id={self.category.id}")
+        with self.assertNumQueries(0):
+            resp = self.client.get(
+                f"/api/market/brands/?category_id={self.category.id}", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get(
+            f"/api/market/brands/?category_id={self.category.id}", HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]
+        )
+        self.assertEqual(resp.status_code, 304)
+
+    def test_write_bumps_version_and_invalidates(self):
+        first = self.client.get("/api/market/device-models/")
+        with self.captureOnCommitCallbacks(execute=True):
+            DeviceModel.objects.create(brand=self.brand, name="iPhone 15")
+
+        resp = self.client.get("/api/market/device-models/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data), len(first.data) + 1)
+        self.assertNotEqual(resp["ETag"], first["ETag"])
+
+
+    def test_version_bumped_by_another_process_changes_etag(self):
+        first = self.client.get("/api/market/categories/")
+        # 另一个进程（管理命令 / 其他 worker）的目录写入：只有库里的版本号变了，本进程的缓存都没动
+        CatalogVersion.objects.update(version=F("version") + 1)
+
+        later = time.monotonic() + 2
+        with mock.patch("apps.market.catalog_cache.time.monotonic", return_value=later):
+            resp = self.client.get("/api/market/categories/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], first["ETag"])
+
+
+class ValuationRuleTableTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.device_model.base_price = Decimal("4000.00")
+        self.device_model.save()
+        option = ValuationOption.objects.create(category=self.category, name="屏幕状态")
+        self.scratch = ValuationChoice.objects.create(option=option, content="细微划痕", depreciation_rate=0.05)
+        self.battery = ValuationChoice.objects.create(option=option, content="电池损耗", depreciation_rate=0.1)
+        bump_catalog_version()
+
+    def test_calculate_price_runs_without_queries(self):
+        ValuationEngine.calculate_price(self.device_model.id, [])  # warm the table
+        with self.assertNumQueries(0):
+            price = ValuationEngine.calculate_price(self.device_model.id, [self.scratch.id, self.battery.id, 999])
+        self.assertEqual(price, Decimal("3400.00"))
+        self.assertEqual(ValuationEngine.calculate_price(123456, []), Decimal("0.00"))
+
+    def test_ids_missing_from_the_table_are_read_from_the_db(self):
+        ValuationEngine.calculate_price(self.device_model.id, [])  # warm the table
+        # 另一个进程刚写入、本进程还没看到新版本：规则表与版本号都没变
+        with mock.patch("apps.market.signals.bump_catalog_version"):
+            new_model = DeviceModel.objects.create(brand=self.brand, name="iPhone 16", base_price=Decimal("6000.00"))
+            tablet = Category.objects.create(name="平板", code="tablet")
+            grade = ConditionGrade.objects.create(category=tablet, label="99新", factor=Decimal("0.95"))
+
+        self.assertEqual(ValuationEngine.calculate_price(new_model.id, []), Decimal("6000.00"))
+        r = ValuationEngine.estimate_listing(tablet.id, 1, Decimal("3000"), grade_id=grade.id)
+        self.assertEqual((r["category"]["code"], r["grade"]["factor"]), ("tablet", Decimal("0.95")))
+        self.assertEqual(get_rule_table().model_category(new_model.id), self.category.id)
+
+    def test_defect_penalty_uses_severity_weights(self):
+        screen = DefectItem.objects.create(category=self.category, code="screen", name="屏幕")
+        body = DefectItem.objects.create(category=self.category, code="body", name="机身")
+        DefectSeverity.objects.create(defect_item=screen, level=1, label="轻微", penalty_weight=Decimal("0.05"))
+        DefectSeverity.objects.create(defect_item=screen, level=3, label="严重", penalty_weight=Decimal("0.30"))
+        DefectSeverity.objects.create(defect_item=body, level=2, label="明显", penalty_weight=Decimal("0.04"))
+        bump_catalog_version()
+
+        rules = get_rule_table()
+        with self.assertNumQueries(0):
+            penalty = rules.defect_penalty(self.category.id, [
+                {"code": "screen", "level": 1}, ("screen", 3), "body:2", {"code": "unknown", "level": 3},
+            ])
+        # 同一检查项取最重等级；未配置的检查项按 1 条映射叠加
+        self.assertEqual(penalty, Decimal("0.42"))
+        # 自由文本 / 未配置类目：按条数回退
+        self.assertEqual(rules.defect_penalty(self.category.id, ["屏幕细微划痕"]), Decimal("0.08"))
+        self.assertEqual(rules.defect_penalty(123456, [("screen", 3)]), Decimal("0.08"))
+        # 结构化与自由文本混合：两部分都计入
+        self.assertEqual(rules.defect_penalty(self.category.id, ["body:2", "划痕", "掉漆"]), Decimal("0.19"))
+        # 不低于无瑕疵时的基准扣减
+        self.assertEqual(rules.defect_penalty(self.category.id, []), Decimal("0.02"))
+        self.assertEqual(rules.defect_penalty(self.category.id, ["screen:0"]), Decimal("0.02"))
+
+        r = ValuationEngine.estimate_listing(self.category.id, 1, Decimal("5000"), defects=[("screen", 3)])
+        self.assertEqual(r["defect_penalty"], 0.3)
+
+    def test_table_rebuilds_after_rule_change(self):
+        self.assertEqual(ValuationEngine.calculate_price(self.device_model.id, [self.scratch.id]), Decimal("3800.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scratch.depreciation_rate = 0.5
+            self.scratch.save()
+        self.assertEqual(ValuationEngine.calculate_price(self.device_model.id, [self.scratch.id]), Decimal("2000.00"))
+
+
+class BatchValuationTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.device_model.base_price = Decimal("4000.00")
+        self.device_model.save()
+        option = ValuationOption.objects.create(category=self.category, name="屏幕状态")
+        self.scratch = ValuationChoice.objects.create(option=option, content="细微划痕", depreciation_rate=0.05)
+        self.grade = ConditionGrade.objects.create(category=self.category, label="9成新", factor=Decimal("0.85"))
+        bump_catalog_version()
+
+    def test_batch_matches_single_estimates_in_order(self):
+        items = [
+            {"category_id": self.category.id, "years_used": 1.5, "original_price": "5999", "grade_label": "9成新"},
+            {"device_model_id": self.device_model.id, "choice_ids": [self.scratch.id]},
+            {"category_id": self.category.id, "years_used": 3, "original_price": "8999", "defects": ["a", "b"]},
+        ]
+        resp = self.client.post("/api/market/valuation/batch/", {"items": items}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        results = resp.data["results"]
+
+        expected = estimate_range(Decimal("5999"), 1.5, Decimal("0.85"), Decimal("0.02"), "mobile")
+        self.assertEqual(results[0]["estimated_mid"], str(expected["estimated_mid"]))
+        self.assertEqual(results[0]["grade_label"], "9成新")
+        self.assertEqual(results[1]["estimated_price"], "3800.00")
+        expected = estimate_range(Decimal("8999"), 3.0, Decimal("0.75"), Decimal("0.15"), "mobile")
+        self.assertEqual(results[2]["estimated_min"], str(expected["estimated_min"]))
+        self.assertEqual(results[2]["estimated_max"], str(expected["estimated_max"]))
+
+    def test_batch_pricing_matches_estimate_range_to_the_cent(self):
+        rnd = random.Random(20261018)
+        codes = list(CATEGORY_K) + ["unknown"]
+        args = [
+            (
+                Decimal(rnd.randint(100, 2000000)) / 100,
+                rnd.choice([0, 0.5, 1, 1.5, 2, 3, 4.5, 7]) + rnd.randint(0, 99) / 100,
+                Decimal(rnd.randint(30, 100)) / 100,
+                Decimal(rnd.randint(0, 80)) / 100,
+                rnd.choice(codes),
+            )
+            for _ in range(2000)
+        ]
+        batch = estimate_range_batch(*zip(*args))
+        self.assertEqual(batch, [estimate_range(*a) for a in args])
+
+    def test_invalid_items_fail_individually(self):
+        items = [
+            {"category_id": self.category.id, "years_used": -1, "original_price": "100"},
+            "oops",
+            {"category_id": self.category.id, "years_used": 1, "original_price": "1000"},
+            {"category_id": self.category.id, "years_used": "nan", "original_price": "1000"},
+            {"category_id": self.category.id, "years_used": 1, "original_price": "Infinity"},
+        ]
+        resp = self.client.post("/api/market/valuation/batch/", {"items": items}, format="json")
+        self.assertEqual(resp.status_code, 200)
+        results = resp.data["results"]
+        self.assertEqual(["error" in r for r in results], [True, True, False, True, True])
+        self.assertIn("estimated_mid", results[2])
+
+    def test_rejects_empty_or_oversized_batch(self):
+        self.assertEqual(self.client.post("/api/market/valuation/batch/", {"items": []}, format="json").status_code, 400)
+        items = [{"device_model_id": self.device_model.id}] * 10001
+        self.assertEqual(self.client.post("/api/market/valuation/batch/", {"items": items}, format="json").status_code, 400)
+
+
+@override_settings(ANALYSIS_RUN_INLINE=True)
+class DraftAnalyzeJobTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.draft_key = "d" * 32
+        self.image = ProductImage.objects.create(
+            uploaded_by=self.seller, draft_key=self.draft_key, image_name="main.jpg", is_main=True,
+            content_hash="a" * 64,
+        )
+        recognition_cache.clear()
+        self.url = f"/api/market/drafts/{self.draft_key}/analyze/"
+        patcher = mock.patch(
+            "apps.market.analysis.AIService.analyze_image",
+            return_value={"score": 85, "label": "9成新", "defects": ["边框磨损"]},
+        )
+        self.analyze_image = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeat_clicks_run_inference_once(self):
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.client.post(self.url)
+            self.assertIn(resp.status_code, (200, 202))
+        self.assertEqual(self.analyze_image.call_count, 1)
+
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["grade_label"], "9成新")
+        self.assertEqual(resp.data["defects"], ["边框磨损"])
+        rec = RecognitionResult.objects.get(image=self.image)
+        self.assertEqual((rec.status, rec.ok, rec.grade_score), (RecognitionResult.STATUS_DONE, True, 85))
+
+    def test_pending_job_returns_202_and_failed_job_is_retried(self):
+        RecognitionResult.objects.create(image=self.image)
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.data["status"], RecognitionResult.STATUS_PENDING)
+
+        RecognitionResult.objects.filter(image=self.image).update(status=RecognitionResult.STATUS_FAILED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertEqual(self.client.get(self.url).data["status"], RecognitionResult.STATUS_DONE)
+        self.assertEqual(self.analyze_image.call_count, 1)
+
+    def test_running_job_of_dead_worker_is_requeued(self):
+        RecognitionResult.objects.create(image=self.image, status=RecognitionResult.STATUS_RUNNING)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(self.url).status_code, 202)
+        self.assertEqual(self.analyze_image.call_count, 0)
+
+        RecognitionResult.objects.filter(image=self.image).update(updated_at=timezone.now() - timedelta(minutes=10))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url)
+        self.assertEqual(self.analyze_image.call_count, 1)
+        self.assertEqual(self.client.get(self.url).data["grade_label"], "9成新")
+
+    def test_identical_image_in_another_draft_skips_inference(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertEqual(self.analyze_image.call_count, 1)
+
+        other = User.objects.create_user(username="buyer2", password="x")
+        ProductImage.objects.create(
+            uploaded_by=other, draft_key="e" * 32, image_name="copy.jpg", is_main=True, content_hash="a" * 64
+        )
+        client = APIClient()
+        client.force_authenticate(other)
+        resp = client.post(f"/api/market/drafts/{'e' * 32}/analyze/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["grade_label"], "9成新")
+        self.assertEqual(self.analyze_image.call_count, 1)
+
+        stats = recognition_cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"]), (1, 2))
+
+        recognition_cache.clear()  # 前置层清空后仍能从 RecognitionResult 命中
+        ProductImage.objects.create(
+            uploaded_by=other, draft_key="f" * 32, image_name="copy2.jpg", is_main=True, content_hash="a" * 64
+        )
+        resp = client.post(f"/api/market/drafts/{'f' * 32}/analyze/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(recognition_cache.stats()["db_hits"], 1)
+        self.assertEqual(self.analyze_image.call_count, 1)
+
+
+def make_png(color=(255, 0, 0), name="photo.png"):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", (8, 8), color).save(buf, format="PNG")
+    return SimpleUploadedFile(name, buf.getvalue(), content_type="image/png")
+
+
+class DraftUploadImagesTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, ANALYSIS_RUN_INLINE=True, IMAGE_PROCESS_INLINE=True))
+        self.url = f"/api/market/drafts/{'d' * 32}/images/"
+        self.folder = os.path.join(media.name, "products")
+
+    def test_multiple_files_in_one_request_dedupe_by_content(self):
+        files = [make_png((i * 60, 0, 0), f"{i}.png") for i in range(3)] + [make_png((0, 0, 0), "dup.png")]
+        with self.captureOnCommitCallbacks(execute=True), mock.patch(
+            "apps.market.analysis.AIService.analyze_image",
+            return_value={"score": 90, "label": "95新", "defects": []},
+        ):
+            resp = self.client.post(self.url, {"images": files}, format="multipart")
+        self.assertEqual(resp.status_code, 201)
+        images = resp.data["images"]
+        self.assertEqual(len(images), 4)
+        self.assertEqual(images[0]["id"], images[3]["id"])  # 同内容只建一条
+        self.assertEqual([img["is_main"] for img in images[:3]], [True, False, False])
+        self.assertEqual(ProductImage.objects.filter(draft_key="d" * 32).count(), 3)
+        self.assertEqual(len([n for n in os.listdir(self.folder) if n.endswith(".jpg")]), 3)
+        self.assertTrue(RecognitionResult.objects.filter(image_id=images[0]["id"]).exists())
+
+        # 另一个草稿上传同一张图：复用磁盘文件
+        resp = self.client.post(f"/api/market/drafts/{'e' * 32}/images/", {"image": make_png((0, 0, 0))})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["image_name"], images[0]["image_name"])
+        self.assertEqual(len([n for n in os.listdir(self.folder) if n.endswith(".jpg")]), 3)
+
+    def test_cap_is_enforced_for_the_whole_batch(self):
+        self.client.post(self.url, {"images": [make_png((i, 1, 1), f"{i}.png") for i in range(3)]}, format="multipart")
+        resp = self.client.post(self.url, {"images": [make_png((9, 9, 9)), make_png((8, 8, 8))]}, format="multipart")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(ProductImage.objects.filter(draft_key="d" * 32).count(), 3)
+        # 超额落盘的文件不在请求里删，留给 gc_draft_images 过了宽限期回收
+        self.assertEqual(len([n for n in os.listdir(self.folder) if n.endswith(".jpg")]), 5)
+        old = time.time() - 100 * 3600
+        for name in os.listdir(self.folder):
+            os.utime(os.path.join(self.folder, name), (old, old))
+        call_command("gc_draft_images", stdout=StringIO())
+        self.assertEqual(ProductImage.objects.filter(draft_key="d" * 32).count(), 3)
+        self.assertEqual(len([n for n in os.listdir(self.folder) if n.endswith(".jpg")]), 3)
+
+    def test_upload_is_normalized_with_thumbnails(self):
+        from PIL import Image
+
+        buf = BytesIO()
+        Image.new("RGBA", (1600, 1200), (0, 128, 255, 128)).save(buf, format="PNG")
+        upload = SimpleUploadedFile("big.png", buf.getvalue(), content_type="image/png")
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(self.url, {"image": upload})
+        self.assertEqual(resp.status_code, 201)
+
+        img = ProductImage.objects.get(id=resp.data["id"])
+        self.assertIsNotNone(img.processed_at)
+        self.assertEqual((img.width, img.height), (1600, 1200))
+        with Image.open(os.path.join(self.folder, img.image_name)) as im:
+            self.assertEqual(im.format, "JPEG")
+            self.assertTrue(im.info.get("progressive"))
+            self.assertNotIn("exif", im.info)
+        with Image.open(os.path.join(self.folder, img.thumb_sm_name)) as im:
+            self.assertEqual((im.format, max(im.size)), ("WEBP", 240))
+
+        # 大厅列表另给小图，main_image 仍是原图；详情只返回原图
+        img.product = self.make_product(images=0)
+        img.save()
+        item = self.client.get("/api/market/products/").data[0]
+        self.assertEqual(item["main_thumb"], f"/media/products/{img.thumb_sm_name}")
+        self.assertEqual(item["main_image"], f"/media/products/{img.image_name}")
+        detail = self.client.get(f"/api/market/products/{img.product_id}/").data
+        self.assertEqual(detail["main_image"], f"/media/products/{img.image_name}")
+        self.assertNotIn("main_thumb", detail)
+
+
+class DraftImageGCTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.folder = os.path.join(media.name, "products")
+        os.makedirs(self.folder)
+        self.old = timezone.now() - timedelta(days=10)
+
+    def draft_image(self, draft_key, name, age=None, **kwargs):
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        ts = (age or self.old).timestamp()
+        os.utime(path, (ts, ts))
+        img = ProductImage.objects.create(uploaded_by=self.seller, draft_key=draft_key, image_name=name, **kwargs)
+        ProductImage.objects.filter(id=img.id).update(created_at=age or self.old)
+        return img
+
+    def test_collects_only_abandoned_drafts_and_unreferenced_files(self):
+        self.draft_image("abandoned", "a.jpg")
+        self.draft_image("abandoned", "shared.jpg")
+        self.draft_image("active", "b.jpg")
+        self.draft_image("active", "c.jpg", age=timezone.now())  # 同草稿有新图：整份保留
+        published = self.make_product(images=0)
+        self.draft_image("", "shared.jpg", product=published)
+
+        out = StringIO()
+        call_command("gc_draft_images", "--dry-run", stdout=out)
+        self.assertIn("rows=2", out.getvalue())
+        self.assertEqual(ProductImage.objects.count(), 5)
+
+        call_command("gc_draft_images", "--batch-size", "1", stdout=StringIO())
+        self.assertFalse(ProductImage.objects.filter(draft_key="abandoned").exists())
+        self.assertEqual(ProductImage.objects.filter(draft_key="active").count(), 2)
+        self.assertEqual(sorted(os.listdir(self.folder)), ["b.jpg", "c.jpg", "shared.jpg"])
+
+    def test_collects_old_orphan_upload_files_only(self):
+        def touch(name, age):
+            path = os.path.join(self.folder, name)
+            with open(path, "wb") as f:
+                f.write(b"x")
+            os.utime(path, (age.timestamp(), age.timestamp()))
+
+        orphan, fresh, used = "a" * 32, "b" * 32, "c" * 32
+        touch(f"{orphan}.jpg", self.old)
+        touch(f"{orphan}_sm.webp", self.old)
+        touch(f"{fresh}.jpg", timezone.now())  # 宽限期内：可能正被并发上传复用
+        touch(f"{used}.jpg", self.old)
+        touch("legacy.jpg", self.old)  # 非内容 hash 命名的文件不碰
+        self.make_product(images=0).images.create(image_name=f"{used}.jpg")
+
+        call_command("gc_draft_images", stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.folder)), [f"{fresh}.jpg", f"{used}.jpg", "legacy.jpg"])
+
+
+class DraftPublishTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        ConditionGrade.objects.create(category=self.category, label="9成新", factor=Decimal("0.85"))
+        bump_catalog_version()
+        self.draft_key = "p" * 32
+        for i in range(4):
+            ProductImage.objects.create(
+                uploaded_by=self.seller, draft_key=self.draft_key, image_name=f"d{i}.jpg", sort_order=i
+            )
+        self.meta = {
+            "category_id": self.category.id,
+            "years_used": 1.5,
+            "original_price": "5999",
+            "grade_label": "9成新",
+            "defects": ["边框磨损"],
+        }
+
+    def test_publish_reuses_estimate_and_binds_images_in_one_update(self):
+        est = self.client.post(f"/api/market/drafts/{self.draft_key}/estimate/", self.meta, format="json")
+        self.assertEqual(est.status_code, 200)
+        self.assertEqual(est.data["grade"]["factor"], "0.85")
+
+        payload = {**self.meta, "device_model_id": self.device_model.id,
+                   "title": "iPhone 13", "description": "自用", "selling_price": "3000"}
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(f"/api/market/drafts/{self.draft_key}/publish/", payload, format="json")
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.data["estimated_mid"], est.data["estimated_mid"])
+        image_updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "market_productimage"')]
+        self.assertEqual(len(image_updates), 1)
+
+        product = Product.objects.get(id=resp.data["product_id"])
+        self.assertEqual((product.category_id, product.grade_label), (self.category.id, "9成新"))
+        self.assertEqual(product.images.count(), 4)
+        self.assertFalse(ProductImage.objects.filter(draft_key=self.draft_key).exists())
+
+        # 图片已被绑定：再次发布失败且不留下空商品
+        resp = self.client.post(f"/api/market/drafts/{self.draft_key}/publish/", payload, format="json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_invalid_meta_and_grade_label_are_rejected(self):
+        payload = {**self.meta, "device_model_id": self.device_model.id,
+                   "title": "iPhone 13", "description": "自用", "selling_price": "3000"}
+        for url in (f"/api/market/drafts/{self.draft_key}/estimate/", f"/api/market/drafts/{self.draft_key}/publish/"):
+            for bad in ({"years_used": "nan"}, {"original_price": "Infinity"}, {"original_price": "-1"},
+                        {"grade_label": "成" * 21}):
+                resp = self.client.post(url, {**payload, **bad}, format="json")
+                self.assertEqual(resp.status_code, 400, (url, bad))
+        self.assertFalse(Product.objects.exists())
+
+    def test_publish_recomputes_when_defects_or_rules_change(self):
+        est = self.client.post(f"/api/market/drafts/{self.draft_key}/estimate/", self.meta, format="json")
+        self.assertEqual(est.status_code, 200)
+        payload = {**self.meta, "device_model_id": self.device_model.id,
+                   "title": "iPhone 13", "description": "自用", "selling_price": "3000"}
+        url = f"/api/market/drafts/{self.draft_key}/publish/"
+
+        def publish_calls(**changes):
+            with mock.patch(
+                "apps.market.views_listing.ValuationEngine.estimate_listing", side_effect=ValueError("recomputed")
+            ) as estimate_listing:
+                self.client.post(url, {**payload, **changes}, format="json")
+            return estimate_listing.call_count
+
+        self.assertEqual(publish_calls(defects=["边框磨损 "]), 0)  # 只是空白差异
+        self.assertEqual(publish_calls(defects=["屏幕碎裂"]), 1)  # 条数相同、内容不同
+        bump_catalog_version()
+        self.assertEqual(publish_calls(), 1)
+
+    def test_later_steps_read_meta_and_estimate_from_draft_state(self):
+        init = self.client.post("/api/market/drafts/init/", {
+            "category_id": self.category.id, "device_model_id": self.device_model.id,
+            "years_used": 1.5, "original_price": "5999",
+        }, format="json")
+        draft_key = init.data["draft_key"]
+        ProductImage.objects.filter(draft_key=self.draft_key).update(draft_key=draft_key)
+
+        est = self.client.post(
+            f"/api/market/drafts/{draft_key}/estimate/", {"grade_label": "9成新", "defects": ["边框磨损"]},
+            format="json",
+        )
+        self.assertEqual(est.status_code, 200)
+        self.assertEqual(est.data["category"]["id"], self.category.id)
+
+        with mock.patch("apps.market.views_listing.ValuationEngine.estimate_listing") as estimate_listing:
+            resp = self.client.post(f"/api/market/drafts/{draft_key}/publish/", {
+                "title": "iPhone 13", "description": "自用", "selling_price": "3000",
+            }, format="json")
+        self.assertEqual(resp.status_code, 201)
+        estimate_listing.assert_not_called()
+        self.assertEqual(resp.data["estimated_mid"], est.data["estimated_mid"])
+        product = Product.objects.get(id=resp.data["product_id"])
+        self.assertEqual((product.grade_label, product.condition_data["defects"]), ("9成新", ["边框磨损"]))
+
+    def test_draft_state_is_shared_across_processes_and_expires(self):
+        # 存库：清空（进程内）缓存后草稿仍在，多 worker 部署时各步骤都能读到
+        save_draft(self.seller.id, self.draft_key, meta={"original_price": Decimal("5999.00")})
+        save_draft(self.seller.id, self.draft_key, analysis={"defects": ["边框磨损"]})
+        cache.clear()
+        self.assertEqual(
+            load_draft(self.seller.id, self.draft_key),
+            {"meta": {"original_price": "5999.00"}, "analysis": {"defects": ["边框磨损"]}},
+        )
+
+        # 过期：读不到，再写也不会复活旧的段；gc_draft_images 删掉过期行
+        ListingDraft.objects.update(updated_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(load_draft(self.seller.id, self.draft_key), {})
+        save_draft(self.seller.id, self.draft_key, analysis={"defects": []})
+        self.assertEqual(load_draft(self.seller.id, self.draft_key), {"analysis": {"defects": []}})
+        save_draft(self.seller.id, "x" * 32, meta={})
+        ListingDraft.objects.filter(draft_key="x" * 32).update(updated_at=timezone.now() - timedelta(days=10))
+        out = StringIO()
+        call_command("gc_draft_images", stdout=out)
+        self.assertIn("draft_sessions=1", out.getvalue())
+        self.assertEqual(list(ListingDraft.objects.values_list("draft_key", flat=True)), [self.draft_key])
+
+
+class MarketPriceAggregationTests(MarketTestMixin, TestCase):
+    def complete_order(self, amount, device_model=None, complete_time=None):
+        product = self.make_product(images=0, device_model=device_model or self.device_model, status="sold")
+        return Order.objects.create(
+            order_no=f"o{product.id}", buyer=self.seller, product=product, amount=Decimal(amount),
+            status="completed", complete_time=complete_time or timezone.now() - timedelta(hours=1),
+        )
+
+    def test_sketch_quantiles_are_within_relative_error(self):
+        sketch = QuantileSketch()
+        for v in range(1, 10001):
+            sketch.add(v)
+        restored = QuantileSketch.from_json(sketch.to_json())
+        for q, exact in ((0.1, 1000), (0.5, 5000), (0.9, 9000)):
+            self.assertLess(abs(restored.quantile(q) - exact) / exact, 0.011)
+        self.assertLess(len(restored.buckets), 500)
+
+    def test_incremental_runs_merge_new_orders_only(self):
+        for amount in ("1000", "2000", "3000"):
+            self.complete_order(amount)
+        call_command("aggregate_market_prices", stdout=StringIO())
+        stat = MarketPriceStat.objects.get(device_model=self.device_model)
+        self.assertEqual(stat.sample_size, 3)
+        self.assertLess(abs(stat.p50_price - Decimal("2000")), Decimal("20"))
+
+        out = StringIO()
+        call_command("aggregate_market_prices", stdout=out)
+        self.assertIn("orders=0", out.getvalue())
+
+        for amount in ("4000", "5000"):
+            self.complete_order(amount)
+        call_command("aggregate_market_prices", stdout=StringIO())
+        stat.refresh_from_db()
+        self.assertEqual(stat.sample_size, 5)
+        self.assertLess(abs(stat.p50_price - Decimal("3000")), Decimal("30"))
+
+        call_command("aggregate_market_prices", "--full", stdout=StringIO())
+        stat.refresh_from_db()
+        self.assertEqual(stat.sample_size, 5)
+
+    def test_historical_orders_without_complete_time_are_backfilled_and_rebuilt(self):
+        self.complete_order("1000")
+        call_command("aggregate_market_prices", stdout=StringIO())
+        legacy = self.complete_order("3000")
+        Order.objects.filter(id=legacy.id).update(
+            complete_time=None, updated_at=timezone.now() - timedelta(days=30)
+        )
+
+        migration = importlib.import_module("apps.market.migrations.0017_backfill_order_complete_time")
+        migration.backfill_complete_time(django_apps, None)
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.complete_time, legacy.updated_at)
+
+        # 回填时间早于水位：水位被重置，下次按全量重建，已并入的订单不重复计数
+        call_command("aggregate_market_prices", stdout=StringIO())
+        self.assertEqual(MarketPriceStat.objects.get(device_model=self.device_model).sample_size, 2)
+
+    def test_overlapping_runs_wait_for_the_watermark_lock(self):
+        self.complete_order("1000")
+        with mock.patch.object(JobWatermark.objects, "select_for_update", wraps=JobWatermark.objects.select_for_update) as lock:
+            call_command("aggregate_market_prices", stdout=StringIO())
+        # 全量重置 1 次 + 每批 1 次（含最后一次空批）
+        self.assertEqual(lock.call_count, 3)
+
+    def test_batches_commit_and_advance_the_watermark_one_by_one(self):
+        orders = [self.complete_order(amount) for amount in ("1000", "2000", "3000")]
+        calls, flush = [], market_stats._flush
+
+        def flush_then_fail(sketches, batch_size):
+            calls.append(sketches)
+            if len(calls) == 2:
+                raise RuntimeError("boom")
+            return flush(sketches, batch_size)
+
+        with mock.patch("apps.market.market_stats._flush", side_effect=flush_then_fail):
+            with self.assertRaises(RuntimeError):
+                call_command("aggregate_market_prices", "--batch-size", "2", stdout=StringIO())
+        # 第一批已提交，失败那批回滚
+        self.assertEqual(MarketPriceStat.objects.get(device_model=self.device_model).sample_size, 2)
+        self.assertEqual(JobWatermark.objects.get(name="market_price_stat").position_id, orders[1].id)
+
+        call_command("aggregate_market_prices", "--batch-size", "2", stdout=StringIO())
+        self.assertEqual(MarketPriceStat.objects.get(device_model=self.device_model).sample_size, 3)
+
+    def test_late_committing_orders_inside_the_lookback_window_are_counted(self):
+        now = timezone.now()
+        self.complete_order("1000", complete_time=now - timedelta(hours=1))
+        self.complete_order("2000", complete_time=now - timedelta(seconds=60))
+        out = StringIO()
+        call_command("aggregate_market_prices", stdout=out)
+        self.assertIn("orders=1", out.getvalue())
+
+        # 完成时间早于上一单、但事务晚提交的订单：仍在水位之后
+        self.complete_order("3000", complete_time=now - timedelta(seconds=120))
+        with mock.patch("apps.market.market_stats.timezone.now", return_value=now + timedelta(minutes=10)):
+            call_command("aggregate_market_prices", stdout=StringIO())
+        self.assertEqual(MarketPriceStat.objects.get(device_model=self.device_model).sample_size, 3)
+
+    def test_full_rebuild_drops_stats_of_models_without_completed_orders(self):
+        iphone14 = DeviceModel.objects.create(brand=self.brand, name="iPhone 14")
+        seeded = DeviceModel.objects.create(brand=self.brand, name="iPhone 13")
+        MarketPriceStat.objects.create(device_model=seeded, p50_price=Decimal("2500"), sample_size=100)
+        self.complete_order("1000")
+        refunded = self.complete_order("5000", device_model=iphone14)
+        listed = self.make_product(images=0, device_model=iphone14, selling_price=Decimal("4000"))
+        call_command("aggregate_market_prices", stdout=StringIO())
+        self.assertIsNotNone(Product.objects.get(id=listed.id).market_diff_pct)
+
+        Order.objects.filter(id=refunded.id).update(status="refunded")
+        out = StringIO()
+        call_command("aggregate_market_prices", "--full", stdout=out)
+        self.assertIn("removed=1", out.getvalue())
+        self.assertEqual(
+            set(MarketPriceStat.objects.values_list("device_model_id", flat=True)), {self.device_model.id, seeded.id}
+        )
+        self.assertEqual(MarketPriceStat.objects.get(device_model=self.device_model).sample_size, 1)
+        self.assertIsNone(Product.objects.get(id=listed.id).market_diff_pct)
+
+    def test_comparisons_are_stored_and_sortable(self):
+        iphone14 = DeviceModel.objects.create(brand=self.brand, name="iPhone 14")
+        MarketPriceStat.objects.create(device_model=self.device_model, p50_price=Decimal("3000"))
+        cheap = self.make_product(images=0, selling_price=Decimal("2400"))
+        pricey = self.make_product(images=0, selling_price=Decimal("3300"))
+        no_stat = self.make_product(images=0, device_model=iphone14)
+
+        call_command("refresh_market_comparisons", stdout=StringIO())
+        cheap.refresh_from_db()
+        self.assertAlmostEqual(cheap.market_diff_pct, -0.2)
+        snap = ValuationSnapshot.objects.get(product=cheap)
+        self.assertEqual((snap.market_median, snap.value_score), (Decimal("3000.00"), 0.2))
+
+        resp = self.client.get("/api/market/products/?ordering=market_diff_pct")
+        self.assertEqual([p["id"] for p in resp.data][:2], [cheap.id, pricey.id])
+        resp = self.client.get("/api/market/products/?below_market=1")
+        self.assertEqual([p["id"] for p in resp.data], [cheap.id])
+        self.assertIsNone(Product.objects.get(id=no_stat.id).market_diff_pct)
+
+        # 统计更新（成交聚合）后按型号自动刷新，复用已有快照
+        self.complete_order("2000")
+        call_command("aggregate_market_prices", stdout=StringIO())
+        pricey.refresh_from_db()
+        self.assertGreater(pricey.market_diff_pct, 0.6)
+        self.assertEqual(ValuationSnapshot.objects.filter(product=pricey).count(), 1)
+
+
+class CreateOrderReservationTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user(username="buyer", password="x")
+        self.product = self.make_product(images=0)
+
+    def test_first_buyer_reserves_and_others_fail_fast(self):
+        order = TradeService.create_order(self.buyer, self.product.id)
+        self.assertEqual(order.amount, Decimal("2800.00"))
+        self.assertEqual(order.status, "pending_payment")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, "locked")
+
+        late = User.objects.create_user(username="late", password="x")
+        with CaptureQueriesContext(connection) as ctx:
+            with self.assertRaisesMessage(ValueError, "商品不可购买"):
+                TradeService.create_order(late, self.product.id)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(Order.objects.filter(product=self.product).count(), 1)
+
+    def test_reservation_is_a_single_conditional_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            TradeService.create_order(self.buyer, self.product.id)
+        updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"status" = ', updates[0].split("WHERE")[1])
+        self.assertNotIn("title", updates[0])
+
+    def test_own_product_and_missing_product(self):
+        with self.assertRaisesMessage(ValueError, "不能购买自己的商品"):
+            TradeService.create_order(self.seller, self.product.id)
+        with self.assertRaisesMessage(ValueError, "商品不存在"):
+            TradeService.create_order(self.buyer, self.product.id + 1000)
+
+    def test_failed_order_insert_releases_product(self):
+        with mock.patch.object(Order.objects, "create", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                TradeService.create_order(self.buyer, self.product.id)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, "on_sale")
+
+
+class OrderStateMachineTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user(username="buyer", password="x")
+        self.order = TradeService.create_order(self.buyer, self.make_product(images=0).id)
+        self.buyer_client = APIClient()
+        self.buyer_client.force_authenticate(self.buyer)
+
+    def post(self, client, op):
+        return client.post(f"/api/market/orders/{self.order.id}/{op}/")
+
+    def test_full_flow_sets_timestamps(self):
+        self.assertEqual(self.post(self.buyer_client, "pay").data["status"], "pending_shipment")
+        self.assertEqual(self.post(self.client, "ship").data["status"], "shipped")
+        self.assertEqual(self.post(self.buyer_client, "confirm_receipt").data["status"], "completed")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "completed")
+        self.assertIsNotNone(self.order.pay_time)
+        self.assertIsNotNone(self.order.ship_time)
+        self.assertIsNotNone(self.order.complete_time)
+        self.assertIsNone(self.order.cancel_time)
+
+    def test_transition_is_one_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            OrderStateMachine.transition(self.order.id, self.buyer, "pay")
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertTrue(ctx.captured_queries[0]["sql"].startswith("UPDATE"))
+
+    def test_rejections(self):
+        self.assertEqual(self.post(self.client, "pay").status_code, 403)
+        self.assertEqual(self.post(self.buyer_client, "ship").status_code, 403)
+        self.assertEqual(self.post(self.buyer_client, "refund").data["error"], "invalid status")
+        self.assertEqual(self.buyer_client.post("/api/market/orders/999999/pay/").status_code, 404)
+
+    def test_cancel_is_idempotent_on_terminal_order(self):
+        self.assertEqual(self.post(self.buyer_client, "cancel_payment").data["status"], "refunded")
+        again = self.post(self.buyer_client, "cancel_payment")
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data["status"], "refunded")
+        self.assertEqual(self.post(self.buyer_client, "pay").data["error"], "order is terminal")
+
+    def test_cancel_and_refund_put_the_product_back_on_sale(self):
+        product = self.order.product
+        self.assertEqual(self.post(self.buyer_client, "cancel_payment").data["status"], "refunded")
+        product.refresh_from_db()
+        self.assertEqual(product.status, "on_sale")
+
+        order = TradeService.create_order(self.buyer, product.id)
+        OrderStateMachine.transition(order.id, self.buyer, "pay")
+        OrderStateMachine.transition(order.id, self.seller, "ship")
+        with mock.patch("apps.market.services.enqueue_order_credit", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                OrderStateMachine.transition(order.id, self.buyer, "refund")
+        product.refresh_from_db()
+        self.assertEqual(product.status, "locked")  # 与订单状态同一事务回滚
+        self.assertEqual(OrderStateMachine.transition(order.id, self.buyer, "refund"), "refunded")
+        product.refresh_from_db()
+        self.assertEqual(product.status, "on_sale")
+
+
+class OrderStateMachineConcurrencyTests(MarketTestMixin, TransactionTestCase):
+    def test_parallel_duplicate_requests_apply_once(self):
+        buyer = User.objects.create_user(username="buyer", password="x")
+        order = TradeService.create_order(buyer, self.make_product(images=0).id)
+        n = 8
+        barrier = threading.Barrier(n)
+        results = []
+
+        def worker(op):
+            client = APIClient()
+            client.force_authenticate(buyer)
+            try:
+                barrier.wait()
+                resp = client.post(f"/api/market/orders/{order.id}/{op}/")
+                results.append((op, resp.status_code, resp.data.get("status")))
+            finally:
+                connection.close()
+
+        # 重复点“付款”与“取消付款”混在一起并发：只有一个请求能让订单离开 pending_payment
+        threads = [threading.Thread(target=worker, args=("pay" if i % 2 else "cancel_payment",)) for i in range(n)]
+        with mock.patch("apps.market.credit_outbox.kick"):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        order.refresh_from_db()
+        winners = [r for r in results if r[1] == 200 and r[2] == order.status]
+        self.assertEqual(len(results), n)
+        self.assertIn(order.status, {"pending_shipment", "refunded"})
+        if order.status == "pending_shipment":
+            self.assertEqual(len(winners), 1)
+            self.assertIsNotNone(order.pay_time)
+            self.assertIsNone(order.cancel_time)
+            self.assertFalse(CreditOutbox.objects.filter(order=order).exists())
+        else:
+            # 取消后重复取消按幂等返回 200，但付款全部失败
+            self.assertFalse([r for r in results if r[0] == "pay" and r[1] == 200])
+            self.assertIsNotNone(order.cancel_time)
+            self.assertIsNone(order.pay_time)
+            self.assertEqual(CreditOutbox.objects.filter(order=order).count(), 1)
+
+
+class UnpaidOrderExpiryTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user(username="buyer", password="x", credit_score=100)
+
+    def place_order(self, minutes_ago):
+        order = TradeService.create_order(self.buyer, self.make_product(images=0).id)
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return order
+
+    def test_expires_stale_orders_in_batches_and_releases_products(self):
+        stale = [self.place_order(60) for _ in range(5)]
+        fresh = self.place_order(5)
+        paid = self.place_order(60)
+        OrderStateMachine.transition(paid.id, self.buyer, "pay")
+
+        stats = expire_unpaid_orders(timezone.now() - timedelta(minutes=30), batch_size=2)
+        self.assertEqual((stats.orders, stats.products, stats.credit_events, stats.batches), (5, 5, 5, 3))
+
+        for order in stale:
+            order.refresh_from_db()
+            self.assertEqual(order.status, "refunded")
+            self.assertIsNotNone(order.cancel_time)
+            self.assertEqual(Product.objects.get(id=order.product_id).status, "on_sale")
+        self.assertEqual(Order.objects.get(id=fresh.id).status, "pending_payment")
+        self.assertEqual(Product.objects.get(id=fresh.product_id).status, "locked")
+        self.assertEqual(Order.objects.get(id=paid.id).status, "pending_shipment")
+        self.assertEqual(CreditOutbox.objects.filter(event_type="payment_cancelled").count(), 5)
+        drain_credit_outbox()
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.credit_score, 100 - 3 * 5)
+
+        # 商品放回后可以再次下单
+        again = TradeService.create_order(self.buyer, stale[0].product_id)
+        self.assertEqual(again.status, "pending_payment")
+
+    def test_command_dry_run_changes_nothing(self):
+        order = self.place_order(60)
+        out = StringIO()
+        call_command("expire_unpaid_orders", "--dry-run", stdout=out)
+        self.assertIn("would expire orders=1", out.getvalue())
+        self.assertEqual(Order.objects.get(id=order.id).status, "pending_payment")
+
+
+class CreditOutboxTests(MarketTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create_user(username="buyer", password="x", credit_score=100)
+        self.buyer_client = APIClient()
+        self.buyer_client.force_authenticate(self.buyer)
+
+    def shipped_order(self):
+        order = TradeService.create_order(self.buyer, self.make_product(images=0).id)
+        Order.objects.filter(id=order.id).update(status="shipped")
+        return order
+
+    def scores(self):
+        return tuple(User.objects.filter(id__in=[self.buyer.id, self.seller.id]).order_by("id").values_list(
+            "credit_score", flat=True
+        ))
+
+    @override_settings(CREDIT_OUTBOX_RUN_INLINE=True)
+    def test_transition_writes_outbox_and_worker_applies_after_commit(self):
+        order = self.shipped_order()
+        before = self.scores()
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.buyer_client.post(f"/api/market/orders/{order.id}/confirm_receipt/")
+        self.assertEqual(resp.data["status"], "completed")
+        # 请求内只写 outbox，不记分
+        self.assertEqual(self.scores(), before)
+        row = CreditOutbox.objects.get(order=order)
+        self.assertEqual((row.event_type, row.processed_at), ("order_completed", None))
+
+        for callback in callbacks:
+            callback()
+        row.refresh_from_db()
+        self.assertIsNotNone(row.processed_at)
+        self.assertEqual(self.scores(), tuple(min(120, s + 3) for s in before))
+
+        # 重复处理同一行不重复记分
+        CreditOutbox.objects.filter(id=row.id).update(processed_at=None)
+        drain_credit_outbox()
+        self.assertEqual(self.scores(), tuple(min(120, s + 3) for s in before))
+
+    def test_failed_rows_back_off_without_blocking_others(self):
+        good, bad = self.shipped_order(), self.shipped_order()
+        for order in (good, bad):
+            OrderStateMachine.transition(order.id, self.buyer, "refund")
+        real = drain_credit_outbox.__globals__["apply_credit_events_bulk"]
+
+        def flaky(events):
+            if any(e["ref_id"] == str(bad.id) for e in events):
+                raise RuntimeError("scoring down")
+            return real(events)
+
+        with mock.patch("apps.market.credit_outbox.apply_credit_events_bulk", side_effect=flaky):
+            with self.assertLogs("apps.market.credit_outbox", "WARNING"):
+                stats = drain_credit_outbox()
+        self.assertEqual((stats.processed, stats.failed), (1, 1))
+        self.assertIsNotNone(CreditOutbox.objects.get(order=good).processed_at)
+        failed = CreditOutbox.objects.get(order=bad)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn("scoring down", failed.last_error)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+
+        # 未到重试时间不处理；到期后重试成功
+        self.assertEqual(drain_credit_outbox().processed, 0)
+        CreditOutbox.objects.filter(id=failed.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_credit_outbox().processed, 1)
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.credit_score, 100 - 3 * 2)
@@ -2,9 +2,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import ProductViewSet, OrderViewSet, ValuationAPI, CategoryViewSet, DeviceModelViewSet, BrandViewSet
+from .views import ProductViewSet, OrderViewSet, ValuationAPI, CategoryViewSet, DeviceModelViewSet, BrandViewSet, SearchAPI, BatchValuationAPI
 from .views_listing import (
-    DraftInitAPI, DraftUploadImagesAPI, DraftAnalyzeAPI, DraftEstimateAPI, DraftPublishAPI
+    DraftInitAPI, DraftUploadImagesAPI, DraftAnalyzeAPI, DraftEstimateAPI, DraftPublishAPI, AnalysisCacheStatsAPI
 )
 
 router = DefaultRouter()
@@ -16,6 +16,8 @@ router.register(r"brands", BrandViewSet, basename="market-brand")
 
 urlpatterns = [
     path("valuation/", ValuationAPI.as_view(), name="valuation"),
+    path("valuation/batch/", BatchValuationAPI.as_view(), name="valuation-batch"),
+    path("search/", SearchAPI.as_view(), name="search"),
     path("device-models/reference/", DeviceModelViewSet.as_view({"get": "reference"}), name="device-model-reference"),
     path("", include(router.urls)),
     path("drafts/init/", DraftInitAPI.as_view()),
@@ -23,4 +25,5 @@ urlpatterns = [
     path("drafts/<str:draft_key>/analyze/", DraftAnalyzeAPI.as_view()),
     path("drafts/<str:draft_key>/estimate/", DraftEstimateAPI.as_view()),
     path("drafts/<str:draft_key>/publish/", DraftPublishAPI.as_view()),
+    path("analysis/cache-stats/", AnalysisCacheStatsAPI.as_view()),
 ]
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""估价规则表：把 估价选项/选项取值/成色/瑕疵扣减矩阵/型号基准价 预编译成进程内只读表。
+
+- 估价时只做 dict 查找 + Decimal 运算，命中时不查库
+- 随目录版本号（catalog_cache，存库、各进程共享）失效：任一规则表/目录表写入都会 bump 版本，下次取表时重建
+- 型号 / 类目 / 成色 id 在表里查不到（别的进程刚写入、本进程还没看到新版本）时回查一次库，不当作不存在
+- 所有数值在构建时一次性转成 Decimal，避免每次估价 float -> str -> Decimal
+"""
+import threading
+from dataclasses import dataclass
+from decimal import Decimal
+from types import MappingProxyType
+
+from .catalog_cache import get_catalog_version
+from .models import Category, ConditionGrade, DefectSeverity, DeviceModel, ValuationChoice
+from .pricing import DefectPenaltyMatrix, defect_penalty_for_count
+
+
+@dataclass(frozen=True)
+class GradeRule:
+    id: int
+    category_id: int
+    label: str
+    factor: Decimal
+
+
+@dataclass(frozen=True)
+class ValuationRuleTable:
+    version: int
+    # device_model_id -> base_price（可能为 None）
+    base_prices: MappingProxyType
+    # device_model_id -> category_id（型号 -> 品牌 -> 类目）
+    model_categories: MappingProxyType
+    # valuation_choice_id -> depreciation_rate（Decimal）
+    choice_depreciation: MappingProxyType
+    # category_id -> (name, code)
+    categories: MappingProxyType
+    # grade_id -> GradeRule；(category_id, label) -> GradeRule
+    grades_by_id: MappingProxyType
+    grades_by_label: MappingProxyType
+    # category_id -> DefectPenaltyMatrix（检查项 x 损耗等级 的扣减权重）
+    defect_matrices: MappingProxyType
+
+    def total_depreciation(self, choice_ids) -> Decimal:
+        rates = self.choice_depreciation
+        return sum((rates[i] for i in set(choice_ids or []) if i in rates), Decimal("0"))
+
+    def defect_penalty(self, category_id, defects) -> Decimal:
+        """瑕疵扣减：类目配置了 DefectSeverity 时，结构化 (item_code, level) 按权重计算，
+        自由文本 / 未配置的检查项按条数映射后叠加（见 DefectPenaltyMatrix.penalty）；
+        类目未配置时整体按条数映射。
+        """
+        defects = defects or []
+        matrix = self.defect_matrices.get(category_id)
+        if matrix is not None:
+            return matrix.penalty(defects)
+        return defect_penalty_for_count(len(defects))
+
+    def base_price(self, device_model_id):
+        """型号基准价；型号不存在返回 None（型号存在但未配置基准价也是 None）。"""
+        if device_model_id in self.base_prices:
+            return self.base_prices[device_model_id]
+        return DeviceModel.objects.filter(id=device_model_id).values_list("base_price", flat=True).first()
+
+    def model_category(self, device_model_id):
+        """型号 -> 类目 id；型号不存在返回 None。"""
+        category_id = self.model_categories.get(device_model_id)
+        if category_id is None:
+            category_id = (
+                DeviceModel.objects.filter(id=device_model_id).values_list("brand__category_id", flat=True).first()
+            )
+        return category_id
+
+    def category(self, category_id):
+        """类目 -> (name, code)；类目不存在返回 None。"""
+        category = self.categories.get(category_id)
+        if category is None:
+            category = Category.objects.filter(id=category_id).values_list("name", "code").first()
+        return category
+
+    def grade(self, category_id, grade_id=None, label=""):
+        if grade_id:
+            grade = self.grades_by_id.get(grade_id)
+            if grade is None:
+                row = (
+                    ConditionGrade.objects.filter(id=grade_id)
+                    .values_list("id", "category_id", "label", "factor")
+                    .first()
+                )
+                grade = GradeRule(*row) if row else None
+            return grade
+        if label:
+            return self.grades_by_label.get((category_id, label))
+        return None
+
+
+def _build(version: int) -> ValuationRuleTable:
+    base_prices, model_categories = {}, {}
+    for dm_id, base_price, category_id in DeviceModel.objects.values_list("id", "base_price", "brand__category_id"):
+        base_prices[dm_id] = base_price
+        model_categories[dm_id] = category_id
+    choice_depreciation = {
+        cid: Decimal(str(rate)) for cid, rate in ValuationChoice.objects.values_list("id", "depreciation_rate")
+    }
+    categories = {cid: (name, code) for cid, name, code in Category.objects.values_list("id", "name", "code")}
+
+    grades_by_id, grades_by_label = {}, {}
+    for gid, category_id, label, factor in ConditionGrade.objects.values_list("id", "category_id", "label", "factor"):
+        g = GradeRule(id=gid, category_id=category_id, label=label, factor=factor)
+        grades_by_id[gid] = g
+        grades_by_label[(category_id, label)] = g
+
+    weights = {}
+    for category_id, code, level, weight in DefectSeverity.objects.values_list(
+        "defect_item__category_id", "defect_item__code", "level", "penalty_weight"
+    ):
+        weights.setdefault(category_id, {})[(code, level)] = weight
+    defect_matrices = {category_id: DefectPenaltyMatrix(w) for category_id, w in weights.items()}
+
+    return ValuationRuleTable(
+        version=version,
+        base_prices=MappingProxyType(base_prices),
+        model_categories=MappingProxyType(model_categories),
+        choice_depreciation=MappingProxyType(choice_depreciation),
+        categories=MappingProxyType(categories),
+        grades_by_id=MappingProxyType(grades_by_id),
+        grades_by_label=MappingProxyType(grades_by_label),
+        defect_matrices=MappingProxyType(defect_matrices),
+    )
+
+
+_lock = threading.Lock()
+_table = None
+
+
+def get_rule_table() -> ValuationRuleTable:
+    """取当前规则表；版本号变化时重建（同一时刻只有一个线程重建）。"""
+    global _table
+    version = get_catalog_version()
+    table = _table
+    if table is not None and table.version == version:
+        return table
+    with _lock:
+        if _table is None or _table.version != version:
+            _table = _build(version)
+        return _table
@@ -4,10 +4,18 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from django.core.exceptions import FieldError
-
-from .services import ValuationEngine, TradeService
-from apps.accounts.services.credit import apply_credit_event, can_trade
-from .models import Category, DeviceModel, Product, Order, Brand
+from django.db.models import OuterRef
+import time
+from decimal import Decimal, InvalidOperation
+
+from .services import ValuationEngine, TradeService, OrderStateMachine, InvalidOrderTransition, MAX_BATCH_SIZE
+from .pagination import ProductCursorPagination
+from .catalog_cache import CatalogCacheMixin
+from . import suggest as suggest_module
+from .suggest import device_model_suggest_index
+from .search import search_products, search_device_models, normalize_query, DEFAULT_LIMIT, MAX_LIMIT
+from apps.accounts.services.credit import can_trade
+from .models import Category, DeviceModel, Product, Order, Brand, main_image_subquery
 from .serializers import (
     ValuationRequestSerializer,
     ProductCreateSerializer,
@@ -40,15 +48,35 @@ class ValuationAPI(APIView):
         return Response(serializer.errors, status=400)
 
 
+class BatchValuationAPI(APIView):
+    """批量估价接口：一次请求估价多台设备 / 多种成色组合，结果与输入同序
+
+    POST /api/market/valuation/batch/  {"items": [...]}，单项格式见 ValuationEngine.estimate_batch
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items = request.data.get("items")
+        if not isinstance(items, list) or not items:
+            return Response({"error": "items must be a non-empty list"}, status=400)
+        if len(items) > MAX_BATCH_SIZE:
+            return Response({"error": f"at most {MAX_BATCH_SIZE} items per request"}, status=400)
+
+        return Response({"count": len(items), "results": ValuationEngine.estimate_batch(items), "currency": "CNY"})
+
+
 class ProductViewSet(ModelViewSet):
     """商品上架与浏览接口"""
 
-    queryset = Product.objects.select_related(
-        "seller",
-        "device_model",
-        "device_model__brand",
-        "device_model__brand__category",
-    ).all()
+    # ?ordering= 允许的排序字段（可加 "-" 前缀倒序），均有 (status, <field>) 类复合索引支撑
+    ORDERING_FIELDS = (
+        "selling_price", "value_score", "diff_pct", "market_diff_pct", "created_at", "view_count", "favorite_count",
+    )
+    # 可为空的排序列：游标分页时排除空值（游标位置无法表示 NULL）
+    NULLABLE_ORDERING_FIELDS = ("value_score", "diff_pct", "market_diff_pct")
+
+    queryset = Product.objects.with_relations().all()
     serializer_class = ProductCreateSerializer
     permission_classes = [IsAuthenticated]
 
@@ -57,6 +85,16 @@ class ProductViewSet(ModelViewSet):
             return ProductListSerializer
         return ProductCreateSerializer
 
+    @property
+    def paginator(self):
+        """列表默认不分页（兼容旧前端）；?paginate=cursor 时启用游标分页。"""
+        if not hasattr(self, "_paginator"):
+            if self.action == "list" and ProductCursorPagination.is_requested(self.request):
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = None
+        return self._paginator
+
     def retrieve(self, request, *args, **kwargs):
         """商品详情：在原有序列化结果基础上，额外返回联查得到的类目/品牌/型号信息。
 
@@ -65,6 +103,8 @@ class ProductViewSet(ModelViewSet):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         data = dict(serializer.data)
+        # 详情页展示原图（main_image），列表小图不返回
+        data.pop("main_thumb", None)
 
         # device_model -> brand -> category
         dm = getattr(instance, "device_model", None)
@@ -101,8 +141,10 @@ class ProductViewSet(ModelViewSet):
         if not can_trade(getattr(self.request.user, "credit_score", 0)):
             return Response({"error": "信用分过低，无法上架"}, status=403)
 
+        device_model = serializer.validated_data["device_model"]
         serializer.save(
             seller=self.request.user,
+            category_id=device_model.brand.category_id,
             status="on_sale",
             estimated_price=0,
         )
@@ -115,21 +157,29 @@ class ProductViewSet(ModelViewSet):
 
         额外支持：
         - category_id：按类目筛选上架商品
+        - min_price / max_price / quality_grade / grade_label / location：范围与属性筛选
+        - ordering：selling_price / value_score / diff_pct / created_at / view_count / favorite_count，
+          "-" 前缀为倒序
 
         GET /api/market/products/                          # 市场大厅
         GET /api/market/products/?seller_id=123            # 卖家上架中商品
         GET /api/market/products/?category_id=15           # 指定类目
         GET /api/market/products/?seller_id=123&category_id=15
+        GET /api/market/products/?paginate=cursor&page_size=20   # 游标分页（next/previous 链接翻页）
+        GET /api/market/products/?category_id=15&max_price=2000&ordering=-value_score   # 2000 元内最划算的手机
+        GET /api/market/products/?below_market=1&ordering=market_diff_pct      # 低于市场价最多的排前面
+
+        在 self.queryset 基础上构建，保留 select_related，并用子查询一次性带出主图，
+        列表每页的查询数与页大小无关。
         """
-        qs = Product.objects.filter(status="on_sale")
+        qs = super().get_queryset().with_main_image().filter(status="on_sale")
 
-        # filter by category_id (Product 本身不存 category_id，需要通过 device_model -> brand -> category 过滤)
+        # filter by category_id（Product 冗余了 category_id，走 (status, category, created_at) 索引，无需 JOIN）
         category_id = self.request.query_params.get("category_id")
         if category_id is not None and str(category_id).strip() != "":
             try:
                 cid = int(str(category_id).strip())
-                # 最稳：按关联链过滤
-                qs = qs.filter(device_model__brand__category_id=cid)
+                qs = qs.filter(category_id=cid)
             except Exception:
                 # ignore invalid category_id instead of returning empty
                 pass
@@ -147,7 +197,103 @@ class ProductViewSet(ModelViewSet):
                 # ignore invalid seller_id instead of returning empty
                 pass
 
-        return qs.distinct()
+        # price range: min_price / max_price（按 selling_price）
+        for param, lookup in (("min_price", "selling_price__gte"), ("max_price", "selling_price__lte")):
+            raw = self.request.query_params.get(param)
+            if raw is not None and str(raw).strip() != "":
+                try:
+                    value = Decimal(str(raw).strip())
+                except InvalidOperation:
+                    continue
+                # NaN / Infinity 视为非法参数，忽略
+                if value.is_finite():
+                    qs = qs.filter(**{lookup: value})
+
+        # quality_grade：支持单值或逗号分隔多值，如 A,B
+        quality_grade = self.request.query_params.get("quality_grade")
+        if quality_grade:
+            grades = [g.strip().upper() for g in str(quality_grade).split(",") if g.strip()]
+            if grades:
+                qs = qs.filter(quality_grade__in=grades)
+
+        # grade_label：成色标签精确匹配，如 9成新
+        grade_label = self.request.query_params.get("grade_label")
+        if grade_label:
+            qs = qs.filter(grade_label=str(grade_label).strip())
+
+        # location：前缀匹配（LIKE 'xx%' 可走索引），如 深圳市
+        location = self.request.query_params.get("location")
+        if location and str(location).strip():
+            qs = qs.filter(location__istartswith=str(location).strip())
+
+        # below_market=1：只看低于成交价中位数的商品（Product.market_diff_pct < 0，走 (status, market_diff_pct) 索引）
+        if str(self.request.query_params.get("below_market") or "").strip() in ("1", "true"):
+            qs = qs.filter(market_diff_pct__lt=0)
+
+        ordering = self.get_ordering()
+        if ordering:
+            # 按比价排序只看有成交统计的商品；其余可空列仅在游标分页时排除空值
+            if ordering[0].lstrip("-") == "market_diff_pct" or (
+                ordering[0].lstrip("-") in self.NULLABLE_ORDERING_FIELDS and ProductCursorPagination.is_requested(self.request)
+            ):
+                qs = qs.filter(**{f"{ordering[0].lstrip('-')}__isnull": False})
+            qs = qs.order_by(*ordering)
+
+        # 过滤条件都沿外键正向关联，不会产生重复行，无需 distinct()
+        return qs
+
+    def get_ordering(self):
+        """解析 ?ordering=-value_score 之类的参数，返回 (字段, id) 排序元组；非法/缺省返回 None。"""
+        raw = str(self.request.query_params.get("ordering") or "").strip()
+        desc = raw.startswith("-")
+        field = raw[1:] if desc else raw
+        if field not in self.ORDERING_FIELDS:
+            return None
+        # 追加 id 作为同值时的稳定次序
+        return (("-" if desc else "") + field, "-id" if desc else "id")
+
+
+class SearchAPI(APIView):
+    """关键词搜索：上架商品（标题/描述）+ 设备型号（名称），按相关度排序。
+
+    GET /api/market/search/?q=iPhone 13&limit=20
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        q = normalize_query(request.query_params.get("q"))
+        if not q:
+            return Response({"error": "q is required"}, status=400)
+
+        try:
+            limit = int(request.query_params.get("limit") or DEFAULT_LIMIT)
+        except ValueError:
+            limit = DEFAULT_LIMIT
+        limit = max(1, min(limit, MAX_LIMIT))
+
+        started = time.perf_counter()
+        base_qs = Product.objects.with_relations().with_main_image().filter(status="on_sale")
+        products = ProductListSerializer(search_products(q, limit, base_qs=base_qs), many=True).data
+        device_models = [
+            {
+                "id": dm.id,
+                "name": dm.name,
+                "brand_id": dm.brand_id,
+                "brand_name": dm.brand.name,
+                "category_id": dm.brand.category_id,
+            }
+            for dm in search_device_models(q, limit)
+        ]
+
+        return Response(
+            {
+                "query": q,
+                "products": products,
+                "device_models": device_models,
+                "took_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+        )
 
 
 class OrderViewSet(ModelViewSet):
@@ -171,7 +317,10 @@ class OrderViewSet(ModelViewSet):
         user = self.request.user
         action = getattr(self, "action", None)
 
-        qs = Order.objects.select_related("product", "buyer", "product__seller")
+        qs = Order.objects.select_related("product", "buyer", "product__seller").annotate(
+            # 列表展示小缩略图，与单条回退路径一致（未生成时回退原图）
+            product_main_image_name=main_image_subquery(OuterRef("product_id"), thumb=True)
+        )
 
         if action in {"sell", "ship"}:
             return qs.filter(product__seller=user)
@@ -179,17 +328,6 @@ class OrderViewSet(ModelViewSet):
         # 默认：买家订单
         return qs.filter(buyer=user)
 
-    def _ensure_buyer(self, order: Order):
-        if order.buyer_id != self.request.user.id:
-            raise PermissionError("not buyer")
-
-    def _ensure_seller(self, order: Order):
-        if getattr(order, "product_id", None) is None or order.product.seller_id != self.request.user.id:
-            raise PermissionError("not seller")
-
-    def _is_terminal(self, status: str) -> bool:
-        return status in {"completed", "refunded"}
-
     def _status_view(self, status: str, perspective: str) -> str:
         """Return UI-friendly status label depending on perspective.
 
@@ -267,11 +405,8 @@ class OrderViewSet(ModelViewSet):
     @action(detail=False, methods=["get"])
     def buy(self, request):
         """买家订单列表：我买的"""
-        qs = (
-            Order.objects.select_related("product", "buyer", "product__seller")
-            .filter(buyer=request.user)
-            .order_by("-id")
-        )
+        # get_queryset 按 action 过滤可见订单，并注解主图小图（避免逐行查询）
+        qs = self.get_queryset().order_by("-id")
         page = self.paginate_queryset(qs)
         if page is not None:
             ser = self.get_serializer(page, many=True)
@@ -286,11 +421,8 @@ class OrderViewSet(ModelViewSet):
     @action(detail=False, methods=["get"])
     def sell(self, request):
         """卖家订单列表：我卖出的（通过订单关联商品联查卖家）"""
-        qs = (
-            Order.objects.select_related("product", "buyer", "product__seller")
-            .filter(product__seller=request.user)
-            .order_by("-id")
-        )
+        # get_queryset 按 action 过滤可见订单，并注解主图小图（避免逐行查询）
+        qs = self.get_queryset().order_by("-id")
         page = self.paginate_queryset(qs)
         if page is not None:
             ser = self.get_serializer(page, many=True)
@@ -302,216 +434,88 @@ class OrderViewSet(ModelViewSet):
         self._attach_status_view(data, "seller")
         return Response(data)
 
-    @action(detail=True, methods=["post"])
-    def confirm_receipt(self, request, pk=None):
-        """买家确认收货 -> 状态：completed（完成）"""
-        try:
-            order = self.get_object()
-            self._ensure_buyer(order)
-
-            if self._is_terminal(order.status):
-                return Response({"error": "order is terminal"}, status=400)
+    def _transition(self, pk, op, perspective, idempotent_terminal=False):
+        """执行订单状态流转（OrderStateMachine，一条条件 UPDATE）。
 
-            if order.status not in {"shipped"}:
-                return Response({"error": "invalid status"}, status=400)
-
-            order.status = "completed"
-            order.save(update_fields=["status"])
-
-            # 订单完成：买家 +3，卖家 +3（幂等）
-            try:
-                apply_credit_event(
-                    user=request.user,
-                    event_type="order_completed",
-                    ref_type="order",
-                    ref_id=str(order.id),
-                )
-                apply_credit_event(
-                    user=order.product.seller,
-                    event_type="order_completed",
-                    ref_type="order",
-                    ref_id=str(order.id),
+        返回 (新状态, None)；失败返回 (None, 错误 Response)。
+        idempotent_terminal：订单已是终态时按成功返回当前状态（取消/退款重复提交）。
+        """
+        try:
+            order_id = int(pk)
+        except (TypeError, ValueError):
+            return None, Response({"error": "not found"}, status=404)
+        try:
+            return OrderStateMachine.transition(order_id, self.request.user, op), None
+        except Order.DoesNotExist:
+            return None, Response({"error": "not found"}, status=404)
+        except PermissionError:
+            return None, Response({"error": "permission denied"}, status=403)
+        except InvalidOrderTransition as e:
+            if e.terminal and idempotent_terminal:
+                return None, Response(
+                    {"order_id": order_id, "status": e.status, "status_view": self._status_view(e.status, perspective)}
                 )
-            except Exception:
-                # 积分不影响主流程
-                pass
+            return None, Response({"error": str(e)}, status=400)
 
-            return Response(
-                {
-                    "order_id": order.id,
-                    "status": order.status,
-                    "status_view": self._status_view(order.status, "buyer"),
-                }
-            )
-        except PermissionError:
-            return Response({"error": "permission denied"}, status=403)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+    def _transition_response(self, pk, status, perspective):
+        return Response({"order_id": int(pk), "status": status, "status_view": self._status_view(status, perspective)})
+
+    @action(detail=True, methods=["post"])
+    def confirm_receipt(self, request, pk=None):
+        """买家确认收货 -> 状态：completed（完成）"""
+        status, error = self._transition(pk, "confirm_receipt", "buyer")
+        if error is not None:
+            return error
+        # 订单完成：买家 +3，卖家 +3，随状态变更写入 outbox 异步记分
+        return self._transition_response(pk, status, "buyer")
 
     @action(detail=True, methods=["post"])
     def pay(self, request, pk=None):
         """买家付款 -> 状态：pending_shipment（待发货）"""
-        try:
-            order = self.get_object()
-            self._ensure_buyer(order)
-
-            if self._is_terminal(order.status):
-                return Response({"error": "order is terminal"}, status=400)
-
-            if order.status not in {"pending_payment", "created"}:
-                return Response({"error": "invalid status"}, status=400)
-
-            order.status = "pending_shipment"
-            order.save(update_fields=["status"])
-            return Response(
-                {
-                    "order_id": order.id,
-                    "status": order.status,
-                    "status_view": self._status_view(order.status, "buyer"),
-                }
-            )
-        except PermissionError:
-            return Response({"error": "permission denied"}, status=403)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        status, error = self._transition(pk, "pay", "buyer")
+        if error is not None:
+            return error
+        return self._transition_response(pk, status, "buyer")
 
     @action(detail=True, methods=["post"])
     def cancel_payment(self, request, pk=None):
         """买家取消付款 -> 状态：refunded（已退款/取消），终态不可继续操作"""
-        try:
-            order = self.get_object()
-            self._ensure_buyer(order)
-
-            if self._is_terminal(order.status):
-                return Response(
-                    {
-                        "order_id": order.id,
-                        "status": order.status,
-                        "status_view": self._status_view(order.status, "buyer"),
-                    }
-                )
-
-            if order.status not in {"created", "pending_payment"}:
-                return Response({"error": "invalid status"}, status=400)
-
-            order.status = "refunded"
-            order.save(update_fields=["status"])
-
-            # 取消付款：取消者（买家） -3（幂等）
-            try:
-                apply_credit_event(
-                    user=request.user,
-                    event_type="payment_cancelled",
-                    ref_type="order",
-                    ref_id=str(order.id),
-                )
-            except Exception:
-                pass
-
-            return Response(
-                {
-                    "order_id": order.id,
-                    "status": order.status,
-                    "status_view": self._status_view(order.status, "buyer"),
-                }
-            )
-        except PermissionError:
-            return Response({"error": "permission denied"}, status=403)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        status, error = self._transition(pk, "cancel_payment", "buyer", idempotent_terminal=True)
+        if error is not None:
+            return error
+        # 取消付款：取消者（买家） -3，随状态变更写入 outbox 异步记分；商品同一事务放回 on_sale
+        return self._transition_response(pk, status, "buyer")
 
     @action(detail=True, methods=["post"])
     def ship(self, request, pk=None):
         """卖家发货 -> 状态：shipped（待收货）"""
-        try:
-            order = self.get_object()
-            self._ensure_seller(order)
-
-            if self._is_terminal(order.status):
-                return Response({"error": "order is terminal"}, status=400)
-
-            if order.status not in {"pending_shipment"}:
-                return Response({"error": "invalid status"}, status=400)
-
-            order.status = "shipped"
-            order.save(update_fields=["status"])
-            return Response(
-                {
-                    "order_id": order.id,
-                    "status": order.status,
-                    "status_view": self._status_view(order.status, "seller"),
-                }
-            )
-        except PermissionError:
-            return Response({"error": "permission denied"}, status=403)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        status, error = self._transition(pk, "ship", "seller")
+        if error is not None:
+            return error
+        return self._transition_response(pk, status, "seller")
 
     @action(detail=True, methods=["post"])
     def refund(self, request, pk=None):
         """买家退货退款 -> 状态：refunded（已退款/取消），终态不可继续操作"""
-        try:
-            order = self.get_object()
-            self._ensure_buyer(order)
-
-            if self._is_terminal(order.status):
-                return Response(
-                    {
-                        "order_id": order.id,
-                        "status": order.status,
-                        "status_view": self._status_view(order.status, "buyer"),
-                    }
-                )
-
-            if order.status not in {"shipped"}:
-                return Response({"error": "invalid status"}, status=400)
-
-            order.status = "refunded"
-            order.save(update_fields=["status"])
-
-            # 退货退款：买家 -3，卖家 -1（幂等）
-            try:
-                apply_credit_event(
-                    user=request.user,
-                    event_type="order_refunded",
-                    party="buyer",
-                    ref_type="order",
-                    ref_id=str(order.id),
-                )
-                apply_credit_event(
-                    user=order.product.seller,
-                    event_type="order_refunded",
-                    party="seller",
-                    ref_type="order",
-                    ref_id=str(order.id),
-                )
-            except Exception:
-                pass
-
-            return Response(
-                {
-                    "order_id": order.id,
-                    "status": order.status,
-                    "status_view": self._status_view(order.status, "buyer"),
-                }
-            )
-        except PermissionError:
-            return Response({"error": "permission denied"}, status=403)
-        except Exception as e:
-            return Response({"error": str(e)}, status=400)
+        status, error = self._transition(pk, "refund", "buyer", idempotent_terminal=True)
+        if error is not None:
+            return error
+        # 退货退款：买家 -3，卖家 -1，随状态变更写入 outbox 异步记分；商品同一事务放回 on_sale
+        return self._transition_response(pk, status, "buyer")
 
 
-class CategoryViewSet(ModelViewSet):
-    """类目列表（market_category）"""
+class CategoryViewSet(CatalogCacheMixin, ModelViewSet):
+    """类目列表（market_category），list/retrieve 走版本化缓存并支持 ETag/304"""
 
     queryset = Category.objects.all().order_by("id")
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
+    catalog_scope = "categories"
 
     http_method_names = ["get"]
 
 
-class BrandViewSet(ModelViewSet):
+class BrandViewSet(CatalogCacheMixin, ModelViewSet):
     """品牌列表（market_brand）
 
     GET /api/market/brands/
@@ -521,6 +525,7 @@ class BrandViewSet(ModelViewSet):
     queryset = Brand.objects.select_related("category").all().order_by("id")
     serializer_class = BrandSerializer
     permission_classes = [IsAuthenticated]
+    catalog_scope = "brands"
 
     http_method_names = ["get"]
 
@@ -536,7 +541,7 @@ class BrandViewSet(ModelViewSet):
         return qs
 
 
-class DeviceModelViewSet(ModelViewSet):
+class DeviceModelViewSet(CatalogCacheMixin, ModelViewSet):
     """型号列表（market_devicemodel）
 
     支持按类目与品牌过滤：
@@ -551,6 +556,7 @@ class DeviceModelViewSet(ModelViewSet):
     queryset = DeviceModel.objects.select_related("brand", "brand__category").all().order_by("id")
     serializer_class = DeviceModelSerializer
     permission_classes = [IsAuthenticated]
+    catalog_scope = "device_models"
 
     http_method_names = ["get"]
 
@@ -574,6 +580,27 @@ class DeviceModelViewSet(ModelViewSet):
 
         return qs
 
+    @action(detail=False, methods=["get"], url_path="suggest")
+    def suggest(self, request):
+        """型号输入联想（SellDeviceView 步骤1），走进程内前缀/trigram 索引，不查库。
+
+        用法：
+        - GET /api/market/device-models/suggest/?q=iphone 13&category_id=<cid>&brand_id=<bid>&limit=10
+        """
+        q = request.query_params.get("q") or ""
+        try:
+            limit = int(request.query_params.get("limit") or suggest_module.DEFAULT_LIMIT)
+            category_id = request.query_params.get("category_id")
+            category_id = int(category_id) if category_id else None
+            brand_id = request.query_params.get("brand_id")
+            brand_id = int(brand_id) if brand_id else None
+        except ValueError:
+            return Response({"error": "invalid limit/category_id/brand_id"}, status=400)
+        limit = max(1, min(limit, suggest_module.MAX_LIMIT))
+
+        device_model_suggest_index.ensure_fresh()
+        return Response(device_model_suggest_index.search(q, limit, category_id=category_id, brand_id=brand_id))
+
     @action(detail=False, methods=["get"], url_path="reference")
     def reference(self, request):
         """参考机型信息（用于商品详情页右侧“商品参考”扩展页）。
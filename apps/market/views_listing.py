@@ -1,24 +1,34 @@
+import math
 import os
 import uuid
 import hashlib
 from decimal import Decimal
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.utils import timezone
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-
-from .ai_service import AIService
-from .pricing import estimate_range, compare_price, value_score_from_diff
-from .models import Category, DeviceModel, Product, ProductImage, ConditionGrade
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+
+from .analysis import enqueue_analysis, wait_for_result
+from .catalog_cache import get_catalog_version
+from .drafts import clear_draft, load_draft, save_draft
+from .image_pipeline import enqueue_image_processing
+from .recognition_cache import recognition_cache
+from .services import ValuationEngine, MarketComparisonService
+from .valuation_rules import get_rule_table
+from .pricing import compare_price, parse_defect, value_score_from_diff
+from .models import Product, ProductImage, RecognitionResult
 from .serializers import (
     DraftInitSerializer, UploadImageSerializer,
     EstimateSerializer, PublishSerializer
 )
 
+User = get_user_model()
+
 ALLOWED_EXT = {".jpg", ".jpeg", ".png"}
 MAX_IMAGES = 4
 
@@ -47,6 +57,8 @@ class DraftInitAPI(APIView):
         ser.is_valid(raise_exception=True)
 
         draft_key = uuid.uuid4().hex
+        # 步骤1 meta 存服务端，后续步骤不必重传
+        save_draft(request.user.id, draft_key, meta=dict(ser.validated_data))
         # 前端后续都带这个 draft_key
         return Response({
             "draft_key": draft_key,
@@ -54,120 +66,290 @@ class DraftInitAPI(APIView):
         })
 
 class DraftUploadImagesAPI(APIView):
+    """上传草稿图片：一次请求可传多张（multipart 字段 images，兼容旧的单张 image）
+
+    - 边写边算 sha256：先写临时文件，完成后按内容 hash 命名（同内容只落盘一份）
+    - 同一草稿里重复上传同一张图直接返回已有记录，不占名额
+    - 4 张上限在事务里锁住上传者行后计数，并发上传也不会超
+    - 落盘的是原始字节，标准化与缩略图由 image_pipeline 在后台生成
+    - 失败/超额时本次新落盘的文件不在请求里删：同内容文件可能正被另一个尚未提交的上传复用，
+      无记录引用的文件由 gc_draft_images 过了宽限期再回收
+    """
+
     permission_classes = [IsAuthenticated]
 
     def post(self, request, draft_key: str):
         folder = ensure_media_dir()
 
-        # 数量限制
-        exist = ProductImage.objects.filter(uploaded_by=request.user, draft_key=draft_key, product__isnull=True).count()
-        if exist >= MAX_IMAGES:
+        files = request.FILES.getlist("images") or request.FILES.getlist("image")
+        if not files:
+            return Response({"detail": "请选择图片"}, status=400)
+        if len(files) > MAX_IMAGES:
             return Response({"detail": "最多上传4张"}, status=400)
 
-        ser = UploadImageSerializer(data=request.data)
-        ser.is_valid(raise_exception=True)
-        f = ser.validated_data["image"]
+        # 快速失败：事务外先粗查一次，避免明显超额时还去写文件
+        draft_imgs = ProductImage.objects.filter(uploaded_by=request.user, draft_key=draft_key, product__isnull=True)
+        if draft_imgs.count() >= MAX_IMAGES:
+            return Response({"detail": "最多上传4张"}, status=400)
 
-        image_name, ext = encrypt_filename(getattr(f, "name", "upload.jpg"))
+        stored = []
+        try:
+            for f in files:
+                ser = UploadImageSerializer(data={"image": f})
+                ser.is_valid(raise_exception=True)
+                encrypt_filename(getattr(f, "name", "upload.jpg"))  # 只校验扩展名
+                image_name, content_hash, _ = store_upload(folder, f)
+                stored.append((f, image_name, content_hash))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        with transaction.atomic():
+            # 锁住上传者行：同一用户的上传串行计数（SQLite 本身写入串行，select_for_update 为空操作）
+            User.objects.select_for_update().filter(id=request.user.id).first()
+            existing = list(draft_imgs.order_by("sort_order", "id"))
+            seen = {img.content_hash for img in existing if img.content_hash}
+            new = []
+            for f, image_name, content_hash in stored:
+                if content_hash not in seen:
+                    seen.add(content_hash)
+                    new.append((f, image_name, content_hash))
+            over_cap = len(existing) + len(new) > MAX_IMAGES
+            if over_cap:
+                new = []
+
+            # 逐条 create（最多 4 条）：MySQL 的 bulk_create 不回填主键
+            next_order = max((img.sort_order for img in existing), default=-1) + 1
+            created_imgs = []
+            for i, (f, image_name, content_hash) in enumerate(new):
+                is_main = not existing and i == 0
+                created_imgs.append(ProductImage.objects.create(
+                    uploaded_by=request.user,
+                    draft_key=draft_key,
+                    image_name=image_name,
+                    original_name=getattr(f, "name", ""),
+                    size_bytes=getattr(f, "size", 0) or 0,
+                    content_hash=content_hash,
+                    is_main=is_main,
+                    sort_order=0 if is_main else next_order + i,
+                ))
+                # 主图一上传就开始识别，等用户点“识别”时结果多半已经好了
+                if is_main:
+                    enqueue_analysis(created_imgs[-1].id)
+
+            # 重编码为 progressive JPEG + 生成缩略图（进程池，事务提交后开始）
+            enqueue_image_processing(img.id for img in created_imgs)
+
+        if over_cap:
+            return Response({"detail": "最多上传4张"}, status=400)
 
-        # 保存文件（统一转 jpg：这里先直接原样写入，后续你要真转jpg再加 Pillow）
-        path = os.path.join(folder, image_name)
-        with open(path, "wb") as out:
+        by_hash = {img.content_hash: img for img in [*existing, *created_imgs] if img.content_hash}
+        data = [
+            {
+                "id": img.id,
+                "image_name": img.image_name,
+                "is_main": img.is_main,
+                "sort_order": img.sort_order,
+            }
+            for img in (by_hash[h] for _, _, h in stored)
+        ]
+        if "images" not in request.FILES:
+            return Response(data[0], status=201)  # 旧客户端：单张 image
+        return Response({"images": data}, status=201)
+
+
+def store_upload(folder: str, f):
+    """流式写入临时文件并计算 sha256，再按内容 hash 命名；同内容文件已存在则复用。
+
+    返回 (image_name, content_hash, 是否新落盘)。
+    """
+    h = hashlib.sha256()
+    tmp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as out:
             for chunk in f.chunks():
                 out.write(chunk)
+                h.update(chunk)
+        content_hash = h.hexdigest()
+        image_name = content_hash[:32] + ".jpg"  # 统一落盘 jpg（后台标准化时重编码为 JPEG）
+        path = os.path.join(folder, image_name)
+        if os.path.exists(path):
+            # 刷新 mtime：gc_draft_images 不会回收宽限期内被复用的文件
+            os.utime(path)
+            return image_name, content_hash, False
+        os.replace(tmp_path, path)
+        return image_name, content_hash, True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-        is_main = (exist == 0)
-        img = ProductImage.objects.create(
-            uploaded_by=request.user,
-            draft_key=draft_key,
-            image_name=image_name,
-            original_name=getattr(f, "name", ""),
-            size_bytes=getattr(f, "size", 0) or 0,
-            is_main=is_main,
-            sort_order=0 if is_main else exist,
-        )
-
-        return Response({
-            "id": img.id,
-            "image_name": img.image_name,
-            "is_main": img.is_main,
-            "sort_order": img.sort_order,
-        }, status=201)
 
 class DraftAnalyzeAPI(APIView):
+    """主图识别（异步，见 analysis.py）
+
+    POST：确保主图有识别任务（重复点击不会重复推理），立即返回当前状态；
+    GET：轮询结果，?wait=秒 长轮询（最多 10 秒）。
+    完成返回 200 + 成色/瑕疵（并记入草稿状态）；排队/识别中返回 202，前端稍后再 GET。
+    """
+
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, draft_key: str):
-        imgs = ProductImage.objects.filter(
+    def _main_image(self, request, draft_key):
+        return ProductImage.objects.filter(
             uploaded_by=request.user, draft_key=draft_key, product__isnull=True
-        ).order_by("sort_order","id")
-        if not imgs.exists():
+        ).order_by("sort_order", "id").first()
+
+    @staticmethod
+    def _response(request, draft_key, main_img, rec):
+        data = {"main_image": main_img.image_name, "status": rec.status}
+        if rec.status == RecognitionResult.STATUS_DONE:
+            # 返回：瑕疵文本 + 成色标签；同时记入草稿，estimate / publish 不传时直接用
+            analysis = {"grade_label": rec.grade_label, "grade_score": rec.grade_score, "defects": rec.defects}
+            save_draft(request.user.id, draft_key, analysis=analysis)
+            data.update(analysis)
+            return Response(data)
+        if rec.status == RecognitionResult.STATUS_FAILED:
+            data["detail"] = rec.message or "识别失败，请重试"
+            return Response(data)
+        return Response(data, status=202)
+
+    def post(self, request, draft_key: str):
+        main_img = self._main_image(request, draft_key)
+        if main_img is None:
             return Response({"detail": "请先上传图片"}, status=400)
+        return self._response(request, draft_key, main_img, enqueue_analysis(main_img.id))
 
-        main_img = imgs.first()
-        image_path = os.path.join(settings.MEDIA_ROOT, "products", main_img.image_name)
+    def get(self, request, draft_key: str):
+        main_img = self._main_image(request, draft_key)
+        if main_img is None:
+            return Response({"detail": "请先上传图片"}, status=400)
+        # 轮询时也补上丢失的任务（没有记录 / worker 已死的 pending、running）；失败结果照常返回，由 POST 重试
+        enqueue_analysis(main_img.id, retry_failed=False)
 
-        result = AIService.analyze_image(image_path)
+        wait = 0.0
+        raw = request.query_params.get("wait")
+        if raw:
+            try:
+                wait = float(raw)
+            except ValueError:
+                pass
+        return self._response(request, draft_key, main_img, wait_for_result(main_img.id, wait))
+
+class AnalysisCacheStatsAPI(APIView):
+    """识别结果缓存命中率（进程内计数，重启清零）"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(recognition_cache.stats())
+
+def _draft_field(request, draft, name, *sections):
+    """请求里带了就用请求的，否则按顺序从草稿各段里取。"""
+    value = request.data.get(name)
+    if value not in (None, ""):
+        return value
+    for section in sections:
+        value = (draft.get(section) or {}).get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _parse_meta(request, draft):
+    """解析步骤1 meta（请求优先，其次草稿），格式错误抛 ValueError。"""
+    category_id = _draft_field(request, draft, "category_id", "meta")
+    years_used = _draft_field(request, draft, "years_used", "meta")
+    original_price = _draft_field(request, draft, "original_price", "meta")
+    if category_id is None or years_used is None or original_price is None:
+        raise ValueError("缺少 category_id / years_used / original_price，请重新填写商品信息")
+    try:
+        category_id, years_used, original_price = int(category_id), float(years_used), Decimal(str(original_price))
+    except (TypeError, ValueError, ArithmeticError):
+        raise ValueError("category_id / years_used / original_price 格式错误")
+    # "nan" / "inf" 能通过 float() / Decimal()，必须显式拒绝（同 estimate_batch）
+    if not (math.isfinite(years_used) and original_price.is_finite()) or years_used < 0 or original_price <= 0:
+        raise ValueError("years_used 需 >= 0、original_price 需 > 0")
+    return category_id, years_used, original_price
+
+
+GRADE_LABEL_MAX_LENGTH = Product._meta.get_field("grade_label").max_length
+
+
+def _parse_grade_label(value) -> str:
+    """成色标签（请求或草稿里的，最终写入 Product.grade_label 列），超长抛 ValueError。"""
+    label = str(value or "").strip()
+    if len(label) > GRADE_LABEL_MAX_LENGTH:
+        raise ValueError(f"grade_label 最长 {GRADE_LABEL_MAX_LENGTH} 个字符")
+    return label
+
+
+def _normalize_defect(defect) -> str:
+    parsed = parse_defect(defect)
+    return f"{parsed[0]}:{parsed[1]}" if parsed else str(defect).strip()
+
+
+def _estimate_inputs(category_id, years_used, original_price, grade_label, defects, version=None):
+    """估价入参指纹：publish 与 estimate 入参一致时直接复用草稿里的估价结果。
+
+    瑕疵按解析后的内容排序比较（条数相同、内容不同也要重算），并带上目录版本号：
+    规则表改过（成色系数 / 扣减矩阵）就重算；version 取估价前读到的版本号，避免估价期间 bump 后误复用。
+    返回列表：草稿按 JSON 存。
+    """
+    return [
+        category_id, years_used, str(original_price.normalize()), grade_label or "",
+        sorted(_normalize_defect(d) for d in defects or []),
+        get_catalog_version() if version is None else version,
+    ]
+
+
+# publish 复用草稿估价时需要的价格字段（草稿按 JSON 存为字符串，读回转 Decimal）
+ESTIMATE_PRICE_KEYS = ("estimated_min", "estimated_max", "estimated_mid")
 
-        # 返回：瑕疵文本 + 成色标签
-        return Response({
-            "main_image": main_img.image_name,
-            "grade_label": result["label"],
-            "grade_score": result["score"],
-            "defects": result["defects"],
-        })
 
 class DraftEstimateAPI(APIView):
+    """估价区间：meta / 成色 / 瑕疵 请求里没带的从草稿状态取（见 drafts.py），结果存回草稿"""
+
     permission_classes = [IsAuthenticated]
 
     def post(self, request, draft_key: str):
         ser = EstimateSerializer(data=request.data)
         ser.is_valid(raise_exception=True)
 
-        # 步骤1的 meta 你现在前端传一次即可（建议前端把 meta 存起来，这里直接从 request 带）
-        category_id = int(request.data.get("category_id"))
-        years_used = float(request.data.get("years_used"))
-        original_price = Decimal(str(request.data.get("original_price")))
-
-        category = Category.objects.get(id=category_id)
-        category_code = category.code or "other"
-
-        # grade_factor：优先 grade_id，其次 grade_label 匹配 ConditionGrade
-        grade_factor = Decimal("0.75")
-        grade_label = ser.validated_data.get("grade_label", "")
-        grade_id = ser.validated_data.get("grade_id")
-
-        if grade_id:
-            g = ConditionGrade.objects.get(id=grade_id)
-            grade_label = g.label
-            grade_factor = g.factor
-        elif grade_label:
-            g = ConditionGrade.objects.filter(category=category, label=grade_label).first()
-            if g:
-                grade_factor = g.factor
-
-        # 瑕疵扣减：先用“假AI defects 数量”简单映射（后续再替换成 DefectSeverity 的权重）
-        defects = request.data.get("defects") or []
-        defects_count = len(defects)
-        defect_penalty = Decimal("0.00")
-        if defects_count == 0:
-            defect_penalty = Decimal("0.02")
-        elif defects_count == 1:
-            defect_penalty = Decimal("0.08")
-        else:
-            defect_penalty = Decimal("0.15")
-
-        r = estimate_range(
-            original_price=original_price,
-            years_used=years_used,
-            grade_factor=grade_factor,
-            defect_penalty=defect_penalty,
-            category_code=category_code,
-        )
+        draft = load_draft(request.user.id, draft_key)
+        try:
+            category_id, years_used, original_price = _parse_meta(request, draft)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        # 瑕疵扣减：结构化 (item_code, level) 按 DefectSeverity 权重，AI 输出的自由文本按条数映射（见 ValuationRuleTable.defect_penalty）
+        try:
+            grade_label = _parse_grade_label(_draft_field(request, draft, "grade_label", "analysis"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        defects = _draft_field(request, draft, "defects", "analysis") or []
+        version = get_catalog_version()
+        try:
+            r = ValuationEngine.estimate_listing(
+                category_id, years_used, original_price,
+                grade_id=ser.validated_data.get("grade_id"),
+                grade_label=grade_label,
+                defects=defects,
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        meta = {**(draft.get("meta") or {}),
+                "category_id": category_id, "years_used": years_used, "original_price": original_price}
+        estimate = {
+            "inputs": _estimate_inputs(category_id, years_used, original_price, r["grade"]["label"], defects, version),
+            "grade_label": r["grade"]["label"],
+            "defects": defects,
+            "result": {k: str(r[k]) for k in ESTIMATE_PRICE_KEYS},
+        }
+        save_draft(request.user.id, draft_key, meta=meta, estimate=estimate)
 
         return Response({
-            "category": {"id": category.id, "name": category.name, "code": category.code},
-            "grade": {"label": grade_label, "factor": str(grade_factor)},
+            "category": r["category"],
+            "grade": {"label": r["grade"]["label"], "factor": str(r["grade"]["factor"])},
             "estimated_min": str(r["estimated_min"]),
             "estimated_max": str(r["estimated_max"]),
             "estimated_mid": str(r["estimated_mid"]),
@@ -176,71 +358,105 @@ class DraftEstimateAPI(APIView):
         })
 
 class DraftPublishAPI(APIView):
+    """发布草稿：校验与估价都在事务外完成（草稿状态按唯一键读一行，规则表不查库），
+    事务里只剩 INSERT 商品 + 一条 UPDATE 绑定图片。
+    """
+
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request, draft_key: str):
         ser = PublishSerializer(data=request.data)
         ser.is_valid(raise_exception=True)
 
-        # 必须带步骤1 meta + 步骤3估价结果
-        category_id = int(request.data.get("category_id"))
-        device_model_id = request.data.get("device_model_id")
-        years_used = float(request.data.get("years_used"))
-        original_price = Decimal(str(request.data.get("original_price")))
-        grade_label = request.data.get("grade_label", "")
-        defects = request.data.get("defects") or []
-
-        category = Category.objects.get(id=category_id)
-        device_model = None
-        if device_model_id:
-            device_model = DeviceModel.objects.get(id=int(device_model_id))
-        else:
+        # 步骤1 meta + 步骤3估价结果：请求里没带的从草稿状态取
+        draft = load_draft(request.user.id, draft_key)
+        try:
+            category_id, years_used, original_price = _parse_meta(request, draft)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        device_model_id = _draft_field(request, draft, "device_model_id", "meta")
+        try:
+            grade_label = _parse_grade_label(_draft_field(request, draft, "grade_label", "estimate", "analysis"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        defects = _draft_field(request, draft, "defects", "estimate", "analysis") or []
+
+        if not device_model_id:
             # 没选型号也要能上架：临时用一个“占位型号”策略（建议你强制选择型号更好）
             return Response({"detail": "请先选择商品型号"}, status=400)
-
-        # 估价：复用 DraftEstimateAPI 的逻辑（此处简化重复一次）
-        g = ConditionGrade.objects.filter(category=category, label=grade_label).first()
-        grade_factor = g.factor if g else Decimal("0.75")
-
-        defect_penalty = Decimal("0.02") if len(defects) == 0 else (Decimal("0.08") if len(defects)==1 else Decimal("0.15"))
-        r = estimate_range(original_price, years_used, grade_factor, defect_penalty, category.code or "other")
+        try:
+            device_model_id = int(device_model_id)
+        except (TypeError, ValueError):
+            return Response({"detail": "device_model_id 格式错误"}, status=400)
+
+        # 型号 -> 类目走规则表；表里没有（别的进程刚导入、本进程还没看到新版本）时规则表回查一次库
+        model_category_id = get_rule_table().model_category(device_model_id)
+        if model_category_id is None:
+            return Response({"detail": "型号不存在"}, status=400)
+
+        # 估价：入参与 estimate 时一致则复用草稿里的结果，否则按同一套规则重算
+        saved = draft.get("estimate")
+        inputs = _estimate_inputs(category_id, years_used, original_price, grade_label, defects)
+        if saved and saved["inputs"] == inputs:
+            r = {k: Decimal(saved["result"][k]) for k in ESTIMATE_PRICE_KEYS}
+        else:
+            try:
+                r = ValuationEngine.estimate_listing(
+                    category_id, years_used, original_price, grade_label=grade_label, defects=defects
+                )
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=400)
 
         selling_price = ser.validated_data["selling_price"]
         diff_pct, market_tag = compare_price(Decimal(str(selling_price)), r["estimated_min"], r["estimated_max"])
         value_score = value_score_from_diff(diff_pct)
 
-        product = Product.objects.create(
-            seller=request.user,
-            device_model=device_model,
-            title=ser.validated_data["title"],
-            description=ser.validated_data["description"],
-            estimated_price=r["estimated_mid"],
-            selling_price=selling_price,
-            status="on_sale",
-            condition_data={
-                "category_id": category_id,
-                "years_used": years_used,
-                "original_price": str(original_price),
-                "grade_label": grade_label,
-                "defects": defects,
-                "market_tag": market_tag,
-                "diff_pct": diff_pct,
-                "value_score": value_score,
-            },
-            # 先简单映射：成色字段你后面想改成 grade_label 就行
-            quality_grade="B",
-        )
-
-        # 绑定图片：把 draft_key 下图片 product 赋值，并清空 draft_key
-        imgs = ProductImage.objects.filter(uploaded_by=request.user, draft_key=draft_key, product__isnull=True).order_by("sort_order","id")
+        imgs = ProductImage.objects.filter(uploaded_by=request.user, draft_key=draft_key, product__isnull=True)
         if not imgs.exists():
             return Response({"detail": "没有可绑定的图片"}, status=400)
 
-        for img in imgs:
-            img.product = product
-            img.draft_key = ""
-            img.save(update_fields=["product","draft_key"])
+        with transaction.atomic():
+            product = Product.objects.create(
+                seller=request.user,
+                device_model_id=device_model_id,
+                category_id=model_category_id,
+                title=ser.validated_data["title"],
+                description=ser.validated_data["description"],
+                estimated_price=r["estimated_mid"],
+                selling_price=selling_price,
+                status="on_sale",
+                original_price=original_price,
+                years_used=years_used,
+                grade_label=grade_label or None,
+                estimated_min=r["estimated_min"],
+                estimated_max=r["estimated_max"],
+                estimated_mid=r["estimated_mid"],
+                market_tag=market_tag,
+                diff_pct=diff_pct,
+                value_score=value_score,
+                condition_data={
+                    "category_id": category_id,
+                    "years_used": years_used,
+                    "original_price": str(original_price),
+                    "grade_label": grade_label,
+                    "defects": defects,
+                    "market_tag": market_tag,
+                    "diff_pct": diff_pct,
+                    "value_score": value_score,
+                },
+                # 先简单映射：成色字段你后面想改成 grade_label 就行
+                quality_grade="B",
+            )
+
+            # 绑定图片：一条 UPDATE 把 draft_key 下图片挂到商品上，并清空 draft_key
+            if not imgs.update(product=product, draft_key=""):
+                # 并发的另一次 publish 已经绑走了图片
+                transaction.set_rollback(True)
+                return Response({"detail": "没有可绑定的图片"}, status=400)
+
+        clear_draft(request.user.id, draft_key)
+        # 与成交价中位数比价（写快照 + Product.market_diff_pct），供大厅“低于市场价”排序
+        MarketComparisonService.refresh(product_ids=[product.id])
 
         return Response({
             "product_id": product.id,
@@ -250,4 +466,4 @@ class DraftPublishAPI(APIView):
             "market_tag": market_tag,
             "diff_pct": diff_pct,
             "value_score": value_score,
-        }, status=201)
\ No newline at end of file
+        }, status=201)
@@ -90,6 +90,35 @@ SIMPLE_JWT = {
     "USER_ID_CLAIM": "user_id",
 }
 
+# 缓存：默认进程内 LocMem（只放可按版本号失效的数据，目录版本号本身存库，见 CatalogVersion）；
+# 多进程部署可换成 "django.core.cache.backends.redis.RedisCache"（LOCATION="redis://127.0.0.1:6379/1"）共享缓存数据
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "second-trade",
+    }
+}
+
+# 类目/品牌/型号接口缓存有效期（秒）；版本号 bump 会让旧缓存立即失效，此值只控制缓存占用
+CATALOG_CACHE_TIMEOUT = 300
+# 目录版本号（库里单行计数器，apps/market/catalog_cache.py）的进程内复查间隔（秒）：其他进程的目录写入最多这么久后可见
+CATALOG_VERSION_CHECK_SECONDS = 1.0
+
+# 草稿主图识别线程池大小（apps/market/analysis.py）
+ANALYSIS_WORKERS = 2
+# 识别结果进程内缓存（按图片内容 sha256，apps/market/recognition_cache.py）
+RECOGNITION_CACHE_SIZE = 2048
+RECOGNITION_CACHE_TTL = 3600
+# 上传图片标准化 / 缩略图进程池大小（apps/market/image_pipeline.py）
+IMAGE_PROCESS_WORKERS = 2
+# 上架草稿服务端状态（ListingDraft 表）保留时长（秒，apps/market/drafts.py），与 gc_draft_images 默认 TTL 一致
+DRAFT_SESSION_TTL = 72 * 3600
+# 待支付订单的支付时限（分钟，apps/market/order_expiry.py），超时由 expire_unpaid_orders 取消并释放商品
+ORDER_PAYMENT_TIMEOUT_MINUTES = 30
+# 成交价聚合的回看窗口（秒，apps/market/market_stats.py）：只处理 complete_time 早于 now - 该值的订单，
+# 完成时间已写入但事务晚提交的订单在此窗口内提交就不会被水位越过
+MARKET_STATS_LOOKBACK_SECONDS = 300
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -15,9 +15,12 @@ export type DraftInitResp = {
 
 export type AnalyzeResp = {
   main_image: string;
+  // 识别任务状态：pending / running 时后端返回 202，尚无识别结果
+  status?: "pending" | "running" | "done" | "failed";
   grade_label: string;
   grade_score: number;
   defects: string[];
+  detail?: string;
 };
 
 export type PublishReq = {
@@ -67,8 +70,26 @@ export async function uploadDraftImages(draftKey: string, files: File[]): Promis
   return results;
 }
 
+// 识别是后端异步任务：POST 入队，排队/识别中返回 202；
+// 之后用 GET ?wait=秒 长轮询，直到 200（done / failed）或超时
+const ANALYZE_WAIT_SECONDS = 5;
+const ANALYZE_TIMEOUT_MS = 60000;
+
 export async function analyzeDraft(draftKey: string): Promise<AnalyzeResp> {
-  const res = await http.post(`/api/market/drafts/${draftKey}/analyze/`);
+  const url = `/api/market/drafts/${draftKey}/analyze/`;
+  let res = await http.post(url);
+  const deadline = Date.now() + ANALYZE_TIMEOUT_MS;
+
+  while (res.status === 202 && Date.now() < deadline) {
+    res = await http.get(url, {
+      params: { wait: ANALYZE_WAIT_SECONDS },
+      // 长轮询会挂起最多 wait 秒，单次请求超时放宽
+      timeout: (ANALYZE_WAIT_SECONDS + 8) * 1000,
+    });
+  }
+
+  if (res.status === 202) throw new Error("识别超时，请稍后重试");
+  if (res.data?.status === "failed") throw new Error(res.data?.detail || "识别失败，请重试");
   return res.data;
 }
 